@@ -0,0 +1,58 @@
+'''
+    Micro-benchmark: pure-Python .git reader vs git subprocess backend
+    Usage: python benchmarks/bench_git_backend.py [repository path] [iterations]
+'''
+# ------------------
+# Importing Modules
+# ------------------
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.realpath(os.path.join(os.path.dirname(__file__), '..')))
+import git_tools #pylint: disable=C0413
+
+def time_backend( function, iterations:int ) -> float:
+    ''' Get mean time in milliseconds of a snapshot query '''
+    start = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    return ( time.perf_counter() - start ) * 1000.0 / iterations
+
+def run_git_benchmark( repository:str, iterations:int ) -> dict:
+    ''' Time both backends inside repository, returns times in milliseconds and snapshots '''
+    cwd = os.getcwd()
+    os.chdir(repository)
+    try:
+        python_snapshot     = git_tools.read_git_snapshot()
+        subprocess_snapshot = git_tools.query_git_snapshot()
+        return {
+            'python_ms'           : time_backend(git_tools.read_git_snapshot , iterations),
+            'subprocess_ms'       : time_backend(git_tools.query_git_snapshot, iterations),
+            'python_snapshot'     : None if python_snapshot is None else python_snapshot.as_dict(),
+            'subprocess_snapshot' : subprocess_snapshot.as_dict(),
+        }
+    finally:
+        os.chdir(cwd)
+
+def main():
+    ''' Run benchmark '''
+    repository = os.path.realpath(sys.argv[1] if len(sys.argv) > 1 else '.')
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    result     = run_git_benchmark(repository, iterations)
+
+    print("Git backend benchmark")
+    print("\tRepository  =", repository)
+    print("\tIterations  =", iterations)
+    print("\tPython      = %8.3f ms" % result['python_ms'])
+    print("\tSubprocess  = %8.3f ms" % result['subprocess_ms'])
+    print("\tSpeed-up    = %8.1fx" % ( result['subprocess_ms'] / max(result['python_ms'], 1e-9) ))
+    if result['python_snapshot'] is None:
+        print("\tPython reader found no repository")
+    elif result['python_snapshot'] != result['subprocess_snapshot']:
+        print("\tSnapshots differ (None means resolved by git describe fallback):")
+        print("\t\tPython     =", result['python_snapshot'])
+        print("\t\tSubprocess =", result['subprocess_snapshot'])
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+'''
+    Startup benchmark of the extra scripts: each case runs in a new interpreter
+    (like each SCons process), with a stand-in SCons.Script module
+    Usage: python benchmarks/bench_startup.py [--repeat 10] [--budget-ms 5]
+    Exit code 1 when a no-op run (the IDE asking for "idedata") takes longer than
+    the budget or imports more than the entry layer.
+'''
+# ------------------
+# Importing Modules
+# ------------------
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+# ------------------
+# Constants
+# ------------------
+REPO_FOLDER        = os.path.realpath(os.path.join(os.path.dirname(__file__), '..'))
+BENCH_FOLDER       = os.path.realpath(os.path.dirname(__file__))
+DEFAULT_REPEAT     = 10
+DEFAULT_BUDGET_MS  = 5.0
+ENTRY_MODULES      = ['script_entry']
+# (name, script or module, command line targets, is a no-op run)
+STARTUP_CASES      = [
+    ('startup_pre_idedata'     , 'pre_extra_script.py' , ['idedata'] , True ),
+    ('startup_post_idedata'    , 'post_extra_script.py', ['idedata'] , True ),
+    ('startup_pre_debug'       , 'pre_extra_script.py' , ['debug']   , True ),
+    ('startup_post_register'   , 'post_extra_script.py', []          , False),
+    ('import_firmware_manager' , 'firmware_manager'    , []          , False),
+]
+# Runs inside the new interpreter: argv is script, targets, repository and benchmarks folders
+CHILD_CODE         = r'''
+import io, os, sys, json, time, types, contextlib
+script, targets, repo_folder, bench_folder = sys.argv[1], sys.argv[2], sys.argv[3], sys.argv[4]
+sys.path[:0] = [repo_folder, bench_folder]
+import fake_env
+env     = fake_env.FakeEnv(PIOENV="bench", BUILD_DIR=os.path.join(repo_folder, ".pio", "build", "bench"))
+exports = {'env': env, 'projenv': env}
+def Import(*names):
+    sys._getframe(1).f_globals.update({x: exports[x] for x in names})
+scons_script = types.ModuleType("SCons.Script")
+scons_script.COMMAND_LINE_TARGETS = [x for x in targets.split(",") if x]
+scons_script.Import = Import
+sys.modules["SCons"] = types.ModuleType("SCons")
+sys.modules["SCons.Script"] = scons_script
+repo_modules = {x[:-3] for x in os.listdir(repo_folder) if x.endswith(".py")}
+# SCons compiled its own SConscripts before, the first compile of a process is slower
+compile(open(fake_env.__file__, encoding='UTF-8').read(), 'warm-up', 'exec')
+before = set(sys.modules)
+with contextlib.redirect_stdout(io.StringIO()):
+    start = time.perf_counter()
+    if script.endswith(".py"):
+        # Like SCons runs SConscripts: compiled from source and executed
+        script_path = os.path.join(repo_folder, script)
+        with open(script_path, 'r', encoding='UTF-8') as file:
+            exec(compile(file.read(), script_path, 'exec'), {'__file__': script_path, '__name__': 'SCons.Script'})
+    else:
+        __import__(script)
+    elapsed = (time.perf_counter() - start) * 1000.0
+print(json.dumps({'ms': elapsed, 'modules': sorted((set(sys.modules) - before) & repo_modules)}))
+'''
+
+# ------------------
+# Functions
+# ------------------
+def time_startup( script:str, targets:list, repeat:int ) -> dict:
+    ''' Run a script (or import a module) in repeat new interpreters '''
+    times   = []
+    modules = []
+    # Installed scripts have their bytecode cached, the first run writes it
+    child_env = {k: v for k, v in os.environ.items() if k != 'PYTHONDONTWRITEBYTECODE'}
+    for i in range(repeat + 1):
+        output = subprocess.run([sys.executable, "-c", CHILD_CODE, script, ",".join(targets),
+                                 REPO_FOLDER, BENCH_FOLDER],
+                                stdout=subprocess.PIPE, check=True, cwd=BENCH_FOLDER, env=child_env).stdout
+        result  = json.loads(output.decode('UTF-8').strip().splitlines()[-1])
+        modules = result['modules']
+        if i > 0:
+            times.append(result['ms'])
+    return {
+        'runs'      : repeat,
+        'min_ms'    : min(times),
+        'median_ms' : statistics.median(times),
+        'mean_ms'   : statistics.mean(times),
+        'modules'   : modules,
+    }
+
+def run_startup_benchmark( repeat:int, add_result=None ) -> list:
+    ''' Time every startup case, returns [(name, is no-op, timing)] '''
+    results = []
+    for name, script, targets, is_noop in STARTUP_CASES:
+        timing = time_startup(script, targets, repeat)
+        results.append( (name, is_noop, timing) )
+        if add_result is not None:
+            add_result(name, {'targets': targets}, {k: v for k, v in timing.items() if k != 'modules'})
+    return results
+
+def main( p_argv=None ) -> int:
+    ''' Run benchmark and check the no-op budget '''
+    parser = argparse.ArgumentParser(description="Startup time of the extra scripts")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="new interpreters per case")
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS,
+                        help="maximum median time of a no-op run")
+    args = parser.parse_args(p_argv)
+
+    print("Extra scripts startup benchmark")
+    failed = 0
+    for name, is_noop, timing in run_startup_benchmark(args.repeat):
+        extra_modules = [x for x in timing['modules'] if x not in ENTRY_MODULES]
+        mark = ""
+        if( is_noop and ( ( timing['median_ms'] > args.budget_ms ) or extra_modules ) ):
+            mark = f"  << OVER BUDGET ({args.budget_ms:g} ms, entry layer only)"
+            failed += 1
+        print(f"\t{name:<26} {timing['median_ms']:8.2f} ms  {len(timing['modules']):2d} modules"
+              f"{' ' + ', '.join(extra_modules) if( is_noop and extra_modules ) else ''}{mark}")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit( main() )
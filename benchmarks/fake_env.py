@@ -0,0 +1,216 @@
+'''
+    Stand-in for the SCons env/projenv objects and a throwaway PlatformIO project,
+    so the scripts can be benchmarked without PlatformIO
+'''
+# ------------------
+# Importing Modules
+# ------------------
+import os
+import re
+import json
+import types
+import subprocess
+
+# ------------------
+# Constants
+# ------------------
+SUBST_REGEX        = re.compile(r'\$\{?([A-Za-z_][A-Za-z0-9_]*)\}?')
+MB                 = 1024 * 1024
+GIT_ENV            = {
+    'GIT_AUTHOR_NAME'     : 'bench', 'GIT_AUTHOR_EMAIL'    : 'bench@localhost',
+    'GIT_COMMITTER_NAME'  : 'bench', 'GIT_COMMITTER_EMAIL' : 'bench@localhost',
+}
+ESPTOOL_UPLOADCMD  = '"$PYTHONEXE" "$UPLOADER" $UPLOADERFLAGS $ESP32_APP_OFFSET $SOURCE'
+OPENOCD_UPLOADCMD  = '$UPLOADER $UPLOADERFLAGS -c "program {$SOURCE} 0x08000000 verify reset; shutdown;"'
+
+# ------------------
+# Fake Environment
+# ------------------
+class FakeEnv(dict):
+    ''' Construction environment with the methods the scripts use '''
+    def __init__(self, options=None, board=None, **values):
+        super().__init__(**values)
+        self.options      = options or {}
+        self.board        = board or {}
+        self.post_actions = []
+        self.pre_actions  = []
+        self.dependencies = []
+
+    def subst(self, value: str) -> str:
+        ''' Expand $VARIABLES recursively '''
+        def _expand(match):
+            found = self.get(match.group(1), '')
+            if isinstance(found, (list, tuple)):
+                return ' '.join(str(x) for x in found)
+            return str(found)
+        for _ in range(10):
+            expanded = SUBST_REGEX.sub(_expand, value)
+            if expanded == value:
+                break
+            value = expanded
+        return value
+
+    def GetOption(self, name): #pylint: disable=C0103,W0613
+        ''' No SCons command line option is set '''
+        return False
+
+    def GetProjectOption(self, option, default=None): #pylint: disable=C0103
+        ''' Get platformio.ini option '''
+        return self.options.get(option, default)
+
+    def BoardConfig(self): #pylint: disable=C0103
+        ''' Board manifest values '''
+        return self.board
+
+    def AddPostAction(self, target, action): #pylint: disable=C0103
+        ''' Record post action '''
+        self.post_actions.append( (target, action) )
+
+    def AddPreAction(self, target, action): #pylint: disable=C0103
+        ''' Record pre action '''
+        self.pre_actions.append( (target, action) )
+
+    def Depends(self, target, dependency): #pylint: disable=C0103
+        ''' Record dependency '''
+        self.dependencies.append( (target, dependency) )
+
+    def Append(self, **values): #pylint: disable=C0103
+        ''' Append to list variables '''
+        for key, value in values.items():
+            self[key] = list(self.get(key, [])) + list(value)
+
+    def BuildSources(self, variant_dir, src_dir): #pylint: disable=C0103
+        ''' Record extra sources '''
+        self.setdefault('PIOBUILDFILES', []).append( (variant_dir, src_dir) )
+
+    def Dump(self): #pylint: disable=C0103
+        ''' Same as SCons Dump() '''
+        return json.dumps(dict(self), indent=4, default=str)
+
+# ------------------
+# Functions
+# ------------------
+def get_scons_modules( targets:list ) -> dict:
+    ''' Stand-in {name: module} of SCons and SCons.Script, with the command line targets '''
+    scons_script = types.ModuleType("SCons.Script")
+    scons_script.COMMAND_LINE_TARGETS = list(targets)
+    return {"SCons": types.ModuleType("SCons"), "SCons.Script": scons_script}
+
+def forget_packaging_jobs( package_scheduler ):
+    ''' Wait for the packaging jobs and forget them, like a new SCons process (new build) '''
+    package_scheduler.join()
+    package_scheduler._JOBS.clear() #pylint: disable=W0212
+
+def run_git( project_dir:str, *args ):
+    ''' Run git inside the project '''
+    subprocess.run(['git'] + list(args), cwd=project_dir, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                   env=dict(os.environ, **GIT_ENV))
+
+def write_synthetic_file( file_path:str, size:int, magic:bytes = b'' ):
+    ''' Write a file half random (incompressible), half repetitive (compressible) like a firmware '''
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    pattern = bytes(range(256)) * 16
+    with open(file_path, 'wb') as file:
+        file.write(magic)
+        written = len(magic)
+        while written < size:
+            chunk = min(MB, size - written)
+            if ( written // MB ) % 2 == 0:
+                file.write( os.urandom(chunk) )
+            else:
+                file.write( (pattern * ( chunk // len(pattern) + 1 ))[:chunk] )
+            written += chunk
+
+def create_tool_package( tool_dir:str, name:str, files:int = 50, file_size:int = 16 * 1024 ):
+    ''' Create a fake tool package tree with a package.json '''
+    os.makedirs(tool_dir, exist_ok=True)
+    with open(os.path.join(tool_dir, "package.json"), 'w', encoding='UTF-8') as file:
+        file.write( json.dumps({'name': name, 'version': '1.0.0'}) )
+    for i in range(files):
+        sub_dir = os.path.join(tool_dir, "scripts" if i % 2 else "lib", f"group{i % 5}")
+        write_synthetic_file(os.path.join(sub_dir, f"file{i:03d}.py"), file_size)
+
+def create_project( project_dir:str, firmware_size:int = MB, commits:int = 1, tags:int = 1,
+                    source_files:int = 20 ):
+    ''' Create a throwaway git project with source files, commits and tags '''
+    os.makedirs(os.path.join(project_dir, "src"), exist_ok=True)
+    os.makedirs(os.path.join(project_dir, "scripts"), exist_ok=True)
+    with open(os.path.join(project_dir, ".gitignore"), 'w', encoding='UTF-8') as file:
+        file.write(".pio\npackages\n")
+    run_git(project_dir, 'init', '-q')
+    for commit in range(max(1, commits)):
+        for i in range(source_files):
+            with open(os.path.join(project_dir, "src", f"module{i:03d}.c"), 'w', encoding='UTF-8') as file:
+                file.write(f"int module{i}_value(void) {{ return {commit}; }}\n")
+        run_git(project_dir, 'add', '-A')
+        run_git(project_dir, 'commit', '-q', '-m', f'commit {commit}')
+        if commit < tags:
+            run_git(project_dir, 'tag', f'v1.0.{commit}')
+    build_dir = os.path.join(project_dir, ".pio", "build", "bench")
+    write_synthetic_file(os.path.join(build_dir, "firmware.bin"), firmware_size)
+    write_synthetic_file(os.path.join(build_dir, "firmware.elf"), firmware_size * 2, b"\x7fELF\x01\x01\x01")
+    write_synthetic_file(os.path.join(build_dir, "bootloader.bin"), 32 * 1024)
+    write_synthetic_file(os.path.join(build_dir, "partitions.bin"), 4 * 1024)
+    return build_dir
+
+def make_esptool_env( project_dir:str, build_dir:str, options=None, board=None ) -> FakeEnv:
+    ''' Create an ESP32 (esptool) env, with its tool package '''
+    tool_dir = os.path.join(project_dir, "packages", "tool-esptoolpy")
+    if not os.path.isdir(tool_dir):
+        create_tool_package(tool_dir, "tool-esptoolpy")
+        write_synthetic_file(os.path.join(tool_dir, "esptool.py"), 128 * 1024)
+    return FakeEnv(
+        options            = options,
+        board              = board,
+        PIOENV             = "bench",
+        BOARD              = "esp32dev",
+        PIOPLATFORM        = "espressif32",
+        PROJECT_DIR        = project_dir,
+        BUILD_DIR          = build_dir,
+        PROGNAME           = "firmware",
+        PROGSUFFIX         = ".elf",
+        PROG_PATH          = "$BUILD_DIR/${PROGNAME}${PROGSUFFIX}",
+        PYTHONEXE          = "python.exe",
+        OBJCOPY            = os.path.join(tool_dir, "esptool.py"),
+        UPLOADER           = os.path.join(tool_dir, "esptool.py"),
+        UPLOAD_PROTOCOL    = "esptool",
+        UPLOAD_SPEED       = "460800",
+        ESP32_APP_OFFSET   = "0x10000",
+        UPLOADERFLAGS      = ["--chip", "esp32", "--port", '"$UPLOAD_PORT"', "--baud", "$UPLOAD_SPEED",
+                              "write_flash", "-z", "0x1000", "$BUILD_DIR/bootloader.bin",
+                              "0x8000", "$BUILD_DIR/partitions.bin"],
+        UPLOADCMD          = ESPTOOL_UPLOADCMD,
+        ENV                = {'PATH': os.environ.get('PATH', '')},
+    )
+
+def make_openocd_env( project_dir:str, build_dir:str, options=None ) -> FakeEnv:
+    ''' Create an STM32 (openocd) env, with its tool package '''
+    tool_dir = os.path.join(project_dir, "packages", "tool-openocd")
+    if not os.path.isdir(tool_dir):
+        create_tool_package(tool_dir, "tool-openocd", files=200)
+        write_synthetic_file(os.path.join(tool_dir, "bin", "openocd"), 4 * MB)
+    return FakeEnv(
+        options            = options,
+        PIOENV             = "bench",
+        BOARD              = "nucleo_f401re",
+        PIOPLATFORM        = "ststm32",
+        PROJECT_DIR        = project_dir,
+        BUILD_DIR          = build_dir,
+        PROGNAME           = "firmware",
+        PROGSUFFIX         = ".elf",
+        PROG_PATH          = "$BUILD_DIR/${PROGNAME}${PROGSUFFIX}",
+        PROGPATH           = os.path.join(build_dir, "firmware.elf"),
+        UPLOADER           = "openocd",
+        UPLOAD_PROTOCOL    = "stlink",
+        UPLOADERFLAGS      = ["-s", os.path.join(tool_dir, "scripts"), "-f", "interface/stlink.cfg",
+                              "-c", "transport select hla_swd", "-f", "target/stm32f4x.cfg"],
+        UPLOADCMD          = OPENOCD_UPLOADCMD,
+        ENV                = {'PATH': os.pathsep.join([os.path.join(tool_dir, "bin"),
+                                                       os.environ.get('PATH', '')])},
+    )
+
+UPLOAD_SHAPES = {
+    'esptool' : make_esptool_env,
+    'openocd' : make_openocd_env,
+}
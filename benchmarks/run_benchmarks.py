@@ -0,0 +1,309 @@
+'''
+    Offline benchmark suite: times the build actions on throwaway projects with
+    synthetic firmware, without PlatformIO, and saves the results as JSON
+    Usage: python benchmarks/run_benchmarks.py [--quick] [--sizes 1 4 16 32] [--shapes esptool openocd]
+                                               [--commits 1 50] [--repeat 3] [--output results.json]
+                                               [--compare previous_results.json] [--threshold 1.25]
+                                               [--replay .pio/env_dumps/<env>/env.json.gz ...]
+'''
+# ------------------
+# Importing Modules
+# ------------------
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import datetime
+import tempfile
+import statistics
+import contextlib
+import subprocess
+
+sys.path.insert(0, os.path.realpath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.insert(0, os.path.realpath(os.path.dirname(__file__)))
+#pylint: disable=C0413
+import fake_env
+import bench_git_backend
+import bench_startup
+import git_tools
+import hash_tools
+import change_tools
+import env_resolver
+import env_snapshot
+import release_tools
+import delta_tools
+import warm_helper
+import package_scheduler
+import firmware_manager as fmw
+
+# ------------------
+# Constants
+# ------------------
+RESULTS_VERSION    = 1
+DEFAULT_SIZES_MB   = [1, 4, 16, 32]
+DEFAULT_COMMITS    = [1, 50]
+DEFAULT_REPEAT     = 3
+DEFAULT_THRESHOLD  = 1.25
+MIN_REGRESSION_MS  = 1.0        # below this difference, timings are noise
+
+# ------------------
+# Functions
+# ------------------
+def time_call( function, repeat:int, setup=None ) -> dict:
+    ''' Time function (stdout silenced), calling setup untimed before each run '''
+    times = []
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            if setup is not None:
+                setup()
+            start = time.perf_counter()
+            function()
+            times.append( ( time.perf_counter() - start ) * 1000.0 )
+    return {
+        'runs'      : repeat,
+        'min_ms'    : min(times),
+        'median_ms' : statistics.median(times),
+        'mean_ms'   : statistics.mean(times),
+    }
+
+def forget_caches():
+    ''' Forget in-process caches, like a new SCons process would '''
+    fake_env.forget_packaging_jobs(package_scheduler)
+    hash_tools.clear_digest_cache()
+    env_resolver.clear_resolver_cache()
+    git_tools.get_git_snapshot(refresh=True)
+
+def bench_release( root:str, shape:str, size_mb:int, repeat:int, add_result ):
+    ''' Time build actions of one upload shape and firmware size '''
+    project_dir = os.path.join(root, f"{shape}-{size_mb}mb")
+    build_dir   = fake_env.create_project(project_dir, size_mb * fake_env.MB)
+    env         = fake_env.UPLOAD_SHAPES[shape](project_dir, build_dir)
+    params      = {'shape': shape, 'firmware_mb': size_mb}
+    os.chdir(project_dir)
+
+    def _cold():
+        forget_caches()
+        shutil.rmtree(fmw.RELEASE_OUTPUT_FOLDER, ignore_errors=True)
+        shutil.rmtree(os.path.join(fmw.get_path_to_platform(), fmw.TOOL_CACHE_FOLDER), ignore_errors=True)
+
+    def _new_zip():
+        forget_caches()
+        if os.path.exists(zip_path):
+            os.remove(zip_path)
+
+    zip_path = os.path.join(root, "zipdir.zip")
+    add_result('pre_build_action', params,
+               time_call(lambda: fmw.pre_build_action(None, None, env), repeat, forget_caches))
+    add_result('move_bin_files', params,
+               time_call(lambda: fmw.move_bin_files(env, release_tools.ReleaseManifest()), repeat, _cold))
+    add_result('post_build_action_cold', params,
+               time_call(lambda: fmw.post_build_action(None, None, env), repeat, _cold))
+    add_result('post_build_action_warm', params,
+               time_call(lambda: fmw.post_build_action(None, None, env), repeat, forget_caches))
+    add_result('zipdir', params,
+               time_call(lambda: fmw.zipdir(zip_path, build_dir), repeat, _new_zip))
+
+    # Next release: some bytes inserted and some changed
+    old_image  = os.path.join(build_dir, "firmware.bin")
+    new_image  = os.path.join(root, "firmware_next.bin")
+    delta_path = os.path.join(root, "firmware.delta")
+    with open(old_image, 'rb') as file:
+        image = bytearray(file.read())
+    image[len(image) // 3 : len(image) // 3] = b"new code" * 64
+    image[len(image) // 2 : len(image) // 2 + 256] = os.urandom(256)
+    with open(new_image, 'wb') as file:
+        file.write(image)
+    add_result('delta_create', params,
+               time_call(lambda: delta_tools.create_delta(old_image, new_image, delta_path), repeat))
+    add_result('delta_apply', params,
+               time_call(lambda: delta_tools.apply_delta(old_image, delta_path, new_image), repeat))
+
+def bench_upload_wait( root:str, repeat:int, add_result ):
+    ''' Time until the upload starts after linking, packaging before it or in background '''
+    project_dir = os.path.join(root, "upload-wait")
+    build_dir   = fake_env.create_project(project_dir, 4 * fake_env.MB)
+    env         = fake_env.UPLOAD_SHAPES['esptool'](project_dir, build_dir)
+    os.chdir(project_dir)
+
+    def _new_build():
+        forget_caches()
+        shutil.rmtree(fmw.RELEASE_OUTPUT_FOLDER, ignore_errors=True)
+
+    try:
+        # Background packaging only overlaps "pio run -t upload"
+        sys.modules.update( fake_env.get_scons_modules(["upload"]) )
+        for mode in [package_scheduler.PACKAGING_MODE_SYNC, package_scheduler.PACKAGING_MODE_BACKGROUND]:
+            os.environ['NAVITAS_RELEASE_PACKAGING'] = mode
+            add_result('post_build_action_until_upload', {'packaging': mode},
+                       time_call(lambda: fmw.post_build_action(None, None, env), repeat, _new_build))
+            with contextlib.redirect_stdout(io.StringIO()):
+                fake_env.forget_packaging_jobs(package_scheduler)
+    finally:
+        for name in fake_env.get_scons_modules([]):
+            sys.modules.pop(name, None)
+        os.environ['NAVITAS_RELEASE_PACKAGING'] = package_scheduler.PACKAGING_MODE_SYNC
+
+def bench_warm_helper( root:str, repeat:int, add_result ):
+    ''' Time build actions answered by the warm helper against in-process work '''
+    project_dir = os.path.join(root, "warm-helper")
+    build_dir   = fake_env.create_project(project_dir, 4 * fake_env.MB)
+    env         = fake_env.UPLOAD_SHAPES['esptool'](project_dir, build_dir)
+    os.chdir(project_dir)
+    helper = subprocess.Popen([sys.executable, warm_helper.__file__, "serve", "--idle", "60"],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
+    try:
+        for _ in range(50):
+            if os.path.exists(warm_helper.HELPER_SOCKET_FILE):
+                break
+            time.sleep(0.1)
+        for served_by, enabled in [('in_process', False), ('warm_helper', True)]:
+            warm_helper.configure(enabled)
+            params = {'served_by': served_by}
+            # First build fills the helper state, like the previous build of an edit-build cycle
+            with contextlib.redirect_stdout(io.StringIO()):
+                fmw.pre_build_action(None, None, env)
+                fmw.post_build_action(None, None, env)
+            add_result('post_build_action', params,
+                       time_call(lambda: fmw.post_build_action(None, None, env), repeat, forget_caches))
+            add_result('pre_build_action', params,
+                       time_call(lambda: fmw.pre_build_action(None, None, env), repeat, forget_caches))
+        warm_helper.request("stop")
+    finally:
+        warm_helper.configure(False)
+        helper.wait(timeout=10)
+
+def bench_replay( snapshot_path:str, repeat:int, add_result ):
+    ''' Time release file collection of a real env, replayed from its snapshot or env dump '''
+    env    = env_snapshot.load_env_snapshot(snapshot_path)
+    params = {'replay': env.get('PIOENV', os.path.basename(snapshot_path))}
+    add_result('resolve_uploadcmd', params,
+               time_call(lambda: env_resolver.resolve_env_value(env, env['UPLOADCMD'], True),
+                         repeat, forget_caches))
+    add_result('move_bin_files', params,
+               time_call(lambda: fmw.move_bin_files(env, release_tools.ReleaseManifest()),
+                         repeat, forget_caches))
+
+def bench_git( root:str, commits:int, repeat:int, add_result ):
+    ''' Time git queries on a repository with commits and tags '''
+    project_dir = os.path.join(root, f"git-{commits}")
+    fake_env.create_project(project_dir, 64 * 1024, commits=commits, tags=max(1, commits // 10),
+                            source_files=200)
+    params = {'commits': commits}
+    os.chdir(project_dir)
+
+    backends = bench_git_backend.run_git_benchmark(project_dir, max(5, repeat))
+    add_result('git_snapshot_python', params, {'runs': max(5, repeat), 'median_ms': backends['python_ms']})
+    add_result('git_snapshot_subprocess', params,
+               {'runs': max(5, repeat), 'median_ms': backends['subprocess_ms']})
+    add_result('get_git_snapshot', params,
+               time_call(lambda: git_tools.get_git_snapshot(refresh=True), repeat))
+
+    def _no_pending_cache():
+        if os.path.exists(change_tools.CHANGE_CACHE_FILE):
+            os.remove(change_tools.CHANGE_CACHE_FILE)
+
+    add_result('get_files_pending_commit_cold', params,
+               time_call(change_tools.get_files_pending_commit, repeat, _no_pending_cache))
+    add_result('get_files_pending_commit_warm', params,
+               time_call(change_tools.get_files_pending_commit, repeat))
+
+def compare_results( results:dict, previous_path:str, threshold:float ) -> int:
+    ''' Print median time ratio against previous results, returns number of regressions '''
+    with open(previous_path, 'r', encoding='UTF-8') as file:
+        previous = json.loads(file.read())
+    def _key(result):
+        return result['name'] + json.dumps(result['params'], sort_keys=True)
+    previous_medians = {_key(x): x['median_ms'] for x in previous.get('results', [])}
+    regressions = 0
+    print(f"\nComparison against {previous_path} (regression above {threshold:g}x)")
+    for result in results['results']:
+        old_ms = previous_medians.get(_key(result))
+        if old_ms is None:
+            continue
+        ratio = result['median_ms'] / max(old_ms, 1e-9)
+        mark  = ""
+        if( ( ratio > threshold ) and ( result['median_ms'] - old_ms > MIN_REGRESSION_MS ) ):
+            mark = "  << REGRESSION"
+            regressions += 1
+        print(f"\t{result['name']:<32} {json.dumps(result['params']):<40} "
+              f"{old_ms:10.2f} -> {result['median_ms']:10.2f} ms ({ratio:5.2f}x){mark}")
+    return regressions
+
+def main( p_argv=None ) -> int:
+    ''' Run benchmarks '''
+    parser = argparse.ArgumentParser(description="Offline benchmark of the Navitas PlatformIO scripts")
+    parser.add_argument("--quick", action="store_true", help="1 MB firmware, 1 commit, 1 run")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES_MB,
+                        help="firmware sizes in MB")
+    parser.add_argument("--shapes", nargs="+", default=list(fake_env.UPLOAD_SHAPES),
+                        choices=list(fake_env.UPLOAD_SHAPES), help="upload command shapes")
+    parser.add_argument("--commits", type=int, nargs="+", default=DEFAULT_COMMITS,
+                        help="commits of the git benchmark repositories")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="runs of each benchmark")
+    parser.add_argument("--output", default="bench_results.json", help="results JSON file")
+    parser.add_argument("--compare", help="previous results JSON file")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="slow-down ratio reported as regression")
+    parser.add_argument("--keep", action="store_true", help="keep the throwaway projects")
+    parser.add_argument("--replay", nargs="+", default=[],
+                        help="navitas_env.json or custom_env_dump files of real envs, "
+                             "replayed from the current project folder")
+    args = parser.parse_args(p_argv)
+    if args.quick:
+        args.sizes, args.commits, args.repeat = [1], [1], 1
+    output_path = os.path.realpath(args.output)
+    cwd         = os.getcwd()
+    root        = tempfile.mkdtemp(prefix="navitas_bench_")
+
+    # Keep everything inside the throwaway folder
+    os.environ['PLATFORMIO_CORE_DIR']       = os.path.join(root, "platformio")
+    os.environ['NAVITAS_RUN_ID']            = f"bench-{os.getpid()}"
+    os.environ['NAVITAS_FMW_UPDATE_POLICY'] = "always"
+    # Build actions are timed with the packaging they trigger
+    os.environ['NAVITAS_RELEASE_PACKAGING'] = package_scheduler.PACKAGING_MODE_SYNC
+
+    results = {
+        'version' : RESULTS_VERSION,
+        'meta'    : {
+            'date'     : datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'python'   : platform.python_version(),
+            'platform' : platform.platform(),
+            'cpus'     : os.cpu_count(),
+            'args'     : {k: v for k, v in vars(args).items() if k not in ['output', 'compare', 'replay']},
+        },
+        'results' : [],
+    }
+    def _add_result(name, params, timing):
+        results['results'].append( dict(name=name, params=params, **timing) )
+        print(f"\t{name:<32} {json.dumps(params):<40} {timing['median_ms']:10.2f} ms")
+
+    print("Navitas scripts benchmark, working in", root)
+    try:
+        for snapshot_path in args.replay:
+            bench_replay(os.path.realpath(snapshot_path), args.repeat, _add_result)
+        for shape in args.shapes:
+            for size_mb in args.sizes:
+                bench_release(root, shape, size_mb, args.repeat, _add_result)
+        for commits in args.commits:
+            bench_git(root, commits, args.repeat, _add_result)
+        bench_warm_helper(root, args.repeat, _add_result)
+        bench_upload_wait(root, args.repeat, _add_result)
+        bench_startup.run_startup_benchmark(max(3, args.repeat), _add_result)
+    finally:
+        os.chdir(cwd)
+        if not args.keep:
+            shutil.rmtree(root, ignore_errors=True)
+
+    with open(output_path, 'w', encoding='UTF-8') as file:
+        file.write( json.dumps(results, indent=4) )
+    print("Results saved to", output_path)
+    if args.compare:
+        return 1 if compare_results(results, args.compare, args.threshold) else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit( main() )
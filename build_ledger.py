@@ -0,0 +1,181 @@
+'''
+    PlatformIO Advanced Script for NavitasTecnologia
+    See: https://docs.platformio.org/en/latest/scripting/actions.html
+
+    Build ledger: SQLite database (stdlib) with every firmware info state and
+    every packaged build of every env: info fields, artifact digests and sizes,
+    release zip, phase timings and memory footprint.
+'''
+# pylint: disable=broad-except
+# ------------------
+# Importing Modules
+# ------------------
+import os
+import json
+import time
+import sqlite3
+import contextlib
+
+# ------------------
+# Constants
+# ------------------
+LEDGER_FILE            = ".pio/navitas_ledger.db"
+LEDGER_SCHEMA_VERSION  = 2
+LEDGER_TIMEOUT         = 30     # seconds waiting for another env writing the ledger
+LEDGER_SCHEMA          = '''
+CREATE TABLE IF NOT EXISTS fmw_info (
+    id           INTEGER PRIMARY KEY,
+    created      REAL    NOT NULL,
+    version      TEXT    NOT NULL,
+    git_commit   TEXT    NOT NULL,
+    info_json    TEXT    NOT NULL
+);
+CREATE TABLE IF NOT EXISTS builds (
+    id           INTEGER PRIMARY KEY,
+    created      REAL    NOT NULL,
+    env          TEXT    NOT NULL,
+    board        TEXT    NOT NULL,
+    version      TEXT    NOT NULL,
+    version_name TEXT    NOT NULL,
+    git_commit   TEXT    NOT NULL,
+    git_branch   TEXT    NOT NULL,
+    build_epoch  INTEGER,
+    zip_name     TEXT,
+    zip_size     INTEGER,
+    info_json    TEXT    NOT NULL
+);
+CREATE TABLE IF NOT EXISTS artifacts (
+    build_id     INTEGER NOT NULL REFERENCES builds(id) ON DELETE CASCADE,
+    name         TEXT    NOT NULL,
+    size         INTEGER NOT NULL,
+    sha256       TEXT    NOT NULL,
+    md5          TEXT
+);
+CREATE TABLE IF NOT EXISTS phases (
+    build_id     INTEGER NOT NULL REFERENCES builds(id) ON DELETE CASCADE,
+    name         TEXT    NOT NULL,
+    wall_ms      REAL    NOT NULL,
+    subprocesses INTEGER,
+    read_bytes   INTEGER,
+    write_bytes  INTEGER
+);
+CREATE TABLE IF NOT EXISTS footprints (
+    build_id     INTEGER NOT NULL REFERENCES builds(id) ON DELETE CASCADE,
+    flash        INTEGER NOT NULL,
+    ram          INTEGER NOT NULL,
+    report_json  TEXT    NOT NULL
+);
+CREATE INDEX IF NOT EXISTS fmw_info_version   ON fmw_info(version);
+CREATE INDEX IF NOT EXISTS builds_env         ON builds(env, created);
+CREATE INDEX IF NOT EXISTS builds_version     ON builds(version);
+CREATE INDEX IF NOT EXISTS builds_commit      ON builds(git_commit);
+CREATE INDEX IF NOT EXISTS builds_board       ON builds(board);
+CREATE INDEX IF NOT EXISTS artifacts_build    ON artifacts(build_id);
+CREATE INDEX IF NOT EXISTS artifacts_sha256   ON artifacts(sha256);
+CREATE INDEX IF NOT EXISTS phases_build       ON phases(build_id);
+CREATE INDEX IF NOT EXISTS footprints_build   ON footprints(build_id);
+'''
+
+# ------------------
+# Functions
+# ------------------
+def _clean_commit( commit:str ) -> str:
+    ''' Commit hash without the quotes of firmware info '''
+    return str(commit or '').replace("'", "").strip()
+
+@contextlib.contextmanager
+def open_ledger( p_ledger_path:str = LEDGER_FILE ):
+    ''' Open (creating if needed) the ledger, committing on success and rolling back on error '''
+    os.makedirs(os.path.dirname(os.path.abspath(p_ledger_path)), exist_ok=True)
+    conn = sqlite3.connect(p_ledger_path, timeout=LEDGER_TIMEOUT)
+    try:
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA foreign_keys = ON")
+        if conn.execute("PRAGMA user_version").fetchone()[0] != LEDGER_SCHEMA_VERSION:
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.executescript(LEDGER_SCHEMA)
+            conn.execute(f"PRAGMA user_version = {LEDGER_SCHEMA_VERSION}")
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+def record_fmw_info( info:dict, p_ledger_path:str = LEDGER_FILE ) -> int:
+    ''' Record a new firmware info state, returns its id '''
+    with open_ledger(p_ledger_path) as conn:
+        cursor = conn.execute(
+            "INSERT INTO fmw_info (created, version, git_commit, info_json) VALUES (?, ?, ?, ?)",
+            ( time.time(), info.get('Version', ''), _clean_commit(info.get('GIT_Commit')),
+              json.dumps(info, sort_keys=True) ) )
+        return cursor.lastrowid
+
+def record_build( info:dict, version_name:str, artifacts:dict, phases:list = None,
+                  zip_path:str = None, footprint:dict = None, p_ledger_path:str = LEDGER_FILE ) -> int:
+    ''' Record a packaged build: artifacts is {name: hash_tools digests}, phases are perf_tools
+        records and footprint is an elf_tools footprint '''
+    with open_ledger(p_ledger_path) as conn:
+        cursor = conn.execute(
+            "INSERT INTO builds (created, env, board, version, version_name, git_commit, git_branch, "
+            "build_epoch, zip_name, zip_size, info_json) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            ( time.time(), info.get('PIOENV', ''), info.get('Board', ''), info.get('Version', ''),
+              version_name, _clean_commit(info.get('GIT_Commit')), info.get('GIT_Branch', ''),
+              info.get('build_epoch'),
+              None if zip_path is None else os.path.basename(zip_path),
+              os.path.getsize(zip_path) if( ( zip_path is not None ) and os.path.isfile(zip_path) ) else None,
+              json.dumps(info, sort_keys=True) ) )
+        build_id = cursor.lastrowid
+        conn.executemany(
+            "INSERT INTO artifacts (build_id, name, size, sha256, md5) VALUES (?, ?, ?, ?, ?)",
+            [ (build_id, name, x['size'], x['sha256'], x.get('md5')) for name, x in artifacts.items() ] )
+        conn.executemany(
+            "INSERT INTO phases (build_id, name, wall_ms, subprocesses, read_bytes, write_bytes) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            [ (build_id, x['name'], x['wall_ms'], x.get('subprocesses'), x.get('read_bytes'),
+               x.get('write_bytes')) for x in (phases or []) ] )
+        if footprint is not None:
+            conn.execute(
+                "INSERT INTO footprints (build_id, flash, ram, report_json) VALUES (?, ?, ?, ?)",
+                ( build_id, footprint['flash'], footprint['ram'], json.dumps(footprint) ) )
+        return build_id
+
+def find_builds( env_name:str = None, commit:str = None, version:str = None, limit:int = 20,
+                 p_ledger_path:str = LEDGER_FILE ) -> list:
+    ''' Get builds (newest first) of an env, a commit (or its prefix) and/or a version '''
+    query  = "SELECT * FROM builds WHERE 1"
+    params = []
+    if env_name:
+        query += " AND env = ?"
+        params.append( env_name.replace("-","_").upper() )
+    if commit:
+        query += " AND git_commit LIKE ?"
+        params.append( _clean_commit(commit) + "%" )
+    if version:
+        query += " AND version = ?"
+        params.append(version)
+    query += " ORDER BY created DESC LIMIT ?"
+    params.append(limit)
+    with open_ledger(p_ledger_path) as conn:
+        return [dict(x) for x in conn.execute(query, params)]
+
+def get_size_trend( env_name:str, artifact:str, limit:int = 100, p_ledger_path:str = LEDGER_FILE ) -> list:
+    ''' Get (created, version_name, size, total phase ms) of the last builds of an env, oldest first.
+        artifact is a binary name (e.g. firmware.bin), or "flash"/"ram" for the .elf footprint '''
+    if artifact in ['flash', 'ram']:
+        size_join = f"JOIN (SELECT build_id, {artifact} AS size FROM footprints) a ON a.build_id = b.id"
+        params    = ( env_name.replace("-","_").upper(), limit )
+    else:
+        size_join = "JOIN artifacts a ON a.build_id = b.id AND a.name = ?"
+        params    = ( artifact, env_name.replace("-","_").upper(), limit )
+    with open_ledger(p_ledger_path) as conn:
+        rows = conn.execute(
+            "SELECT b.created, b.version_name, a.size, "
+            "(SELECT SUM(p.wall_ms) FROM phases p WHERE p.build_id = b.id AND p.name NOT LIKE '%/%') "
+            f"FROM builds b {size_join} "
+            "WHERE b.env = ? ORDER BY b.created DESC LIMIT ?", params ).fetchall()
+    return [tuple(x) for x in reversed(rows)]
+
+def get_fmw_info_history( limit:int = 20, p_ledger_path:str = LEDGER_FILE ) -> list:
+    ''' Get firmware info states, newest first '''
+    with open_ledger(p_ledger_path) as conn:
+        rows = conn.execute("SELECT info_json FROM fmw_info ORDER BY id DESC LIMIT ?", (limit,))
+        return [json.loads(x[0]) for x in rows]
@@ -0,0 +1,239 @@
+'''
+    PlatformIO Advanced Script for NavitasTecnologia
+    See: https://docs.platformio.org/en/latest/scripting/actions.html
+
+    Incremental replacement for "git ls-files -m --others --exclude-standard".
+    A stat cache (mtime, size, inode) of every tracked file is kept under .pio/,
+    together with the blob SHA1 git has in the index. Only files whose stat
+    changed are re-hashed, and only directories whose mtime changed are
+    re-scanned for untracked files (every directory that is not ignored is
+    watched, a file created in an empty one changes only its mtime).
+'''
+# pylint: disable=broad-except
+# ------------------
+# Importing Modules
+# ------------------
+import os
+import json
+import time
+from hashlib import sha1
+import git_tools
+import warm_helper
+
+# ------------------
+# Constants
+# ------------------
+CHANGE_CACHE_FILE    = ".pio/pending_commit_cache.json"
+CHANGE_CACHE_VERSION = 2
+MAX_DIRS_TO_RESCAN   = 200
+GIT_MODE_GITLINK     = "160000"
+RACY_DIR_NS          = 50 * 1000 * 1000  # directories changed this recently are scanned again
+
+# Caches kept by a long-running process (warm helper), {cache file: cache}
+_MEMORY_CACHE = {}
+
+# ------------------
+# Functions
+# ------------------
+def get_files_pending_commit( cache_file=CHANGE_CACHE_FILE, keep_in_memory=False ):
+    ''' Get list of files pending commit, same as git_tools.get_files_pending_commit.
+        keep_in_memory: reuse the cache of the previous call instead of reading and writing
+        cache_file (the file is still validated by stat when read again, only slower) '''
+    if cache_file == CHANGE_CACHE_FILE:
+        warm = warm_helper.request("pending_files")
+        if warm is not None:
+            return warm
+    try:
+        cache = _MEMORY_CACHE.get(cache_file) if keep_in_memory else None
+        if( ( cache is not None ) and ( cache['state'] == _get_repository_state() ) ):
+            _incremental_scan(cache)
+            return _get_pending_list(cache)
+        cache = _load_cache(cache_file)
+        if cache is None:
+            cache = _full_scan()
+        else:
+            _incremental_scan(cache)
+        _save_cache(cache_file, cache)
+        if keep_in_memory:
+            _MEMORY_CACHE[cache_file] = cache
+        return _get_pending_list(cache)
+    except Exception as excep:
+        print(f'Incremental change detection failed. Reason: {excep}')
+    return git_tools.get_files_pending_commit()
+
+def get_git_blob_sha1( file_path:str, normalize_eol=False ) -> str:
+    ''' Hash file content the same way git hashes a blob '''
+    if os.path.islink(file_path):
+        content = os.readlink(file_path).encode()
+    else:
+        with open(file_path, 'rb') as file:
+            content = file.read()
+    if normalize_eol:
+        content = content.replace(b'\r\n', b'\n')
+    blob_hash = sha1( b'blob %d\0' % len(content) )
+    blob_hash.update(content)
+    return blob_hash.hexdigest()
+
+def _get_stat( path:str ):
+    ''' Get [mtime_ns, size, inode] or None if the file does not exist '''
+    try:
+        stat = os.lstat(path)
+    except OSError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size, stat.st_ino]
+
+def _get_repository_state():
+    ''' Get values that invalidate the whole cache: HEAD, index and exclude files '''
+    found = git_tools.find_git_dir()
+    if found is None:
+        return None
+    _, git_dir, common_dir = found
+    snapshot      = git_tools.read_git_snapshot()
+    excludes_file = git_tools.get_excludes_file(common_dir)
+    return {
+        'version'       : CHANGE_CACHE_VERSION,
+        'cwd'           : os.getcwd(),
+        'head'          : snapshot.commit if snapshot is not None else '',
+        'index'         : _get_stat( os.path.join(git_dir, 'index') ),
+        'exclude'       : _get_stat( os.path.join(common_dir, 'info', 'exclude') ),
+        'excludes_file' : [excludes_file, _get_stat(excludes_file)],
+    }
+
+def _load_cache( cache_file:str ):
+    ''' Load cache, or None when it is missing or invalidated '''
+    if not os.path.isfile(cache_file):
+        return None
+    with open(cache_file, 'r', encoding='UTF-8') as file:
+        cache = json.loads(file.read())
+    state = _get_repository_state()
+    if( ( state is None ) or ( cache.get('state') != state ) ):
+        return None
+    return cache
+
+def _save_cache( cache_file:str, cache:dict ):
+    ''' Save cache atomically '''
+    os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+    tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+    with open(tmp_file, 'w', encoding='UTF-8') as file:
+        file.write( json.dumps(cache) )
+    os.replace(tmp_file, cache_file)
+
+def _ls_files( args ):
+    ''' Run "git ls-files -z" and split its output '''
+    return_code, out = git_tools._run_git(['ls-files', '-z'] + args) #pylint: disable=W0212
+    if return_code != 0:
+        raise RuntimeError('git ls-files ' + ' '.join(args) + ' failed')
+    return [x for x in out.split('\0') if x != '']
+
+def _to_git_path( path:str ) -> str:
+    ''' Relative path with "/" separators, "." for the current directory '''
+    return os.path.normpath(path).replace('\\', '/')
+
+def _get_ignored_dirs( roots ) -> set:
+    ''' Get directories under roots matched by an ignore rule ("ls-files --ignored --directory"
+        would also list directories holding only ignored files, where a new file is not ignored) '''
+    # Without optional locks, status does not refresh the index (its stat is part of the state)
+    return_code, out = git_tools._run_git(['--no-optional-locks', 'status', '--porcelain', '-z', #pylint: disable=W0212
+                                           '--ignored=matching', '--untracked-files=normal', '--'] + roots)
+    if return_code != 0:
+        raise RuntimeError('git status --ignored=matching failed')
+    # Porcelain paths are relative to the repository root, not to a project in a sub-directory
+    prefix = _to_git_path( os.path.relpath(os.path.realpath('.'), git_tools.find_git_dir()[0]) )
+    prefix = '' if prefix == '.' else prefix + '/'
+    return {_to_git_path(x[3 + len(prefix):]) for x in out.split('\0')
+            if( x.startswith('!! ' + prefix) and x.endswith('/') )}
+
+def _record_dirs( cache:dict, roots ):
+    ''' Record the mtime of every directory under roots that is not ignored, nor a repository
+        of its own. Directories changed too recently to trust their mtime are recorded as None '''
+    ignored = _get_ignored_dirs(roots)
+    racy_ns = time.time_ns() - RACY_DIR_NS
+    for root in roots:
+        for dir_path, dir_names, _ in os.walk(root):
+            stat = _get_stat(dir_path)
+            if stat is not None:
+                cache['dirs'][_to_git_path(dir_path)] = stat[0] if stat[0] < racy_ns else None
+            dir_names[:] = [x for x in dir_names if( ( x != '.git' )
+                            and ( _to_git_path(os.path.join(dir_path, x)) not in ignored )
+                            and ( not os.path.lexists(os.path.join(dir_path, x, '.git')) ) )]
+
+def _full_scan() -> dict:
+    ''' Build cache from scratch, trusting git for the first answer '''
+    state    = _get_repository_state()
+    pending  = set( _ls_files(['-m', '--others', '--exclude-standard']) )
+    tracked  = {}
+    for line in _ls_files(['-s']):
+        info, _, path = line.partition('\t')
+        mode, blob_sha = info.split()[:2]
+        if mode == GIT_MODE_GITLINK:
+            # Submodules keep the state git reported
+            blob_sha = ''
+        tracked[path] = [blob_sha, _get_stat(path), path in pending]
+    cache = {
+        'state'     : state,
+        'tracked'   : tracked,
+        'untracked' : sorted(x for x in pending if x not in tracked),
+        'dirs'      : {},
+    }
+    _record_dirs(cache, ['.'])
+    return cache
+
+def _incremental_scan( cache:dict ):
+    ''' Re-hash files whose stat changed and re-scan directories whose mtime changed '''
+    # Tracked files
+    for path, entry in cache['tracked'].items():
+        stat = _get_stat(path)
+        if( ( stat == entry[1] ) or ( entry[0] == '' ) ):
+            continue
+        entry[1] = stat
+        if os.path.basename(path) == '.gitignore':
+            # Ignore rules changed, every untracked file must be listed again
+            cache['dirs'] = {'.': None}
+        if stat is None:
+            entry[2] = True
+            continue
+        entry[2] = get_git_blob_sha1(path) != entry[0]
+        if entry[2]:
+            # core.autocrlf checkouts store LF in the blob
+            entry[2] = get_git_blob_sha1(path, normalize_eol=True) != entry[0]
+
+    # Untracked files
+    changed_dirs = []
+    for dir_i, mtime in cache['dirs'].items():
+        stat = _get_stat(dir_i)
+        if( ( stat is None ) or ( stat[0] != mtime ) ):
+            changed_dirs.append(dir_i)
+    untracked = [x for x in cache['untracked'] if os.path.lexists(x)]
+    if len(changed_dirs) > 0:
+        if( ( '.' in changed_dirs ) or ( len(changed_dirs) > MAX_DIRS_TO_RESCAN ) ):
+            changed_dirs = ['.']
+        # Sub-directories are scanned with their parent, and re-recorded (or dropped) after
+        changed_dirs = [x for x in changed_dirs if not _has_parent_in(x, changed_dirs)]
+        cache['dirs'] = {k: v for k, v in cache['dirs'].items() if not _has_parent_in(k, changed_dirs, True)}
+        changed_dirs = [x for x in changed_dirs if os.path.isdir(x)]
+        prefixes = tuple( '' if x == '.' else x + '/' for x in changed_dirs )
+        untracked = [x for x in untracked if not x.startswith(prefixes)]
+        if len(changed_dirs) > 0:
+            found = _ls_files(['--others', '--exclude-standard', '--'] + changed_dirs)
+            untracked = sorted( set(untracked + found) )
+            if any(os.path.basename(x) == '.gitignore' for x in found):
+                return _reset_cache(cache)
+            _record_dirs(cache, changed_dirs)
+    cache['untracked'] = untracked
+    return cache
+
+def _has_parent_in( path:str, dirs, or_self=False ) -> bool:
+    ''' Check if one of dirs (git paths) holds path, or is path when or_self '''
+    return any( ( ( x == '.' ) and ( path != '.' ) ) or path.startswith(x + '/')
+                or ( or_self and ( x == path ) ) for x in dirs )
+
+def _reset_cache( cache:dict ) -> dict:
+    ''' Replace cache content with a full scan '''
+    cache.clear()
+    cache.update( _full_scan() )
+    return cache
+
+def _get_pending_list( cache:dict ):
+    ''' Get files pending commit in "git ls-files" order '''
+    pending = [path for path, entry in cache['tracked'].items() if entry[2]]
+    return sorted( pending + cache['untracked'] )
@@ -0,0 +1,264 @@
+'''
+    PlatformIO Advanced Script for NavitasTecnologia
+    See: https://docs.platformio.org/en/latest/scripting/actions.html
+
+    Binary delta between two firmware images, standalone (bundled in release zips).
+    Usage: python delta_tools.py diff   <old image> <new image> <delta file>
+           python delta_tools.py apply  <old image> <delta file> <new image>
+           python delta_tools.py verify <old image> <delta file>
+
+    Delta format: header (magic, source sha256, source size, target sha256,
+    target size) followed by a zlib stream of records:
+        COPY   <u32 length> <u32 source offset> <length bytes: target XOR source>
+        INSERT <u32 length> <length bytes>
+        END
+    XOR data of nearly equal blocks is mostly zeros, so zlib shrinks it to almost nothing.
+'''
+# pylint: disable=broad-except
+# ------------------
+# Importing Modules
+# ------------------
+import os
+import sys
+import zlib
+import struct
+import hashlib
+
+# ------------------
+# Constants
+# ------------------
+DELTA_MAGIC          = b"NAVDELTA"
+DELTA_VERSION        = 1
+DELTA_HEADER         = struct.Struct("<8sH32sQ32sQ")
+RECORD_HEADER        = struct.Struct("<BII")
+RECORD_END           = 0
+RECORD_COPY          = 1
+RECORD_INSERT        = 2
+BLOCK_SIZE           = 32       # bytes hashed to find matches
+INDEX_STEP           = 32       # source is indexed every INDEX_STEP bytes
+PROBE_STEP           = 33       # target is probed every PROBE_STEP bytes (coprime with INDEX_STEP)
+MAX_MISMATCH_BLOCKS  = 8        # mismatching blocks tolerated inside a COPY (XOR keeps them small)
+CHUNK_SIZE           = 64 * 1024
+COMPRESSION_LEVEL    = 6
+
+# ------------------
+# Functions
+# ------------------
+def _xor( data_a:bytes, data_b:bytes ) -> bytes:
+    ''' XOR two byte strings of the same length '''
+    value = int.from_bytes(data_a, 'little') ^ int.from_bytes(data_b, 'little')
+    return value.to_bytes(len(data_a), 'little')
+
+def _file_sha256( file_path:str ) -> bytes:
+    ''' SHA-256 digest of a file '''
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.digest()
+
+def _index_source( source:bytes ) -> dict:
+    ''' Map hash of the block at every INDEX_STEP offset to its offset '''
+    index = {}
+    for offset in range(0, len(source) - BLOCK_SIZE + 1, INDEX_STEP):
+        index.setdefault( hash(source[offset : offset + BLOCK_SIZE]), offset )
+    return index
+
+def _extend_forward( source:bytes, target:bytes, src_pos:int, tgt_pos:int ) -> int:
+    ''' Get target end of a COPY starting at tgt_pos, tolerating a few mismatching blocks '''
+    end        = tgt_pos
+    mismatches = 0
+    limit      = min(len(target) - tgt_pos, len(source) - src_pos)
+    step       = 0
+    while step + BLOCK_SIZE <= limit:
+        if source[src_pos + step : src_pos + step + BLOCK_SIZE] == target[tgt_pos + step : tgt_pos + step + BLOCK_SIZE]:
+            mismatches = 0
+            end        = tgt_pos + step + BLOCK_SIZE
+        else:
+            mismatches += 1
+            if mismatches > MAX_MISMATCH_BLOCKS:
+                break
+        step += BLOCK_SIZE
+    return end
+
+def _extend_backward( source:bytes, target:bytes, src_pos:int, tgt_pos:int, tgt_min:int ) -> int:
+    ''' Get target start of a COPY ending at tgt_pos, without going before tgt_min '''
+    start = tgt_pos
+    while( ( start > tgt_min ) and ( src_pos - (tgt_pos - start) > 0 ) and
+           ( source[src_pos - (tgt_pos - start) - 1] == target[start - 1] ) ):
+        start -= 1
+    return start
+
+def find_matches( source:bytes, target:bytes ) -> list:
+    ''' Get list of (target start, target end, source start) COPY regions, in target order '''
+    index   = _index_source(source)
+    matches = []
+    covered = 0
+    delta   = None
+    probe   = 0
+    while probe + BLOCK_SIZE <= len(target):
+        src_pos = None
+        block   = target[probe : probe + BLOCK_SIZE]
+        # Same shift as the previous match first, it is the most likely
+        if( ( delta is not None ) and ( 0 <= probe + delta <= len(source) - BLOCK_SIZE ) and
+            ( source[probe + delta : probe + delta + BLOCK_SIZE] == block ) ):
+            src_pos = probe + delta
+        else:
+            candidate = index.get( hash(block) )
+            if( ( candidate is not None ) and ( source[candidate : candidate + BLOCK_SIZE] == block ) ):
+                src_pos = candidate
+        if src_pos is None:
+            probe += PROBE_STEP
+            continue
+        start = _extend_backward(source, target, src_pos, probe, covered)
+        end   = _extend_forward(source, target, src_pos, probe)
+        matches.append( (start, end, src_pos - (probe - start)) )
+        delta   = src_pos - probe
+        covered = end
+        probe   = end
+    return matches
+
+def _write_record( compressor, output, kind:int, length:int = 0, offset:int = 0, data:bytes = b'' ):
+    ''' Compress one record into output '''
+    output.write( compressor.compress(RECORD_HEADER.pack(kind, length, offset)) )
+    if data:
+        output.write( compressor.compress(data) )
+
+def create_delta( source_path:str, target_path:str, delta_path:str ) -> dict:
+    ''' Create delta file from source to target image, returns its statistics '''
+    with open(source_path, 'rb') as file:
+        source = file.read()
+    with open(target_path, 'rb') as file:
+        target = file.read()
+    matches    = find_matches(source, target)
+    source_sha = hashlib.sha256(source).digest()
+    target_sha = hashlib.sha256(target).digest()
+
+    tmp_path   = f"{delta_path}.{os.getpid()}.tmp"
+    compressor = zlib.compressobj(COMPRESSION_LEVEL)
+    copied     = 0
+    with open(tmp_path, 'wb') as output:
+        output.write( DELTA_HEADER.pack(DELTA_MAGIC, DELTA_VERSION, source_sha, len(source),
+                                        target_sha, len(target)) )
+        position = 0
+        for start, end, src_start in matches + [(len(target), len(target), 0)]:
+            for chunk in range(position, start, CHUNK_SIZE):
+                data = target[chunk : min(start, chunk + CHUNK_SIZE)]
+                _write_record(compressor, output, RECORD_INSERT, len(data), 0, data)
+            for chunk in range(start, end, CHUNK_SIZE):
+                length = min(end, chunk + CHUNK_SIZE) - chunk
+                offset = src_start + chunk - start
+                data   = _xor(target[chunk : chunk + length], source[offset : offset + length])
+                _write_record(compressor, output, RECORD_COPY, length, offset, data)
+            copied  += end - start
+            position = end
+        _write_record(compressor, output, RECORD_END)
+        output.write( compressor.flush() )
+    os.replace(tmp_path, delta_path)
+    return {
+        'source_sha256' : source_sha.hex(),
+        'source_size'   : len(source),
+        'target_sha256' : target_sha.hex(),
+        'target_size'   : len(target),
+        'delta_size'    : os.path.getsize(delta_path),
+        'copied_bytes'  : copied,
+        'ratio'         : round( os.path.getsize(delta_path) / max(1, len(target)), 4 ),
+    }
+
+def read_delta_header( delta_path:str ) -> dict:
+    ''' Read delta header '''
+    with open(delta_path, 'rb') as file:
+        raw = file.read(DELTA_HEADER.size)
+    if len(raw) != DELTA_HEADER.size:
+        raise ValueError("delta file is truncated")
+    magic, version, source_sha, source_size, target_sha, target_size = DELTA_HEADER.unpack(raw)
+    if( ( magic != DELTA_MAGIC ) or ( version != DELTA_VERSION ) ):
+        raise ValueError("not a delta file, or unsupported version")
+    return {
+        'source_sha256' : source_sha.hex(),
+        'source_size'   : source_size,
+        'target_sha256' : target_sha.hex(),
+        'target_size'   : target_size,
+    }
+
+class _RecordReader:
+    ''' Read decompressed bytes of a delta with bounded memory '''
+    def __init__(self, file):
+        self.file         = file
+        self.decompressor = zlib.decompressobj()
+        self.buffer       = b''
+
+    def read( self, size:int ) -> bytes:
+        ''' Read exactly size bytes '''
+        while len(self.buffer) < size:
+            data = self.decompressor.unconsumed_tail
+            if not data:
+                data = self.file.read(CHUNK_SIZE)
+                if not data:
+                    raise ValueError("delta file is truncated")
+            try:
+                self.buffer += self.decompressor.decompress(data, CHUNK_SIZE)
+            except zlib.error as excep:
+                raise ValueError(f"delta file is corrupted ({excep})") from excep
+        data        = self.buffer[:size]
+        self.buffer = self.buffer[size:]
+        return data
+
+def apply_delta( source_path:str, delta_path:str, target_path:str = None ) -> str:
+    ''' Rebuild target image from source and delta (just verify when target_path is None),
+        returns the target sha256 '''
+    header = read_delta_header(delta_path)
+    if( ( os.path.getsize(source_path) != header['source_size'] ) or
+        ( _file_sha256(source_path).hex() != header['source_sha256'] ) ):
+        raise ValueError("source image does not match the delta")
+    digest   = hashlib.sha256()
+    tmp_path = None if target_path is None else f"{target_path}.{os.getpid()}.tmp"
+    output   = None if tmp_path is None else open(tmp_path, 'wb') #pylint: disable=R1732
+    try:
+        with open(source_path, 'rb') as source, open(delta_path, 'rb') as delta:
+            delta.seek(DELTA_HEADER.size)
+            reader = _RecordReader(delta)
+            while True:
+                kind, length, offset = RECORD_HEADER.unpack( reader.read(RECORD_HEADER.size) )
+                if kind == RECORD_END:
+                    break
+                data = reader.read(length)
+                if kind == RECORD_COPY:
+                    source.seek(offset)
+                    data = _xor(data, source.read(length))
+                elif kind != RECORD_INSERT:
+                    raise ValueError(f"unknown delta record {kind}")
+                digest.update(data)
+                if output is not None:
+                    output.write(data)
+        if digest.hexdigest() != header['target_sha256']:
+            raise ValueError("rebuilt image does not match the delta target")
+    except Exception:
+        if output is not None:
+            output.close()
+            os.remove(tmp_path)
+        raise
+    if output is not None:
+        output.close()
+        os.replace(tmp_path, target_path)
+    return digest.hexdigest()
+
+def main( argv ) -> int:
+    ''' Command line entry point '''
+    if( ( len(argv) == 4 ) and ( argv[0] == 'diff' ) ):
+        print( create_delta(argv[1], argv[2], argv[3]) )
+    elif( ( len(argv) == 4 ) and ( argv[0] == 'apply' ) ):
+        print( "OK, sha256 =", apply_delta(argv[1], argv[2], argv[3]) )
+    elif( ( len(argv) == 3 ) and ( argv[0] == 'verify' ) ):
+        print( "OK, sha256 =", apply_delta(argv[1], argv[2]) )
+    else:
+        print(__doc__)
+        return 2
+    return 0
+
+if __name__ == "__main__":
+    try:
+        sys.exit( main(sys.argv[1:]) )
+    except Exception as excep:
+        print("ERROR:", excep)
+        sys.exit(1)
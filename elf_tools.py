@@ -0,0 +1,237 @@
+'''
+    PlatformIO Advanced Script for NavitasTecnologia
+    See: https://docs.platformio.org/en/latest/scripting/actions.html
+
+    Memory footprint of a linked .elf (ELF32/ELF64, both endiannesses), read
+    with mmap: flash/RAM usage per section (by load/run address) and the largest
+    symbols, compact enough to be kept for every build and diffed against the
+    previous one.
+'''
+# pylint: disable=broad-except
+# ------------------
+# Importing Modules
+# ------------------
+import os
+import mmap
+import struct
+
+# ------------------
+# Constants
+# ------------------
+FOOTPRINT_VERSION      = 2
+FOOTPRINT_TOP_SYMBOLS  = 50
+ELF_MAGIC              = b"\x7fELF"
+ELF_CLASS_64           = 2
+ELF_DATA_BIG_ENDIAN    = 2
+PT_LOAD                = 1
+SHT_SYMTAB             = 2
+SHT_NOBITS             = 8
+SHF_WRITE              = 0x1
+SHF_ALLOC              = 0x2
+STT_OBJECT             = 1
+STT_FUNC               = 2
+SHN_LORESERVE          = 0xff00
+EM_XTENSA              = 94
+EM_RISCV               = 243
+# (header, section header, symbol, program header) struct formats, fields in the order read below
+ELF_FORMATS            = {
+    32 : ("16xHHIIIIIHHHHHH", "IIIIIIIIII", "IIIBBH", "IIIIII"),
+    64 : ("16xHHIQQQIHHHHHH", "IIQQQQIIQQ", "IBBHQQ", "IIQQQQQ"),
+}
+# [start, end) of the RAM the boot ROM loads directly from the flash image (load address
+# == run address, so only the address tells it apart from flash mapped code/constants)
+RAM_ADDRESS_RANGES     = {
+    EM_XTENSA : [ (0x3FF80000, 0x40000000),    # ESP32/ESP32-S2/ESP8266 DRAM, RTC fast data
+                  (0x40020000, 0x400C2000),    # ESP32/ESP32-S2 IRAM, ESP32 RTC fast code
+                  (0x40100000, 0x40110000),    # ESP8266 IRAM
+                  (0x3FC88000, 0x3FD00000),    # ESP32-S3 DRAM
+                  (0x40370000, 0x403E0000),    # ESP32-S3 IRAM
+                  (0x50000000, 0x50002000),    # RTC slow memory
+                  (0x600FE000, 0x60100000) ],  # ESP32-S3 RTC fast memory
+    EM_RISCV  : [ (0x3FC80000, 0x3FD00000),    # ESP32-C3 DRAM
+                  (0x4037C000, 0x403E0000),    # ESP32-C3 IRAM
+                  (0x40800000, 0x40880000),    # ESP32-C6/H2 SRAM
+                  (0x50000000, 0x50004000) ],  # RTC/LP memory
+}
+SYMBOL_TYPES           = {STT_OBJECT: 'object', STT_FUNC: 'func'}
+REGION_FLASH           = 'flash'
+REGION_RAM             = 'ram'
+REGION_BOTH            = 'flash+ram'
+
+# ------------------
+# Parsing
+# ------------------
+def _get_region( flags:int, sh_type:int, addr:int, segments:list, ram_ranges:list ):
+    ''' Memory used by an allocated section: what runs from RAM (writable, copied from another
+        load address or placed in a RAM range) uses flash for its content and RAM, zero-initialized
+        data uses RAM only, the rest (code/constants) uses flash '''
+    if not flags & SHF_ALLOC:
+        return None
+    in_ram = ( ( flags & SHF_WRITE != 0 ) or
+               any( start <= addr < end for start, end in ram_ranges ) or
+               any( vaddr <= addr < vaddr + memsz and vaddr != paddr for vaddr, paddr, memsz in segments ) )
+    if not in_ram:
+        return REGION_FLASH
+    return REGION_RAM if sh_type == SHT_NOBITS else REGION_BOTH
+
+def _read_cstring( data, offset:int ) -> str:
+    ''' Read null terminated string '''
+    end = data.find(b'\0', offset)
+    return data[offset : end if end >= 0 else len(data)].decode('UTF-8', 'replace')
+
+def read_load_segments( data, header:tuple, bits:int, endianness:str ) -> list:
+    ''' Get [(vaddr, paddr, memsz)] of the PT_LOAD program headers '''
+    ph_offset, ph_entsize, ph_num = header[4], header[8], header[9]
+    if( ( ph_offset == 0 ) or ( ph_num == 0 ) ):
+        return []
+    program_struct = struct.Struct(endianness + ELF_FORMATS[bits][3])
+    segments = []
+    for i in range(ph_num):
+        fields = program_struct.unpack_from(data, ph_offset + i * ph_entsize)
+        if bits == 64:
+            p_type, _, _, p_vaddr, p_paddr, _, p_memsz = fields
+        else:
+            p_type, _, p_vaddr, p_paddr, _, p_memsz = fields
+        if p_type == PT_LOAD:
+            segments.append( (p_vaddr, p_paddr, p_memsz) )
+    return segments
+
+def read_sections( data ) -> list:
+    ''' Get [{name, type, flags, addr, offset, size, link, entsize, region}] of an ELF image '''
+    if( ( len(data) < 52 ) or ( data[:4] != ELF_MAGIC ) ):
+        raise ValueError("not an ELF file")
+    bits       = 64 if data[4] == ELF_CLASS_64 else 32
+    endianness = '>' if data[5] == ELF_DATA_BIG_ENDIAN else '<'
+    header_fmt, section_fmt = ELF_FORMATS[bits][:2]
+    header = struct.unpack_from(endianness + header_fmt, data, 0)
+    sh_offset, sh_entsize, sh_num, sh_strndx = header[5], header[10], header[11], header[12]
+    segments   = read_load_segments(data, header, bits, endianness)
+    ram_ranges = RAM_ADDRESS_RANGES.get(header[1], [])
+    if( ( sh_offset == 0 ) or ( sh_num == 0 ) ):
+        return []
+    section_struct = struct.Struct(endianness + section_fmt)
+    raw_sections   = [ section_struct.unpack_from(data, sh_offset + i * sh_entsize) for i in range(sh_num) ]
+    names_offset   = raw_sections[sh_strndx][4] if sh_strndx < sh_num else None
+    sections = []
+    for sh_name, sh_type, flags, addr, offset, size, link, _, _, entsize in raw_sections:
+        sections.append({
+            'name'    : '' if names_offset is None else _read_cstring(data, names_offset + sh_name),
+            'type'    : sh_type,
+            'flags'   : flags,
+            'addr'    : addr,
+            'offset'  : offset,
+            'size'    : size,
+            'link'    : link,
+            'entsize' : entsize,
+            'region'  : _get_region(flags, sh_type, addr, segments, ram_ranges),
+        })
+    return sections
+
+def read_symbols( data, sections:list ) -> list:
+    ''' Get [(name, size, type, section)] of the sized functions/objects in .symtab '''
+    bits       = 64 if data[4] == ELF_CLASS_64 else 32
+    endianness = '>' if data[5] == ELF_DATA_BIG_ENDIAN else '<'
+    symbol_struct = struct.Struct(endianness + ELF_FORMATS[bits][2])
+    symbols = []
+    for symtab in [x for x in sections if x['type'] == SHT_SYMTAB]:
+        names_offset = sections[symtab['link']]['offset']
+        entsize      = symtab['entsize'] or symbol_struct.size
+        for offset in range(symtab['offset'], symtab['offset'] + symtab['size'], entsize):
+            fields = symbol_struct.unpack_from(data, offset)
+            if bits == 64:
+                st_name, st_info, _, st_shndx, _, st_size = fields
+            else:
+                st_name, _, st_size, st_info, _, st_shndx = fields
+            symbol_type = SYMBOL_TYPES.get(st_info & 0xf)
+            if( ( symbol_type is None ) or ( st_size == 0 ) or ( st_shndx == 0 ) or
+                ( st_shndx >= min(len(sections), SHN_LORESERVE) ) ):
+                continue
+            symbols.append( (_read_cstring(data, names_offset + st_name), st_size, symbol_type,
+                             sections[st_shndx]['name']) )
+    return symbols
+
+def get_footprint( elf_path:str, top_symbols:int = FOOTPRINT_TOP_SYMBOLS ) -> dict:
+    ''' Get flash/RAM bytes, allocated section sizes and the largest symbols of an .elf '''
+    with open(elf_path, 'rb') as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            sections = read_sections(data)
+            symbols  = read_symbols(data, sections)
+    regions = {x['name']: x['region'] for x in sections}
+    flash   = sum( x['size'] for x in sections if x['region'] in [REGION_FLASH, REGION_BOTH] )
+    ram     = sum( x['size'] for x in sections if x['region'] in [REGION_RAM, REGION_BOTH] )
+    symbols.sort(key=lambda x: x[1], reverse=True)
+    return {
+        'version'  : FOOTPRINT_VERSION,
+        'elf'      : os.path.basename(elf_path),
+        'flash'    : flash,
+        'ram'      : ram,
+        'sections' : {x['name']: [x['size'], x['region']] for x in sections if x['region'] and x['size']},
+        'symbols_total' : len(symbols),
+        # [name, size, type, section, region]
+        'symbols'  : [ [name, size, kind, section, regions.get(section)]
+                       for name, size, kind, section in symbols[:top_symbols] ],
+    }
+
+# ------------------
+# Comparison
+# ------------------
+def diff_footprints( old:dict, new:dict, limit:int = 10 ) -> dict:
+    ''' Get flash/RAM growth and the sections and symbols that changed most '''
+    def _changes(old_sizes, new_sizes):
+        changes = [ [name, new_sizes.get(name, 0) - old_sizes.get(name, 0)]
+                    for name in set(old_sizes) | set(new_sizes) ]
+        changes = [x for x in changes if x[1] != 0]
+        changes.sort(key=lambda x: abs(x[1]), reverse=True)
+        return changes[:limit]
+    # Only the largest symbols are kept: a symbol missing from a truncated list has an unknown size
+    old_symbols = {x[0]: x[1] for x in old.get('symbols', [])}
+    new_symbols = {x[0]: x[1] for x in new.get('symbols', [])}
+    names       = set(old_symbols) & set(new_symbols)
+    if len(old_symbols) >= old.get('symbols_total', 0):
+        names |= set(new_symbols)
+    if len(new_symbols) >= new.get('symbols_total', 0):
+        names |= set(old_symbols)
+    return {
+        'flash'    : new['flash'] - old['flash'],
+        'ram'      : new['ram'] - old['ram'],
+        'sections' : _changes( {k: v[0] for k, v in old.get('sections', {}).items()},
+                               {k: v[0] for k, v in new.get('sections', {}).items()} ),
+        'symbols'  : _changes( {k: v for k, v in old_symbols.items() if k in names},
+                               {k: v for k, v in new_symbols.items() if k in names} ),
+    }
+
+def parse_size( value ) -> int:
+    ''' Parse "123456", "320K", "4M" (or KB/MB) into bytes, None if empty '''
+    text = str(value).strip().upper().rstrip('B')
+    if text == '':
+        return None
+    multiplier = 1
+    if text[-1] in 'KM':
+        multiplier = 1024 if text[-1] == 'K' else 1024 * 1024
+        text = text[:-1]
+    return int( float(text) * multiplier )
+
+def check_budgets( footprint:dict, budgets:dict ) -> list:
+    ''' Get messages of every region ({'flash': bytes, 'ram': bytes}) above its budget '''
+    messages = []
+    for region, budget in budgets.items():
+        if( ( budget is not None ) and ( footprint[region] > budget ) ):
+            messages.append( f"{region} {footprint[region]} B exceeds its budget of {budget} B "
+                             f"by {footprint[region] - budget} B" )
+    return messages
+
+def get_summary( footprint:dict, diff:dict = None, budgets:dict = None ) -> str:
+    ''' Printable summary of a footprint and its diff '''
+    lines = []
+    for region in [REGION_FLASH, REGION_RAM]:
+        text = f"{region:<5} {footprint[region]:>10} B"
+        if( budgets and ( budgets.get(region) ) ):
+            text += f" ({footprint[region] * 100.0 / budgets[region]:5.1f}% of {budgets[region]} B)"
+        if diff is not None:
+            text += f"  {diff[region]:+d} B since last build"
+        lines.append(text)
+    if diff is not None:
+        for kind in ['sections', 'symbols']:
+            if diff[kind]:
+                lines.append( f"{kind}: " + ", ".join(f"{name} {delta:+d}" for name, delta in diff[kind][:5]) )
+    return "\n".join(lines)
@@ -0,0 +1,269 @@
+'''
+    PlatformIO Advanced Script for NavitasTecnologia
+    See: https://docs.platformio.org/en/latest/scripting/actions.html
+
+    Resolver of SCons construction variable expressions ("$UPLOADCMD", ...):
+    expressions are compiled once into token trees, and resolved values are
+    cached per env until one of the variables they depend on changes.
+'''
+# pylint: disable=broad-except
+# ------------------
+# Importing Modules
+# ------------------
+import os
+import re
+import ntpath
+import functools
+
+# ------------------
+# Constants
+# ------------------
+TOKEN_LITERAL          = 0
+TOKEN_VARIABLE         = 1
+TOKEN_FUNCTION         = 2
+TOKEN_SUBST            = 3
+IGNORED_KEYS           = ['UPLOAD_PORT']
+NAME_REGEX             = re.compile(r'[A-Za-z_][A-Za-z0-9_]*')
+FUNCTION_CALL_REGEX    = re.compile(r'([A-Za-z_][A-Za-z0-9_]*)\(([^)]*)\)')
+FILE_EXISTS_DEPENDENCY = '?'
+
+# ------------------
+# Compiler
+# ------------------
+@functools.lru_cache(maxsize=None)
+def compile_expression( text:str ) -> tuple:
+    ''' Parse an expression into words, each one a tuple of (token type, ...) parts '''
+    words   = []
+    parts   = []
+    literal = []
+    quote   = None
+    in_word = False
+
+    def _flush_literal():
+        if literal:
+            parts.append( (TOKEN_LITERAL, "".join(literal)) )
+            literal.clear()
+
+    i = 0
+    while i < len(text):
+        char = text[i]
+        if quote is not None and char == quote:
+            # Closing quote, quotes are dropped like the shell would
+            quote = None
+            i += 1
+            continue
+        if quote is None and char in '"\'':
+            quote   = char
+            in_word = True
+            i += 1
+            continue
+        if quote is None and char.isspace():
+            _flush_literal()
+            if( parts or in_word ):
+                words.append( tuple(parts) )
+            parts   = []
+            in_word = False
+            i += 1
+            continue
+        in_word = True
+        if char != '$':
+            literal.append(char)
+            i += 1
+            continue
+
+        # $$, ${NAME}, ${function(args)}, ${other expression} or $NAME
+        next_char = text[i+1:i+2]
+        if next_char == '$':
+            literal.append('$')
+            i += 2
+            continue
+        if next_char == '{':
+            end = text.find('}', i + 2)
+            if end < 0:
+                literal.append( text[i:] )
+                break
+            expression = text[i+2:end]
+            function   = FUNCTION_CALL_REGEX.fullmatch(expression)
+            _flush_literal()
+            if NAME_REGEX.fullmatch(expression):
+                parts.append( (TOKEN_VARIABLE, expression) )
+            elif function:
+                parts.append( (TOKEN_FUNCTION, function.group(1), function.group(2).strip(), text[i:end+1]) )
+            else:
+                parts.append( (TOKEN_SUBST, text[i:end+1]) )
+            i = end + 1
+            continue
+        name = NAME_REGEX.match(text, i + 1)
+        if name is None:
+            literal.append('$')
+            i += 1
+            continue
+        _flush_literal()
+        parts.append( (TOKEN_VARIABLE, name.group(0)) )
+        i = name.end()
+
+    _flush_literal()
+    if( parts or in_word ):
+        words.append( tuple(parts) )
+    return tuple(words)
+
+def _fingerprint( value ):
+    ''' Comparable identity of an env value, to detect changes '''
+    if isinstance(value, str):
+        return value
+    if callable(value):
+        return ('callable', id(value))
+    if isinstance(value, (list, tuple)) or hasattr(value, '__iter__'):
+        try:
+            return tuple( _fingerprint(x) for x in value )
+        except Exception:
+            pass
+    return str(value)
+
+def _join_words( words:list, new_words ):
+    ''' Append new_words to words, gluing the first one to the last word (e.g. "$BUILD_DIR/x.bin") '''
+    for i, word in enumerate(new_words):
+        if i == 0:
+            words[-1] += word
+        else:
+            words.append(word)
+
+# ------------------
+# Resolver
+# ------------------
+class EnvResolver:
+    ''' Resolve expressions of one env, caching the resolved variables '''
+    def __init__(self, env):
+        self.env    = env
+        self.values = {}
+
+    def _is_valid( self, dependencies ) -> bool:
+        ''' Check if no dependency changed since it was resolved '''
+        for key, fingerprint in dependencies:
+            if key.startswith(FILE_EXISTS_DEPENDENCY):
+                if os.path.isfile(key[1:]) != fingerprint:
+                    return False
+            elif key not in self.env:
+                if fingerprint is not None:
+                    return False
+            elif _fingerprint(self.env[key]) != fingerprint:
+                return False
+        return True
+
+    def _resolve_words( self, compiled:tuple, stack:set, dependencies:list ) -> list:
+        ''' Resolve compiled words '''
+        out_words = []
+        for word in compiled:
+            words = ['']
+            for part in word:
+                if part[0] == TOKEN_LITERAL:
+                    _join_words(words, [part[1]])
+                elif part[0] == TOKEN_VARIABLE:
+                    _join_words(words, self._resolve_variable(part[1], stack, dependencies))
+                elif part[0] == TOKEN_FUNCTION:
+                    _join_words(words, self._resolve_function(part, dependencies))
+                else:
+                    _join_words(words, str(self.env.subst(part[1])).split())
+            out_words.extend( w for w in words if w != '' )
+        return out_words
+
+    def _resolve_value( self, value, stack:set, dependencies:list ) -> list:
+        ''' Resolve an env value: a string, or a list of strings '''
+        if isinstance(value, str):
+            return self._resolve_words(compile_expression(value), stack, dependencies)
+        if( ( not callable(value) ) and ( isinstance(value, (list, tuple)) or hasattr(value, '__iter__') ) ):
+            out_words = []
+            for value_i in value:
+                out_words.extend( self._resolve_value(value_i, stack, dependencies) )
+            return out_words
+        return [str(value)]
+
+    def _resolve_function( self, part:tuple, dependencies:list ) -> list:
+        ''' Resolve ${function(__env__)}, or let SCons do it '''
+        _, name, args, raw = part
+        if( ( args == '__env__' ) and ( name in self.env ) ):
+            function = self.env[name]
+            dependencies.append( (name, _fingerprint(function)) )
+            return str(function(self.env)).split()
+        return str(self.env.subst(raw)).split()
+
+    def _resolve_variable( self, name:str, stack:set, dependencies:list ) -> list:
+        ''' Resolve $NAME, using the cache when nothing it depends on changed '''
+        if name in IGNORED_KEYS:
+            return []
+        cached = self.values.get(name)
+        if( ( cached is not None ) and self._is_valid(cached[1]) ):
+            dependencies.extend(cached[1])
+            return cached[0]
+        if name in stack:
+            print( f'"{name}" references itself!' )
+            return [f"${name}"]
+        if name not in self.env:
+            if name.upper() == "SOURCE":
+                return self._resolve_source(stack, dependencies)
+            print( f'"{name}" not found!' )
+            dependencies.append( (name, None) )
+            return [f"${name}"]
+
+        value             = self.env[name]
+        name_dependencies = [ (name, _fingerprint(value)) ]
+        stack.add(name)
+        try:
+            words = self._resolve_value(value, stack, name_dependencies)
+        finally:
+            stack.discard(name)
+        self.values[name] = (words, name_dependencies)
+        dependencies.extend(name_dependencies)
+        return words
+
+    def _resolve_source( self, stack:set, dependencies:list ) -> list:
+        ''' Resolve $SOURCE: the firmware .bin when it exists, else $PROG_PATH '''
+        fmw_path = " ".join( self._resolve_variable('PROG_PATH', stack, dependencies) )
+        bin_path = os.path.splitext(fmw_path)[0] + '.bin'
+        bin_exists = os.path.isfile(bin_path)
+        dependencies.append( (FILE_EXISTS_DEPENDENCY + bin_path, bin_exists) )
+        return [bin_path if bin_exists else fmw_path]
+
+    def get_firmware_path( self ) -> str:
+        ''' Get firmware file path (.bin when it exists) '''
+        return self._resolve_source(set(), [])[0]
+
+    def resolve( self, value, collect_files:bool = False ):
+        ''' Resolve an expression, returns (text, set of files it references) '''
+        words = self._resolve_value(value, set(), [])
+        files = set()
+        if collect_files:
+            for i, word in enumerate(words):
+                # Files may be inside a quoted word, e.g. -c "program {$SOURCE} verify"
+                atoms = word.split(' ')
+                for j, atom in enumerate(atoms):
+                    file_path = atom.strip('{}')
+                    if( ( file_path == '' ) or ( not os.path.isfile(file_path) ) ):
+                        continue
+                    if "python" not in file_path.lower():
+                        files.add( os.path.realpath(file_path.replace("\\", "/")) )
+                    atoms[j] = atom.replace(file_path, ntpath.basename(file_path))
+                words[i] = " ".join(atoms)
+        # Quotes are dropped, fix_zip_file_*() quote the arguments that need it
+        return " ".join(words), files
+
+# ------------------
+# Functions
+# ------------------
+_RESOLVERS = {}
+
+def get_resolver( env ) -> EnvResolver:
+    ''' Get the resolver of an env, keeping its cache between calls '''
+    resolver = _RESOLVERS.get(id(env))
+    if( ( resolver is None ) or ( resolver.env is not env ) ):
+        resolver = EnvResolver(env)
+        _RESOLVERS[id(env)] = resolver
+    return resolver
+
+def resolve_env_value( env, value, collect_files:bool = False ):
+    ''' Resolve an expression of env, returns (text, set of files it references) '''
+    return get_resolver(env).resolve(value, collect_files)
+
+def clear_resolver_cache():
+    ''' Forget every resolved value '''
+    _RESOLVERS.clear()
@@ -0,0 +1,236 @@
+'''
+    PlatformIO Advanced Script for NavitasTecnologia
+    See: https://docs.platformio.org/en/latest/scripting/actions.html
+
+    Snapshot of the SCons construction variables used by the release scripts,
+    so releases can be packaged again without the SCons runtime.
+'''
+# pylint: disable=broad-except
+# ------------------
+# Importing Modules
+# ------------------
+import os
+import re
+import gzip
+import json
+
+# ------------------
+# Constants
+# ------------------
+ENV_SNAPSHOT_FILE    = "navitas_env.json"
+ENV_SNAPSHOT_VERSION = 2
+SNAPSHOT_KEYS        = [
+    'PIOENV', 'BOARD', 'PIOPLATFORM', 'PIOFRAMEWORK', 'PROJECT_DIR', 'BUILD_DIR',
+    'PROGNAME', 'PROG_PATH', 'PROGPATH', 'PROGSUFFIX', 'OBJCOPY', 'PYTHONEXE',
+    'UPLOADCMD', 'UPLOADER', 'UPLOADERFLAGS', 'UPLOAD_PROTOCOL', 'UPLOAD_SPEED',
+    'FLASH_EXTRA_IMAGES', 'ESP32_APP_OFFSET',
+]
+SNAPSHOT_OPTIONS     = [
+    'custom_release_compression', 'custom_release_compression_level',
+    'custom_perf_report', 'custom_perf_profile', 'custom_release_delta',
+    'custom_release_store', 'custom_release_store_keep', 'custom_release_store_max_mb',
+    'custom_build_ledger', 'custom_footprint_report', 'custom_flash_budget', 'custom_ram_budget',
+    'custom_footprint_budget_action', 'custom_sector_manifest', 'custom_upload_runner',
+    'custom_warm_helper', 'custom_warm_helper_idle', 'custom_fmw_info_mode', 'custom_fmw_info_sources',
+    'custom_fmw_update_policy', 'custom_fmw_update_policy_branches', 'custom_fmw_update_prompt_timeout',
+    'custom_fmw_update_prompt_default', 'custom_release_packaging', 'custom_env_dump',
+]
+# Board manifest values (BoardConfig()) read by the release scripts
+SNAPSHOT_BOARD_KEYS  = [
+    'upload.offset_address', 'upload.maximum_size', 'upload.maximum_ram_size',
+]
+ENV_DUMP_FOLDER      = ".pio/env_dumps/"
+ENV_DUMP_SUFFIX      = ".json.gz"
+ENV_DIFF_SUFFIX      = ".diff.json"
+VARIABLE_REGEX       = re.compile(r'\$\{?([A-Za-z_][A-Za-z0-9_]*)')
+FUNCTION_REGEX       = re.compile(r'\$\{([A-Za-z_][A-Za-z0-9_]*)\(([^)]*)\)\}')
+
+# ------------------
+# Snapshot Environment
+# ------------------
+class EnvSnapshot(dict):
+    ''' Replacement for the SCons env, built from a snapshot file '''
+    def __init__(self, data: dict):
+        super().__init__(data.get('values', {}))
+        self.functions     = data.get('functions', {})
+        self.substitutions = data.get('substitutions', {})
+        self.options       = data.get('options', {})
+        self.board         = data.get('board', {})
+
+    def __getitem__(self, key):
+        if( ( key in self.functions ) and ( not dict.__contains__(self, key) ) ):
+            value = self.functions[key]
+            return lambda *args, **kwargs: value
+        return dict.__getitem__(self, key)
+
+    def subst(self, value: str) -> str:
+        ''' Expand $VARIABLES like SCons would, with the recorded values '''
+        if value in self.substitutions:
+            return self.substitutions[value]
+        def _expand(match):
+            found = self.get(match.group(1), '')
+            if isinstance(found, list):
+                return ' '.join(str(x) for x in found)
+            return str(found)
+        for _ in range(10):
+            expanded = re.sub(r'\$\{?([A-Za-z_][A-Za-z0-9_]*)\}?', _expand, value)
+            if expanded == value:
+                break
+            value = expanded
+        return value
+
+    def GetProjectOption(self, option, default=None): #pylint: disable=C0103
+        ''' Get platformio.ini option recorded in the snapshot (unset options are recorded as None) '''
+        value = self.options.get(option)
+        return default if value is None else value
+
+    def GetOption(self, name): #pylint: disable=C0103,W0613
+        ''' SCons command line options are never set outside SCons '''
+        return False
+
+    def BoardConfig(self): #pylint: disable=C0103
+        ''' Board manifest values recorded in the snapshot (unset values are not recorded) '''
+        return dict(self.board)
+
+    def Dump(self): #pylint: disable=C0103
+        ''' Same as SCons Dump(), for debug '''
+        return json.dumps(dict(self), indent=4)
+
+# ------------------
+# Functions
+# ------------------
+def _to_json_value( value ):
+    ''' Convert SCons values (lists, CLVars, nodes, tuples) to JSON values '''
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    if isinstance(value, (list, tuple)):
+        return [_to_json_value(x) for x in value]
+    if isinstance(value, dict):
+        return {str(k): _to_json_value(v) for k, v in value.items()}
+    try:
+        return [_to_json_value(x) for x in list(value)] if hasattr(value, '__iter__') else str(value)
+    except Exception:
+        return str(value)
+
+def collect_env_snapshot( env, keys=None, options=None, call_functions=True ) -> dict:
+    ''' Collect keys, and every key they reference, from a SCons env '''
+    data = {
+        'version'       : ENV_SNAPSHOT_VERSION,
+        'values'        : {},
+        'functions'     : {},
+        'substitutions' : {},
+        'options'       : {},
+        'board'         : {},
+    }
+    pending = list(SNAPSHOT_KEYS if keys is None else keys)
+    while pending:
+        key = pending.pop()
+        if( ( key in data['values'] ) or ( key in data['functions'] ) or ( key not in env ) ):
+            continue
+        value = env[key]
+        if( callable(value) and ( not call_functions ) ):
+            # Builders, scanners and actions are callable too
+            data['values'][key] = str(value)
+            continue
+        if callable(value):
+            try:
+                data['functions'][key] = str(value(env))
+            except Exception:
+                pass
+            continue
+        value = _to_json_value(value)
+        data['values'][key] = value
+        for text in ( value if isinstance(value, list) else [value] ):
+            if not isinstance(text, str):
+                continue
+            pending.extend( VARIABLE_REGEX.findall(text) )
+            for match in FUNCTION_REGEX.finditer(text):
+                try:
+                    data['substitutions'][match.group(0)] = env.subst(match.group(0))
+                except Exception:
+                    pass
+    if 'ENV' in env:
+        data['values']['ENV'] = {'PATH': str(env['ENV'].get('PATH', ''))}
+    for option in ( SNAPSHOT_OPTIONS if options is None else options ):
+        try:
+            data['options'][option] = env.GetProjectOption(option, None)
+        except Exception:
+            pass
+    try:
+        board = env.BoardConfig() if hasattr(env, 'BoardConfig') else None
+        for key in ( SNAPSHOT_BOARD_KEYS if board is not None else [] ):
+            value = board.get(key, None)
+            if value is not None:
+                data['board'][key] = _to_json_value(value)
+    except Exception:
+        pass
+    return data
+
+def get_env_snapshot_path( build_dir:str ) -> str:
+    ''' Get snapshot file path inside the build folder of an env '''
+    return os.path.join(build_dir, ENV_SNAPSHOT_FILE)
+
+def save_env_snapshot( env, snapshot_path:str ):
+    ''' Save the variables the release scripts use, returns them '''
+    data = collect_env_snapshot(env)
+    os.makedirs(os.path.dirname(snapshot_path), exist_ok=True)
+    tmp_path = f"{snapshot_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='UTF-8') as file:
+        file.write( json.dumps(data, indent=4) )
+    os.replace(tmp_path, snapshot_path)
+    return data
+
+def _read_snapshot_data( snapshot_path:str ) -> dict:
+    ''' Read snapshot data, plain or gzip compressed '''
+    if snapshot_path.endswith('.gz'):
+        with gzip.open(snapshot_path, 'rt', encoding='UTF-8') as file:
+            return json.loads(file.read())
+    with open(snapshot_path, 'r', encoding='UTF-8') as file:
+        return json.loads(file.read())
+
+def load_env_snapshot( snapshot_path:str ) -> EnvSnapshot:
+    ''' Load a snapshot saved with save_env_snapshot() or save_env_dump() '''
+    return EnvSnapshot( _read_snapshot_data(snapshot_path) )
+
+def get_env_dump_path( pioenv:str, name:str ) -> str:
+    ''' Get path of the compressed dump of an env ("env" or "projenv") '''
+    return os.path.join(ENV_DUMP_FOLDER, pioenv, name + ENV_DUMP_SUFFIX)
+
+def diff_env_snapshots( old:dict, new:dict ) -> dict:
+    ''' Get {added, removed, changed} variables between two snapshot data '''
+    diff = {'added': {}, 'removed': {}, 'changed': {}}
+    for section in ['values', 'functions', 'substitutions', 'options', 'board']:
+        old_values = old.get(section, {})
+        new_values = new.get(section, {})
+        for key in sorted( set(old_values) | set(new_values) ):
+            if key not in old_values:
+                diff['added'][key] = new_values[key]
+            elif key not in new_values:
+                diff['removed'][key] = old_values[key]
+            elif old_values[key] != new_values[key]:
+                diff['changed'][key] = [old_values[key], new_values[key]]
+    return diff
+
+def save_env_dump( env, dump_path:str, full:bool = False ) -> dict:
+    ''' Save a compressed snapshot (every variable when full) and its diff to the previous one '''
+    keys = None
+    if full:
+        keys = list( env.Dictionary().keys() if hasattr(env, 'Dictionary') else env.keys() )
+    data = collect_env_snapshot(env, keys, call_functions=not full)
+    diff = None
+    if os.path.isfile(dump_path):
+        try:
+            diff = diff_env_snapshots(_read_snapshot_data(dump_path), data)
+        except Exception as excep:
+            print(f'Failed to read previous {dump_path}. Reason: {excep}')
+    os.makedirs(os.path.dirname(dump_path), exist_ok=True)
+    tmp_path = f"{dump_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as raw_file:
+        with gzip.GzipFile(fileobj=raw_file, mode='wb', mtime=0) as file:
+            file.write( json.dumps(data, sort_keys=True, separators=(',', ':')).encode('UTF-8') )
+    os.replace(tmp_path, dump_path)
+    if diff is not None:
+        diff_path = dump_path[:-len(ENV_DUMP_SUFFIX)] + ENV_DIFF_SUFFIX
+        with open(diff_path, 'w', encoding='UTF-8') as file:
+            file.write( json.dumps(diff, indent=4, sort_keys=True) )
+    return diff
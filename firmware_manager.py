@@ -7,15 +7,36 @@
 # Importing Modules
 # ------------------
 import os
+import sys
 import json
 import datetime
 import shutil
-from hashlib import md5, sha256
-import zipfile
 import time
+import shlex
+import re
 from pathlib import Path
+import script_entry
 import pio_tools
-import git_tools
+import env_resolver
+import perf_tools
+# Subsystems are imported on first use: registering the post actions, or a build
+# with nothing to release, only loads what it needs
+git_tools      = script_entry.LazyModule("git_tools")
+change_tools   = script_entry.LazyModule("change_tools")
+hash_tools     = script_entry.LazyModule("hash_tools")
+release_tools  = script_entry.LazyModule("release_tools")
+tool_cache     = script_entry.LazyModule("tool_cache")
+env_snapshot   = script_entry.LazyModule("env_snapshot")
+fmw_info_tools = script_entry.LazyModule("fmw_info_tools")
+delta_tools    = script_entry.LazyModule("delta_tools")
+update_policy  = script_entry.LazyModule("update_policy")
+release_store  = script_entry.LazyModule("release_store")
+build_ledger   = script_entry.LazyModule("build_ledger")
+elf_tools      = script_entry.LazyModule("elf_tools")
+sector_tools   = script_entry.LazyModule("sector_tools")
+upload_runner  = script_entry.LazyModule("upload_runner")
+warm_helper    = script_entry.LazyModule("warm_helper")
+package_scheduler = script_entry.LazyModule("package_scheduler")
 
 # ------------------
 # Constants
@@ -26,6 +47,35 @@ THIS_PATH                    = Path( os.path.realpath(__file__) ).parent
 FIRMWARE_USB_UPDATE_ZIP_MAIN = os.path.realpath( THIS_PATH / "../usbUpdateInfo.zip" )
 FIRMWARE_USB_UPDATE_ZIP_ALT  = os.path.realpath( THIS_PATH /  "./usbUpdateInfo.zip" )
 RELEASE_OUTPUT_FOLDER        = ".pio/release/"
+TOOL_CACHE_FOLDER            = ".cache/navitas_tool_bundles"
+RELEASE_FINGERPRINT_FILE     = "release_fingerprint.json"
+BUILD_OUTPUT_FOLDER          = ".pio/build/"
+IDEDATA_FILE                 = "idedata.json"
+FMW_INFO_LIB_FOLDER          = "lib/firmware_info/"
+FMW_INFO_STAMP_FILE          = "firmware_info.stamp"
+FMW_INFO_MODE_SOURCE         = "source"
+FMW_INFO_MODE_PATCH          = "patch"
+FMW_INFO_ENV_FOLDER          = ".pio/fmw_info/"
+FMW_INFO_LOCK_FILE           = ".pio/fmw_info/.lock"
+FMW_INFO_SOURCES_SHARED      = "shared"
+FMW_INFO_SOURCES_ENV         = "env"
+FMW_INFO_ENV_SOURCES_FOLDER  = "navitas_fmw_info/src"
+FMW_VERSION_RUN_CACHE        = "fmw_version"
+FMW_INFO_ENV_FIELDS          = ['Board', 'PIOENV']
+RELEASE_HISTORY_FOLDER       = "history"
+RELEASE_HISTORY_FILE         = "history.json"
+RELEASE_HISTORY_SIZE         = 5
+DELTA_ARC_FOLDER             = "delta/"
+DELTA_TOOLS_FILE             = os.path.realpath( THIS_PATH / "delta_tools.py" )
+SECTOR_TOOLS_FILE            = os.path.realpath( THIS_PATH / "sector_tools.py" )
+UPLOAD_RUNNER_FILE           = os.path.realpath( THIS_PATH / "upload_runner.py" )
+FOOTPRINT_FILE               = "footprint.json"
+FOOTPRINT_ACTION_WARN        = "warn"
+FOOTPRINT_ACTION_FAIL        = "fail"
+FOOTPRINT_BOARD_MAXIMUMS     = {'flash': "upload.maximum_size", 'ram': "upload.maximum_ram_size"}
+ENV_DUMP_MODE_OFF            = "off"
+ENV_DUMP_MODE_SCRIPTS        = "scripts"
+ENV_DUMP_MODE_FULL           = "full"
 REM_PIO_UPLOAD_START         = "Rem begin pio upload command\n"
 REM_PIO_UPLOAD_END           = "\nRem end pio upload command"
 
@@ -33,8 +83,8 @@ REM_PIO_UPLOAD_END           = "\nRem end pio upload command"
 # Functions
 # ------------------
 
-def get_upload_script(env, p_path_to_copy_n_paste=''):
-    ''' Prepare upload batch script '''
+def get_upload_script(env, p_release):
+    ''' Prepare upload batch script, adding the files it uses to the release "bin/" folder '''
     out_str = r'''@echo off
 Rem Terminal Setup
 color F0
@@ -59,7 +109,9 @@ if exist "bin" (
 )
 
 '''
-    upload_cmd_str = pio_tools.get_from_env_recursive(env, env['UPLOADCMD'], p_path_to_copy_n_paste)
+    upload_cmd_str, files_to_copy = env_resolver.resolve_env_value(env, env['UPLOADCMD'], True)
+    for file_i in sorted(files_to_copy):
+        p_release.add_file(file_i, "bin/" + os.path.basename(file_i))
     upload_cmd_str = upload_cmd_str.replace('python.exe', r'%PYTHON_DIR%')
     upload_cmd_str = upload_cmd_str.replace('--port ', '')
     upload_cmd_str = upload_cmd_str.replace('$UPLOAD_PORT', '')
@@ -71,8 +123,7 @@ if exist "bin" (
 
     fmw_path = pio_tools.get_default_firmware_path(env)
     md5_value = get_firmware_md5( fmw_path )
-    with open( p_path_to_copy_n_paste + "firmware.md5", "w", encoding='UTF-8') as file:
-        file.write( md5_value )
+    p_release.add_bytes( "bin/firmware.md5", md5_value )
 
     out_str += r'''
 
@@ -99,10 +150,23 @@ EXIT /B 0
 def filter_list_of_files_pending_commit(all_changed_files = None):
     ''' Filter invalid files from list '''
     if all_changed_files is None:
-        all_changed_files = git_tools.get_files_pending_commit()
+        all_changed_files = change_tools.get_files_pending_commit()
     filtered_changed_files = [x for x in all_changed_files if is_valid_changed_file(x)]
     return filtered_changed_files
 
+def is_dirty_tree() -> bool:
+    ''' Check if there are changes pending commit, ignoring the ones from firmware info '''
+    return len( filter_list_of_files_pending_commit() ) > 0
+
+def is_new_commit() -> bool:
+    ''' Check if HEAD differs from the commit recorded in the firmware info '''
+    try:
+        with open( CUR_FMW_INFO, 'r', encoding='UTF-8' ) as file:
+            recorded_commit = json.loads( file.read() ).get('GIT_Commit', '')
+    except Exception:
+        recorded_commit = ''
+    return recorded_commit.replace("'","") != git_tools.get_git_commit().replace("'","")
+
 def is_valid_changed_file( file_name:str ) -> bool:
     ''' Check if file changed in repository shall not be ignored '''
     if ".bin" in file_name:
@@ -117,19 +181,22 @@ def is_valid_changed_file( file_name:str ) -> bool:
 
 def get_firmware_md5( p_file_path ):
     ''' Calculate firmware.bin MD5 checksum '''
-    content = open(p_file_path, "rb").read()
-    md5_hash = md5()
-    md5_hash.update(content)
-    digest = md5_hash.hexdigest()
+    digest = hash_tools.get_file_digests(p_file_path)['md5']
     return str(digest).capitalize()
 
-def zipdir( p_zip_name:str , p_folder_path:str ):
+@perf_tools.timed("zipdir")
+def zipdir( p_zip_name:str , p_folder_path:str, p_method=None, p_level=None ) -> dict:
     ''' Zip a folder '''
-    with zipfile.ZipFile( p_zip_name , 'w', zipfile.ZIP_DEFLATED ) as ziph:
-        for root, _, files in os.walk( p_folder_path ):
-            for file in files:
-                file_path = os.path.join(root, file)
-                ziph.write( file_path , file_path[len(p_folder_path):] )
+    release = release_tools.ReleaseManifest()
+    release.add_tree( p_folder_path, '' )
+    return release.write( p_zip_name, p_method, p_level )
+
+def get_release_compression( env ):
+    ''' Get (method, level) from custom_release_compression[_level] options '''
+    method = pio_tools.get_project_option(env, "custom_release_compression",
+                                          release_tools.DEFAULT_COMPRESSION)
+    level  = pio_tools.get_project_option(env, "custom_release_compression_level", None)
+    return method, level
 
 def delete_inside_folder( folder_name:str, list_to_ignore=None ):
     ''' Delete every file inside folder, except the files in list '''
@@ -153,14 +220,52 @@ def delete_inside_folder( folder_name:str, list_to_ignore=None ):
         except Exception as excep:
             print(f'Failed to delete {file_path}. Reason: {excep}')
 
+def write_file_if_changed( p_file_path, p_text:str ) -> bool:
+    ''' Write text file only when its content changes, keeping its mtime otherwise '''
+    if os.path.isfile(p_file_path):
+        with open(p_file_path, 'r', encoding='utf-8') as file:
+            if file.read() == p_text:
+                return False
+    # Write and rename, so parallel builds never read a half written file
+    tmp_path = f"{p_file_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as file:
+        file.write(p_text)
+    os.replace(tmp_path, p_file_path)
+    return True
+
+def get_fmw_info_mode( env ) -> str:
+    ''' Get custom_fmw_info_mode: "source" regenerates lib/firmware_info, "patch" patches the .elf '''
+    mode = str(pio_tools.get_project_option(env, "custom_fmw_info_mode", FMW_INFO_MODE_SOURCE))
+    mode = mode.strip().lower()
+    return FMW_INFO_MODE_PATCH if mode == FMW_INFO_MODE_PATCH else FMW_INFO_MODE_SOURCE
+
+def get_fmw_info_stamp_path( env ) -> str:
+    ''' Stamp file the .elf depends on in "patch" mode '''
+    return os.path.join( env_resolver.resolve_env_value(env, "$BUILD_DIR")[0], FMW_INFO_STAMP_FILE )
+
+def get_fmw_info_record_values( info:dict, epoch:int ) -> dict:
+    ''' Get values patched into the firmware info record '''
+    return fmw_info_tools.get_record_values(
+        info, get_custom_fmw_tag(info), get_fmw_number_version(info),
+        get_fmw_board_name(info), epoch )
+
 def save_new_json_version( new_info: dict ) -> dict:
-    ''' Update firmware information to JSON '''
-    if os.path.exists( OLD_FMW_INFO ):
-        os.remove( OLD_FMW_INFO )
+    ''' Update firmware information JSON (previous content goes to the backup) and the build ledger,
+        only when it changes '''
+    new_text = json.dumps(new_info, indent=4, sort_keys=False)
+    old_text = None
     if os.path.exists( CUR_FMW_INFO ):
-        os.rename( CUR_FMW_INFO, OLD_FMW_INFO )
-    with open( CUR_FMW_INFO , 'w', encoding='UTF-8') as file:
-        file.write( json.dumps(new_info, indent=4, sort_keys=False) )
+        with open( CUR_FMW_INFO, 'r', encoding='UTF-8' ) as file:
+            old_text = file.read()
+    if old_text == new_text:
+        return new_info
+    if old_text is not None:
+        write_file_if_changed( OLD_FMW_INFO, old_text )
+    write_file_if_changed( CUR_FMW_INFO, new_text )
+    try:
+        build_ledger.record_fmw_info( new_info )
+    except Exception as excep:
+        print(f'Failed to record firmware info in {build_ledger.LEDGER_FILE}. Reason: {excep}')
     return new_info
 
 def get_custom_fmw_tag( info: dict ) -> str:
@@ -193,7 +298,7 @@ def get_path_to_platform() -> str:
 def get_elf_file(env):
     ''' Get firmware.elf file path '''
     try:
-        build_dir = Path( pio_tools.get_from_env_recursive(env, "$BUILD_DIR") )
+        build_dir = Path( env_resolver.resolve_env_value(env, "$BUILD_DIR")[0] )
         elf_file = build_dir / "firmware.elf"
         if os.path.isfile( elf_file ):
             return os.path.realpath( elf_file )
@@ -212,57 +317,172 @@ def get_list_of_files_to_copy(env):
         output.append( elf_file )
     return output
 
-def move_bin_files( env, p_out_folder ):
-    ''' Move binary files related to the firmware to a release folder '''
+@perf_tools.timed("move_bin_files")
+def move_bin_files( env, p_release ):
+    ''' Add binary files related to the firmware to the release '''
 
-    # First extract the zip folder
+    # Start from the zip folder members, still compressed
     zip_path = FIRMWARE_USB_UPDATE_ZIP_ALT
     if os.path.exists(FIRMWARE_USB_UPDATE_ZIP_MAIN):
         zip_path = FIRMWARE_USB_UPDATE_ZIP_MAIN
-    with zipfile.ZipFile( zip_path, 'r' ) as zip_ref:
-        zip_ref.extractall( p_out_folder )
-
-    # Create a binary folder
-    binary_folder = p_out_folder + "bin/"
-    if not os.path.exists(binary_folder):
-        os.makedirs( binary_folder )
+    p_release.add_zip_members( zip_path )
 
-    # Copy every file to the binary folder
+    # Add every file to the binary folder
     for dir_i in get_list_of_files_to_copy(env):
         if isinstance(dir_i, str):
-            if not os.path.exists(dir_i):
+            dir_i = [dir_i]
+        for file_j in dir_i:
+            if not os.path.exists(file_j):
                 continue
-            if os.path.isfile(dir_i):
-                shutil.copy2(dir_i, binary_folder)
+            if os.path.isfile(file_j):
+                p_release.add_file(file_j, "bin/" + os.path.basename(file_j))
             else:
-                shutil.copytree(dir_i, binary_folder)
-        else:
-            for file_j in dir_i:
-                if not os.path.exists(dir_i):
-                    continue
-                if os.path.isfile(file_j):
-                    shutil.copy2(file_j, binary_folder)
-                else:
-                    shutil.copytree(file_j, binary_folder)
+                p_release.add_tree(file_j, "bin")
 
     # Prepare Upload Script
-    script_str = get_upload_script(env, binary_folder)
-    script_str = fix_zip_file(env, script_str, p_out_folder)
-    with open(p_out_folder + "fmw_upload.bat", 'w', encoding='UTF-8') as dir_i:
-        dir_i.write(script_str)
+    script_str = get_upload_script(env, p_release)
+    script_str = fix_zip_file(env, script_str, p_release)
+    uses_esptool = 'esptool' in env.get('UPLOADER', '').lower()
+    with_sectors = add_sector_manifest(env, p_release) and uses_esptool
+    with_runner  = add_upload_runner(env, p_release, script_str)
+    # sector_tools.py also reads the flash MD5 for the upload runner
+    if( with_sectors or ( with_runner and uses_esptool ) ):
+        p_release.add_file( SECTOR_TOOLS_FILE, "bin/" + os.path.basename(SECTOR_TOOLS_FILE) )
+    if with_sectors:
+        script_str = add_upload_option( script_str, "diff", "writes only the flash sectors that changed",
+                                        r"%PYTHON_DIR% sector_tools.py flash sectors.json %2" )
+    if with_runner:
+        script_str = add_upload_option( script_str, "multi", "flashes many boards at once",
+                                        r"%PYTHON_DIR% upload_runner.py run %2 %3 %4 %5 %6 %7 %8 %9" )
+    p_release.add_bytes("fmw_upload.bat", script_str)
+
+def get_flash_images( env ) -> list:
+    ''' Get [(flash offset, image path)] written by the upload: the app and, on ESP32,
+        bootloader, partition table and other FLASH_EXTRA_IMAGES '''
+    images = []
+    if 'FLASH_EXTRA_IMAGES' in env:
+        for offset, image_path in env['FLASH_EXTRA_IMAGES']:
+            images.append( (env_resolver.resolve_env_value(env, str(offset))[0],
+                            env_resolver.resolve_env_value(env, str(image_path))[0]) )
+    else:
+        # "<offset> <image>" pairs of the uploader flags (esptool write_flash)
+        flags = env_resolver.resolve_env_value(env, "$UPLOADERFLAGS")[0].replace('"', '').split()
+        images += [ (flags[i], flags[i + 1]) for i in range(len(flags) - 1)
+                    if( flags[i].lower().startswith("0x") and os.path.isfile(flags[i + 1]) ) ]
+    fmw_path = pio_tools.get_default_firmware_path(env)
+    if fmw_path.endswith(".bin"):
+        app_offset = ""
+        if 'ESP32_APP_OFFSET' in env:
+            app_offset = env_resolver.resolve_env_value(env, "$ESP32_APP_OFFSET")[0].strip()
+        elif hasattr(env, 'BoardConfig'):
+            app_offset = str( env.BoardConfig().get("upload.offset_address", "0") )
+        images.append( (app_offset or "0", fmw_path) )
+    return [ (int(offset, 0), path) for offset, path in images if os.path.isfile(path) ]
+
+@perf_tools.timed("sectors")
+def add_sector_manifest( env, p_release ) -> bool:
+    ''' Add per flash sector hashes of every image to the release, returns True if added '''
+    if not pio_tools.get_project_flag(env, "custom_sector_manifest", True):
+        return False
+    try:
+        images = get_flash_images(env)
+        if len(images) == 0:
+            return False
+        manifest = sector_tools.create_manifest(images)
+    except Exception as excep:
+        print(f'Failed to create {sector_tools.SECTOR_MANIFEST_FILE}. Reason: {excep}')
+        return False
+    p_release.add_bytes( "bin/" + sector_tools.SECTOR_MANIFEST_FILE, json.dumps(manifest, separators=(',', ':')) )
+    return True
+
+def add_upload_option( script_str:str, option:str, description:str, command:str ) -> str:
+    ''' Let "fmw_upload.bat <option> ..." run command instead of the upload '''
+    option_str = f'''Rem "fmw_upload.bat {option}" {description}
+if /I "%~1"=="{option}" (
+	{command}
+	goto :end_of_upload
+)
+
+'''
+    script_str = script_str.replace(REM_PIO_UPLOAD_START, option_str + REM_PIO_UPLOAD_START, 1)
+    end_label = REM_PIO_UPLOAD_END + "\n:end_of_upload"
+    if end_label in script_str:
+        return script_str
+    return script_str.replace(REM_PIO_UPLOAD_END, end_label, 1)
+
+def get_upload_runner_config( env, script_str:str ):
+    ''' Get upload_runner.json: the upload command of the batch script, with the serial port
+        (esptool) or probe serial number (openocd) of each board as {target}, or None '''
+    start_index = script_str.index(REM_PIO_UPLOAD_START) + len(REM_PIO_UPLOAD_START)
+    upload_cmd  = script_str[start_index : script_str.index(REM_PIO_UPLOAD_END)]
+    command     = [ x.strip('"').replace('\\', '/') for x in shlex.split(upload_cmd, posix=False) ]
+    command     = [ '{python}' if x == '%PYTHON_DIR%' else x for x in command ]
+    fmw_path    = pio_tools.get_default_firmware_path(env)
+    config      = {
+        'version'     : upload_runner.RUNNER_CONFIG_VER,
+        'firmware'    : os.path.basename(fmw_path),
+        'target_kind' : upload_runner.TARGET_KIND_PORT,
+        'command'     : command,
+        'verify'      : None,
+    }
+    uploader   = env.get('UPLOADER', '').lower()
+    esptool_i  = [ i for i, x in enumerate(command) if x.lower().endswith("esptool.py") ]
+    program_i  = [ i for i, x in enumerate(command) if( ( i > 0 ) and x.startswith("program ") ) ]
+    if( ( 'esptool' in uploader ) and esptool_i ):
+        command[esptool_i[0] + 1 : esptool_i[0] + 1] = ["--port", "{target}"]
+        app_offsets = [ offset for offset, image_path in get_flash_images(env)
+                        if os.path.realpath(image_path) == os.path.realpath(fmw_path) ]
+        if app_offsets:
+            config['verify'] = [ "{python}", os.path.basename(SECTOR_TOOLS_FILE), "md5", hex(app_offsets[0]),
+                                 str(os.path.getsize(fmw_path)), "--port", "{target}" ]
+    elif( ( 'openocd' in uploader ) and program_i ):
+        # The probe is picked before "program", the image is read back from its flash address
+        command[program_i[0] - 1 : program_i[0] - 1] = ["-c", "adapter serial {target}"]
+        config['target_kind'] = upload_runner.TARGET_KIND_PROBE
+        address = re.search(r'^program\s+\S+\s+(0x[0-9a-fA-F]+)\b', command[program_i[0] + 2])
+        if address:
+            config['verify'] = command[: program_i[0] + 1] + [
+                "-c", f"init; reset halt; dump_image {{{{readback}}}} {address.group(1)} "
+                      f"{os.path.getsize(fmw_path)}; reset run; shutdown" ]
+    else:
+        return None
+    return config
+
+def add_upload_runner( env, p_release, script_str:str ) -> bool:
+    ''' Add the multi-board upload runner to the release, returns True if added '''
+    if not pio_tools.get_project_flag(env, "custom_upload_runner", True):
+        return False
+    try:
+        config = get_upload_runner_config(env, script_str)
+    except Exception as excep:
+        print(f'Failed to create {upload_runner.RUNNER_CONFIG_FILE}. Reason: {excep}')
+        return False
+    if config is None:
+        return False
+    p_release.add_file( UPLOAD_RUNNER_FILE, "bin/" + os.path.basename(UPLOAD_RUNNER_FILE) )
+    p_release.add_bytes( "bin/" + upload_runner.RUNNER_CONFIG_FILE, json.dumps(config, indent=4) )
+    return True
+
+def add_tool_folder(env, p_release, folder_path, arc_prefix):
+    ''' Add an uploader tool package to the release, from the precompressed tool cache '''
+    method, level = get_release_compression(env)
+    cache_folder  = os.path.join(get_path_to_platform(), TOOL_CACHE_FOLDER)
+    tool_cache.add_tool_bundle(p_release, folder_path, arc_prefix, cache_folder, method, level)
 
-def fix_zip_file_esptool(env, binary_folder, new_pio_upload):
+@perf_tools.timed("fix_zip_file_esptool")
+def fix_zip_file_esptool(env, p_release, new_pio_upload):
     ''' Fix zip file when using esptool '''
     # Move whole 'tool-esptoolpy' folder to zip
     uploader_path = env['UPLOADER']
     if "tool-esptoolpy" in uploader_path.lower():
-        folder_path = uploader_path[:uploader_path.rindex('\\')]
-        shutil.copytree(folder_path, binary_folder + "tool-esptoolpy\\")
-        os.remove( binary_folder + "esptool.py" )
+        folder_path = os.path.dirname(uploader_path)
+        add_tool_folder(env, p_release, folder_path, "bin/tool-esptoolpy")
+        p_release.remove("bin/esptool.py")
         new_pio_upload = new_pio_upload.replace('esptool.py', '"tool-esptoolpy\\esptool.py"')
     return new_pio_upload
 
-def fix_zip_file_openocd(env, binary_folder, new_pio_upload, p_out_folder):
+@perf_tools.timed("fix_zip_file_openocd")
+def fix_zip_file_openocd(env, p_release, new_pio_upload):
     ''' Fix zip file when using openocd '''
     # Tested with 'stlink' in env['UPLOAD_PROTOCOL'].lower()
 
@@ -300,20 +520,20 @@ def fix_zip_file_openocd(env, binary_folder, new_pio_upload, p_out_folder):
                 break
         return cmd
 
-    env_paths     = env.get("ENV",'')["PATH"].split(';')
+    env_paths     = env.get("ENV",'')["PATH"].split(os.pathsep)
     uploader_path = env.get('UPLOADER','')
     for path_i in env_paths:
         if 'openocd' in path_i:
             uploader_path  = path_i
-            folder_path    = uploader_path[ : uploader_path.rindex('\\') ]
+            folder_path    = os.path.dirname(uploader_path)
             new_pio_upload = new_pio_upload.replace('openocd', '\"tool-openocd/bin/openocd\"',1)
             new_pio_upload = new_pio_upload.replace(folder_path, r'tool-openocd',1)
-            shutil.copytree(folder_path, binary_folder + "tool-openocd\\")
+            add_tool_folder(env, p_release, folder_path, "bin/tool-openocd")
             # Copy .elf too for STM32CubeProgrammer
             if 'PROGPATH' in env:
                 elf_path = env.subst('$PROGPATH')
                 if( os.path.isfile(elf_path) and '.elf' in elf_path ):
-                    shutil.copy2(elf_path, p_out_folder)
+                    p_release.add_file(elf_path, os.path.basename(elf_path))
                     # Use .elf instead of .bin
                     new_pio_upload = new_pio_upload.replace('firmware.bin', '../firmware.elf')
 
@@ -326,32 +546,29 @@ def fix_zip_file_openocd(env, binary_folder, new_pio_upload, p_out_folder):
             break
     return new_pio_upload
 
-def fix_zip_file(env, script_str, p_out_folder) -> str:
+def fix_zip_file(env, script_str, p_release) -> str:
     ''' Fix zip file for current platform and board '''
-    binary_folder = p_out_folder + "bin/"
-
     pio_upload_start_index = script_str.index(REM_PIO_UPLOAD_START) + len(REM_PIO_UPLOAD_START)
     pio_upload_end_index   = script_str.index(REM_PIO_UPLOAD_END  )
     pio_upload             = script_str[pio_upload_start_index : pio_upload_end_index]
     new_pio_upload         = pio_upload
 
     if 'esptool' in env['UPLOAD_PROTOCOL'].lower():
-        new_pio_upload = fix_zip_file_esptool(env, binary_folder, new_pio_upload)
+        new_pio_upload = fix_zip_file_esptool(env, p_release, new_pio_upload)
     elif 'openocd' == env['UPLOADER'].lower():
-        new_pio_upload = fix_zip_file_openocd(env, binary_folder, new_pio_upload, p_out_folder)
+        new_pio_upload = fix_zip_file_openocd(env, p_release, new_pio_upload)
 
     script_str = script_str.replace(pio_upload, new_pio_upload, 1)
     return script_str
 
-def get_fmw_info( p_file_name, env )->dict:
+@perf_tools.timed("get_fmw_info")
+def get_fmw_info( p_file_name, env, p_save=True )->dict:
     ''' Load Firmware Info JSON File '''
     data_out = json.loads(
 '''
 {
     "Version": "1.0.0",
     "Description": "",
-    "Board": "",
-    "PIOENV": "",
     "Date": "",
     "GIT_Project": "",
     "GIT_Version": "",
@@ -365,24 +582,25 @@ def get_fmw_info( p_file_name, env )->dict:
     if os.path.exists( p_file_name ):
         with open( p_file_name, 'r', encoding='UTF-8' ) as file:
             data_out = json.loads( file.read() )
+    # Env values live in the info of each env only (see get_env_fmw_info)
+    for field in FMW_INFO_ENV_FIELDS:
+        data_out.pop(field, None)
     # Override
-    data_out['Board']       = env.get('BOARD',"")
-    data_out['PIOENV']      = env.get('PIOENV',"").replace("-","_").upper()
     data_out['GIT_Project'] = git_tools.get_git_proj_name()
     data_out['GIT_Branch']  = git_tools.get_git_branch()
     data_out['GIT_Commit']  = git_tools.get_git_commit()
     data_out['GIT_Origin']  = git_tools.get_git_origin()
+    if not p_save:
+        return data_out
 
     # Create or refresh json
-    with open( CUR_FMW_INFO , 'w', encoding='UTF-8') as file:
-        file.write( json.dumps(data_out, indent=4, sort_keys=False) )
+    write_file_if_changed( CUR_FMW_INFO, json.dumps(data_out, indent=4, sort_keys=False) )
     # Create backup if it does not exist
     if not os.path.exists( OLD_FMW_INFO ):
-        with open( OLD_FMW_INFO , 'w', encoding='UTF-8') as file:
-            file.write( json.dumps(data_out, indent=4, sort_keys=False) )
+        write_file_if_changed( OLD_FMW_INFO, json.dumps(data_out, indent=4, sort_keys=False) )
     return data_out
 
-def get_new_fmw_info( p_old_info, env ) -> dict:
+def get_new_fmw_info( p_old_info ) -> dict:
     ''' Increase version from old firmware information '''
     data_out    = p_old_info
     old_version = p_old_info['Version'].strip().split('.')
@@ -398,37 +616,111 @@ def get_new_fmw_info( p_old_info, env ) -> dict:
     data_out['GIT_Branch']  = git_tools.get_git_branch()
     data_out['GIT_Commit']  = git_tools.get_git_commit()
     data_out['GIT_Origin']  = git_tools.get_git_origin()
-    data_out['Board']       = env.get('BOARD',"")
-    data_out['PIOENV']      = env.get('PIOENV',"").replace("-","_").upper()
     return data_out
 
+def get_env_fmw_info( p_shared_info:dict, env ) -> dict:
+    ''' Get firmware info of an env: the shared info with the board and env it is built for '''
+    env_values = {
+        'Board'  : env.get('BOARD',""),
+        'PIOENV' : env.get('PIOENV',"").replace("-","_").upper(),
+    }
+    data_out = {}
+    for key, value in p_shared_info.items():
+        data_out[key] = value
+        if key == 'Description':
+            data_out.update(env_values)
+    data_out.update(env_values)
+    return data_out
 
-def pre_build_action(source, target, env):
-    # pylint: disable=unused-argument
-    ''' Pre Build PlatformIO Action '''
-    print("\tUpdate firmware info? [y/n]")
-    if not input().lower().strip().startswith('y'):
-        return
+def is_fmw_version_increased( p_info:dict ) -> bool:
+    ''' Check if the version was increased since the last commit (the committed firmware info
+        has another version), so pending changes are already accounted for '''
+    committed = git_tools.get_committed_file( CUR_FMW_INFO )
+    if committed is None:
+        return False
+    try:
+        return json.loads(committed).get('Version') != p_info['Version']
+    except Exception:
+        return False
+
+
+def update_shared_fmw_info( env, files_pending_commit:list ) -> dict:
+    ''' Increase the shared version if there are changes pending commit, once per commit.
+        Call it holding FMW_INFO_LOCK_FILE, envs built in parallel read-modify-write the same file:
+        files_pending_commit was listed before the lock, the firmware info state is checked again '''
     old_info = get_fmw_info( CUR_FMW_INFO, env )
     new_info = old_info
-
-    # Handle Pending Changes
-    files_pending_commit = git_tools.get_files_pending_commit()
     filtered_list_pending_commit = filter_list_of_files_pending_commit( files_pending_commit )
     if len(filtered_list_pending_commit) > 0:
-        if OLD_FMW_INFO in files_pending_commit:
+        if( ( OLD_FMW_INFO in files_pending_commit ) or
+            ( pio_tools.load_run_cache(FMW_VERSION_RUN_CACHE) == old_info['Version'] ) or
+            is_fmw_version_increased( old_info ) ):
             print("\tFirmware info has already been updated!")
         else:
             print("\tPending changes to commit.\n\tFirmware info is going to be updated!")
             for i,file_i in enumerate( filtered_list_pending_commit ):
                 print(f"\t\tChanged file[%02d]: {file_i}" % (i+1))
-            new_info = get_new_fmw_info( old_info, env )
+            new_info = get_new_fmw_info( old_info )
+            pio_tools.save_run_cache( FMW_VERSION_RUN_CACHE, new_info['Version'] )
     else:
         print("\tNO pending changes to commit.\n\tFirmware info is NOT going to be updated!")
+    new_info.pop('build_epoch', None)
+    new_info.pop('elf_sha256', None)
+    return save_new_json_version( new_info )
+
+def get_env_fmw_info_path( env ) -> str:
+    ''' Firmware info of one env: the shared one plus what only this env built '''
+    return FMW_INFO_ENV_FOLDER + env.get('PIOENV',"unknown") + ".json"
+
+def load_env_fmw_info( env ) -> dict:
+    ''' Load firmware info the env was built with, or the shared one if the env has none '''
+    try:
+        with open( get_env_fmw_info_path(env), 'r', encoding='UTF-8' ) as file:
+            return json.loads( file.read() )
+    except Exception:
+        return get_env_fmw_info( get_fmw_info(CUR_FMW_INFO, env, p_save=False), env )
+
+def save_env_fmw_info( env, info:dict ):
+    ''' Save firmware info of one env '''
+    os.makedirs( FMW_INFO_ENV_FOLDER, exist_ok=True )
+    write_file_if_changed( get_env_fmw_info_path(env), json.dumps(info, indent=4, sort_keys=False) )
+
+def get_fmw_info_sources_folder( env ) -> Path:
+    ''' Folder of the generated firmware_info.h/.c: shared lib/firmware_info/ or one per env '''
+    mode = str( pio_tools.get_project_option(env, "custom_fmw_info_sources", FMW_INFO_SOURCES_SHARED) )
+    if mode.strip().lower() != FMW_INFO_SOURCES_ENV:
+        return Path( os.path.realpath(FMW_INFO_LIB_FOLDER) )
+    build_dir = env_resolver.resolve_env_value(env, "$BUILD_DIR")[0]
+    return Path( os.path.realpath(os.path.join(build_dir, FMW_INFO_ENV_SOURCES_FOLDER)) )
+
+def add_env_fmw_info_sources( env, sources_folder:Path ):
+    ''' Build per env firmware info sources with the project, instead of lib/firmware_info/ '''
+    for file_name in ["firmware_info.h", "firmware_info.c"]:
+        lib_file = os.path.join(FMW_INFO_LIB_FOLDER, file_name)
+        if os.path.isfile(lib_file):
+            print(f"\tRemoving {lib_file}, firmware info sources are generated per env")
+            os.remove(lib_file)
+    if hasattr(env, 'BuildSources'):
+        env.Append( CPPPATH=[str(sources_folder)] )
+        env.BuildSources( str(sources_folder.parent / "obj"), str(sources_folder) )
+
+@perf_tools.timed("pre_build_action")
+def pre_build_action(source, target, env):
+    # pylint: disable=unused-argument
+    ''' Pre Build PlatformIO Action '''
+    if not update_policy.decide( env, is_dirty_tree, is_new_commit ):
+        save_env_fmw_info( env, load_env_fmw_info(env) )
+        return
+
+    # Handle Pending Changes
+    with perf_tools.phase("pending_changes"):
+        files_pending_commit = change_tools.get_files_pending_commit()
+    with pio_tools.file_lock( FMW_INFO_LOCK_FILE ):
+        new_info = get_env_fmw_info( update_shared_fmw_info(env, files_pending_commit), env )
     build_time = int(time.time())
     board_name = get_fmw_board_name(new_info)
     new_info['build_epoch'] = build_time
-    save_new_json_version( new_info )
+    save_env_fmw_info( env, new_info )
 
     print()
     print("\tFirmware Version          =", new_info['Version']      )
@@ -447,8 +739,26 @@ def pre_build_action(source, target, env):
     }
 
     #for key,val in macro_values.items(): env['SRC_BUILD_FLAGS'].append(f"'-D {key} = {val}'")
-    lib_folder = Path( os.path.realpath("lib/firmware_info/") )
-    os.makedirs(lib_folder.absolute(), exist_ok=True)
+    with perf_tools.phase("fmw_info_sources"):
+        lib_folder = get_fmw_info_sources_folder(env)
+        os.makedirs(lib_folder.absolute(), exist_ok=True)
+        if get_fmw_info_mode(env) == FMW_INFO_MODE_PATCH:
+            # Sources stay the same, values are patched into the .elf after linking
+            lib_h_txt, lib_c_txt = fmw_info_tools.get_patch_mode_sources(
+                f'NAVITAS_PROJECT_BOARD_{board_name.upper()}' )
+            stamp_values = get_fmw_info_record_values(new_info, 0)
+            stamp_path   = get_fmw_info_stamp_path(env)
+            os.makedirs(os.path.dirname(stamp_path), exist_ok=True)
+            write_file_if_changed(stamp_path, json.dumps(stamp_values, indent=4))
+        else:
+            lib_h_txt, lib_c_txt = get_source_mode_sources(macro_values)
+        write_file_if_changed(lib_folder / "firmware_info.h", lib_h_txt)
+        write_file_if_changed(lib_folder / "firmware_info.c", lib_c_txt)
+        if lib_folder != Path( os.path.realpath(FMW_INFO_LIB_FOLDER) ):
+            add_env_fmw_info_sources(env, lib_folder)
+
+def get_source_mode_sources( macro_values:dict ):
+    ''' Get (firmware_info.h, firmware_info.c) text with every value compiled in '''
     lib_c_txt = '''#include "firmware_info.h"
 
 
@@ -488,46 +798,320 @@ extern "C" {
 }
 #endif
     '''
-    with open(lib_folder / "firmware_info.h", 'w', encoding='utf-8') as file:
-        file.write(lib_h_txt)
-    with open(lib_folder / "firmware_info.c", 'w', encoding='utf-8') as file:
-        file.write(lib_c_txt)
+    return lib_h_txt, lib_c_txt
+
+def post_link_action(source, target, env):
+    # pylint: disable=unused-argument
+    ''' Patch firmware info record into the linked .elf ("patch" mode) '''
+    info   = load_env_fmw_info( env )
+    values = get_fmw_info_record_values( info, info.get('build_epoch', int(time.time())) )
+    for target_i in target:
+        elf_path = str(target_i)
+        patched  = fmw_info_tools.patch_record( elf_path, values )
+        if patched == 0:
+            print(f"\tFirmware info record not found in {elf_path}!")
+        else:
+            print(f"\tFirmware info patched into {os.path.basename(elf_path)}: {values['version']}")
+
+def is_upload_targeted() -> bool:
+    ''' Check if the SCons command line uploads (never outside SCons) '''
+    try:
+        return script_entry.has_cmd_line_target("upload")
+    except ImportError:
+        return False
 
+def get_release_packaging_mode( env ) -> str:
+    ''' Get custom_release_packaging: background (default), sync or detached. Background
+        packaging only overlaps an upload, a build without one packages synchronously '''
+    mode = str( pio_tools.get_project_option(env, "custom_release_packaging",
+                                             package_scheduler.PACKAGING_MODE_BACKGROUND) ).strip().lower()
+    if mode not in package_scheduler.PACKAGING_MODES:
+        print(f'\tUnknown custom_release_packaging "{mode}", packaging in background')
+        mode = package_scheduler.PACKAGING_MODE_BACKGROUND
+    if( ( mode == package_scheduler.PACKAGING_MODE_BACKGROUND ) and ( not is_upload_targeted() ) ):
+        # Nothing to overlap: a packaging failure fails the build, like before the upload
+        mode = package_scheduler.PACKAGING_MODE_SYNC
+    return mode
+
+@perf_tools.timed("post_build_action")
 def post_build_action(source, target, env):
     # pylint: disable=unused-argument
-    ''' PlatformIO PostBuildProgram Callback '''
+    ''' PlatformIO PostBuildProgram Callback, also run after upload: the release of a build is
+        packaged once (in background by default, see custom_release_packaging) '''
+    env_name = env.get('PIOENV',"unknown")
+    if package_scheduler.get_job(env_name) is not None:
+        # Upload after the build: its release is already packaged, or being packaged
+        return None if package_scheduler.join(env_name) else 1
     print( "\n", "-"*70, "\n\n", "\tPost Build Action Script")
+    build_dir = env_resolver.resolve_env_value(env, "$BUILD_DIR")[0]
+    with perf_tools.phase("env_snapshot"):
+        snapshot = env_snapshot.save_env_snapshot( env, env_snapshot.get_env_snapshot_path(build_dir) )
+    footprint, over_budget = get_firmware_footprint( env, RELEASE_OUTPUT_FOLDER + env_name + "/" )
+    mode = get_release_packaging_mode(env)
+    if mode == package_scheduler.PACKAGING_MODE_SYNC:
+        package_scheduler.submit( env_name, lambda: package_release(env, p_footprint=footprint), mode )
+    else:
+        # Packaged from the snapshot, SCons goes on with the upload meanwhile
+        release_env = env_snapshot.EnvSnapshot(snapshot)
+        if mode == package_scheduler.PACKAGING_MODE_DETACHED:
+            load_release_fmw_info( env, p_save_info=True )
+        package_scheduler.submit( env_name, lambda: package_release(release_env, p_footprint=footprint), mode,
+                                  [sys.executable, os.path.realpath(__file__), "-d", os.getcwd(),
+                                   "release", "-e", env_name, "-j", "1"] )
+    print( "\n", "-"*70, "\n" )
+    if is_over_budget_failure(env, over_budget):
+        print("\tFirmware exceeds its memory budget:\n\t\t" + "\n\t\t".join(over_budget))
+        return 1
+    return None
 
-    print("\t>> Getting Firmware Info")
-    new_info = get_fmw_info( CUR_FMW_INFO, env )
+def is_over_budget_failure( env, over_budget:list ) -> bool:
+    ''' True if the build fails: a budget is exceeded and custom_footprint_budget_action is fail '''
+    action = str( pio_tools.get_project_option(env, "custom_footprint_budget_action", FOOTPRINT_ACTION_WARN) )
+    return bool(over_budget) and ( action.strip().lower() == FOOTPRINT_ACTION_FAIL )
+
+def get_footprint_budgets( env ) -> dict:
+    ''' Get {region: bytes or None} from custom_flash_budget/custom_ram_budget, in bytes
+        ("320K", "1M") or percentage of the board maximum ("90%") '''
+    budgets = {}
+    for region, board_key in FOOTPRINT_BOARD_MAXIMUMS.items():
+        value = str( pio_tools.get_project_option(env, f"custom_{region}_budget", "") ).strip()
+        budgets[region] = None
+        try:
+            if value.endswith('%'):
+                maximum = env.BoardConfig().get(board_key, None) if hasattr(env, 'BoardConfig') else None
+                if maximum:
+                    budgets[region] = int( int(maximum) * float(value[:-1]) / 100.0 )
+            else:
+                budgets[region] = elf_tools.parse_size(value)
+        except Exception as excep:
+            print(f'Invalid custom_{region}_budget "{value}". Reason: {excep}')
+    return budgets
+
+@perf_tools.timed("footprint")
+def get_firmware_footprint( env, p_zip_folder:str ):
+    ''' Get (footprint of the .elf, budget messages), printing how it changed since the previous build '''
+    elf_file = get_elf_file(env)
+    if( ( elf_file is None ) or ( not pio_tools.get_project_flag(env, "custom_footprint_report", True) ) ):
+        return None, []
+    try:
+        footprint = elf_tools.get_footprint(elf_file)
+    except Exception as excep:
+        print(f'Failed to read footprint of {elf_file}. Reason: {excep}')
+        return None, []
+    footprint['elf_sha256'] = hash_tools.get_file_digests(elf_file)['sha256']
+
+    # Compare with the previous build, even when the same build is packaged again (upload)
+    report_path = p_zip_folder + FOOTPRINT_FILE
+    previous    = None
+    try:
+        with open(report_path, 'r', encoding='UTF-8') as file:
+            previous = json.loads(file.read())
+        if previous.get('elf_sha256') == footprint['elf_sha256']:
+            previous = previous.get('previous')
+        else:
+            previous.pop('previous', None)
+        if( ( previous is not None ) and ( previous.get('version') != footprint['version'] ) ):
+            previous = None
+    except Exception:
+        pass
+    diff    = None if previous is None else elf_tools.diff_footprints(previous, footprint)
+    budgets = get_footprint_budgets(env)
+    print("\t>> Footprint of", os.path.basename(elf_file))
+    for line in elf_tools.get_summary(footprint, diff, budgets).splitlines():
+        print("\t\t" + line)
+    over_budget = elf_tools.check_budgets(footprint, budgets)
+    for message in over_budget:
+        print("\t>> WARNING:", message)
+    os.makedirs(p_zip_folder, exist_ok=True)
+    write_file_if_changed( report_path, json.dumps(dict(footprint, previous=previous)) )
+    return footprint, over_budget
+
+def load_release_history( p_history_folder:str ) -> list:
+    ''' Load [{version, sha256, file}] of previous release images, oldest first '''
+    try:
+        with open(os.path.join(p_history_folder, RELEASE_HISTORY_FILE), 'r', encoding='UTF-8') as file:
+            return json.loads(file.read())
+    except Exception:
+        return []
+
+def record_release_history( p_history_folder:str, p_fmw_path:str, p_version:str ):
+    ''' Keep a copy of the released image, for deltas of the next releases '''
+    history = load_release_history(p_history_folder)
+    sha256  = hash_tools.get_file_digests(p_fmw_path)['sha256']
+    if( history and ( history[-1]['sha256'] == sha256 ) ):
+        return
+    os.makedirs(p_history_folder, exist_ok=True)
+    image_name = sha256[:16] + os.path.splitext(p_fmw_path)[1]
+    shutil.copy2(p_fmw_path, os.path.join(p_history_folder, image_name))
+    history = [x for x in history if x['sha256'] != sha256]
+    history.append( {'version': p_version, 'sha256': sha256, 'file': image_name} )
+    history = history[-RELEASE_HISTORY_SIZE:]
+    # Forget images and deltas of releases no longer in history
+    kept_files = [x['file'] for x in history] + [RELEASE_HISTORY_FILE]
+    kept_ids   = [x['sha256'][:16] for x in history]
+    for file_name in os.listdir(p_history_folder):
+        # Deltas are named "<source id>-<target id>.delta[.json]"
+        delta_ids = file_name.split('.')[0].split('-')
+        if( ( file_name in kept_files ) or
+            ( ( len(delta_ids) == 2 ) and ( delta_ids[0] in kept_ids ) and ( delta_ids[1] in kept_ids ) ) ):
+            continue
+        os.remove(os.path.join(p_history_folder, file_name))
+    tmp_path = os.path.join(p_history_folder, f"{RELEASE_HISTORY_FILE}.{os.getpid()}.tmp")
+    with open(tmp_path, 'w', encoding='UTF-8') as file:
+        file.write( json.dumps(history, indent=4) )
+    os.replace(tmp_path, os.path.join(p_history_folder, RELEASE_HISTORY_FILE))
+
+@perf_tools.timed("delta")
+def add_firmware_delta( p_release, p_history_folder:str, p_fmw_path:str, p_version:str ):
+    ''' Add a delta from the previous release image to the new one, with the tool to apply it '''
+    sha256 = hash_tools.get_file_digests(p_fmw_path)['sha256']
+    base   = None
+    for entry in reversed( load_release_history(p_history_folder) ):
+        if( ( entry['sha256'] != sha256 ) and
+            os.path.isfile(os.path.join(p_history_folder, entry['file'])) ):
+            base = entry
+            break
+    if base is None:
+        print("\t>> No previous release image, skipping delta")
+        return
+    delta_path = os.path.join(p_history_folder, f"{base['sha256'][:16]}-{sha256[:16]}.delta")
+    stats_path = delta_path + ".json"
+    try:
+        with open(stats_path, 'r', encoding='UTF-8') as file:
+            stats = json.loads(file.read())
+        if not os.path.isfile(delta_path):
+            raise FileNotFoundError(delta_path)
+    except Exception:
+        stats = delta_tools.create_delta(os.path.join(p_history_folder, base['file']), p_fmw_path, delta_path)
+        with open(stats_path, 'w', encoding='UTF-8') as file:
+            file.write( json.dumps(stats, indent=4) )
+
+    image_name = os.path.basename(p_fmw_path)
+    manifest   = dict(stats,
+        format         = f"navitas-delta-{delta_tools.DELTA_VERSION}",
+        source_version = base['version'],
+        target_version = p_version,
+        image          = "bin/" + image_name,
+        delta          = DELTA_ARC_FOLDER + image_name + ".delta",
+        apply          = f"python {DELTA_ARC_FOLDER}delta_tools.py apply <{base['version']} {image_name}> "
+                         f"{DELTA_ARC_FOLDER}{image_name}.delta {image_name}",
+    )
+    p_release.add_file( delta_path, manifest['delta'] )
+    p_release.add_file( DELTA_TOOLS_FILE, DELTA_ARC_FOLDER + "delta_tools.py" )
+    p_release.add_bytes( DELTA_ARC_FOLDER + "delta_manifest.json", json.dumps(manifest, indent=4) )
+    print(f"\t>> Delta from {base['version']}: {stats['delta_size'] / 1024:.1f} KB "
+          f"({stats['ratio'] * 100:.1f}% of {image_name})")
+
+def load_release_fmw_info( env, p_save_info=True ) -> dict:
+    ''' Load firmware info of the env with the SHA-256 of its .elf, saving it if p_save_info '''
+    new_info = load_env_fmw_info( env )
     elf_file = get_elf_file(env)
     if elf_file is not None:
-        with open(elf_file, 'rb') as file:
-            elf_data = file.read()
-            elf_sha256 = sha256(elf_data).hexdigest()
-            new_info['elf_sha256'] = elf_sha256
-            save_new_json_version( new_info )
+        new_info['elf_sha256'] = hash_tools.get_file_digests(elf_file)['sha256']
+        if p_save_info:
+            save_env_fmw_info( env, new_info )
+    return new_info
 
-    print("\t>> Moving Files to Release Folder")
-    output_folder = RELEASE_OUTPUT_FOLDER + "v" + get_custom_fmw_tag( new_info ) + "/"
-    move_bin_files( env, output_folder )
+@perf_tools.timed("package_release")
+def package_release( env, p_save_info=True, p_footprint=None ) -> str:
+    ''' Create release zip of an env, returns the zip path '''
+    print("\t>> Getting Firmware Info")
+    new_info = load_release_fmw_info( env, p_save_info )
+
+    print("\t>> Collecting Release Files")
+    release = release_tools.ReleaseManifest()
+    move_bin_files( env, release )
+    release.add_bytes( "bin/" + os.path.basename(CUR_FMW_INFO),
+                       json.dumps(new_info, indent=4, sort_keys=False) )
+    if p_footprint is not None:
+        release.add_bytes( "bin/" + FOOTPRINT_FILE, json.dumps(p_footprint, indent=1) )
 
-    print("\t>> Zipping everything together")
     zip_name   = new_info['GIT_Project'] + "_v" + get_custom_fmw_tag( new_info ) + '.zip'
     zip_folder = RELEASE_OUTPUT_FOLDER + env.get('PIOENV',"unknown") + "/"
-    os.makedirs( zip_folder, exist_ok=True )
-    zipdir( zip_folder + zip_name , output_folder )
-    shutil.rmtree( output_folder )
-    delete_inside_folder( zip_folder, [zip_name] )
-
-    print( "\n", "-"*70, "\n" )
+    fmw_path   = pio_tools.get_default_firmware_path(env)
+    with_delta = pio_tools.get_project_flag(env, "custom_release_delta") and os.path.isfile(fmw_path)
+    if with_delta:
+        add_firmware_delta( release, zip_folder + RELEASE_HISTORY_FOLDER, fmw_path,
+                            get_custom_fmw_tag(new_info) )
+    fingerprint_path = zip_folder + RELEASE_FINGERPRINT_FILE
+    method, level    = get_release_compression(env)
+    with perf_tools.phase("fingerprint"):
+        fingerprint  = release.get_fingerprint(method, level)
+    if release_tools.is_release_up_to_date(fingerprint_path, zip_folder + zip_name,
+                                           fingerprint, len(release.entries)):
+        print("\t>> Skipping zip: firmware, firmware info, upload command and tools "
+              f"did not change since {zip_name} was created")
+    else:
+        print("\t>> Zipping everything together")
+        os.makedirs( zip_folder, exist_ok=True )
+        with perf_tools.phase("zip"):
+            stats = release.write( zip_folder + zip_name, method, level )
+        print("\t>> Compressed", release_tools.get_stats_summary(stats))
+        release_tools.save_fingerprint(fingerprint_path, zip_folder + zip_name,
+                                       fingerprint, stats['members'])
+    if with_delta:
+        record_release_history( zip_folder + RELEASE_HISTORY_FOLDER, fmw_path, get_custom_fmw_tag(new_info) )
+    if pio_tools.get_project_flag(env, "custom_release_store", True):
+        store_release( env, zip_folder + zip_name, fingerprint, new_info )
+    if pio_tools.get_project_flag(env, "custom_build_ledger", True):
+        record_build( release, new_info, zip_folder + zip_name, p_footprint )
+    delete_inside_folder( zip_folder, [zip_name, RELEASE_FINGERPRINT_FILE, RELEASE_HISTORY_FOLDER, FOOTPRINT_FILE] +
+                                      perf_tools.get_output_files() )
+    return zip_folder + zip_name
+
+def record_build( p_release, p_info:dict, p_zip_path:str, p_footprint:dict = None ):
+    ''' Record the build in the build ledger, with digests of the binaries and phase timings '''
+    artifacts = {}
+    for arcname, (kind, value) in p_release.entries.items():
+        if( ( kind == release_tools.ReleaseManifest.FILE ) and ( arcname.count('/') == 1 ) and
+            arcname.startswith("bin/") ):
+            artifacts[arcname[len("bin/"):]] = hash_tools.get_file_digests(value)
+    try:
+        build_ledger.record_build( p_info, get_custom_fmw_tag(p_info), artifacts,
+                                   perf_tools.get_phases(), p_zip_path, p_footprint )
+    except Exception as excep:
+        print(f'Failed to record build in {build_ledger.LEDGER_FILE}. Reason: {excep}')
+
+@perf_tools.timed("store")
+def store_release( env, p_zip_path:str, p_fingerprint:str, p_info:dict ):
+    ''' Keep release zip in the release store, evicting old releases of the env '''
+    env_name = env.get('PIOENV',"unknown")
+    store    = release_store.ReleaseStore()
+    try:
+        if store.has_release(env_name, os.path.basename(p_zip_path), p_fingerprint):
+            return
+        store.add_release( p_zip_path, env_name, p_info, p_fingerprint )
+        evicted = store.evict( env_name,
+            int( pio_tools.get_project_option(env, "custom_release_store_keep", release_store.DEFAULT_MAX_RELEASES) ),
+            float( pio_tools.get_project_option(env, "custom_release_store_max_mb", release_store.DEFAULT_MAX_MB) ) )
+        print(f"\t>> Release stored ({len(store.list_releases(env_name))} kept"
+              + (f", {evicted} evicted" if evicted else "") + ")")
+    except Exception as excep:
+        print(f'Failed to store release {p_zip_path}. Reason: {excep}')
+
+def configure_perf_tools( env ):
+    ''' Enable instrumentation from custom_perf_report / custom_perf_profile options '''
+    mode    = pio_tools.get_project_option(env, "custom_perf_report", perf_tools.PERF_MODE_OFF)
+    perf_tools.configure( mode,
+                          pio_tools.get_project_flag(env, "custom_perf_profile"),
+                          RELEASE_OUTPUT_FOLDER + env.get('PIOENV',"unknown") + "/",
+                          env.get('PIOENV',"") )
+
+def configure_warm_helper( env ):
+    ''' Query the warm helper process (started on first use) when custom_warm_helper is enabled '''
+    if not pio_tools.get_project_flag(env, "custom_warm_helper"):
+        return
+    warm_helper.configure( True, float( pio_tools.get_project_option(env, "custom_warm_helper_idle",
+                                                                     warm_helper.DEFAULT_IDLE_TIMEOUT) ) )
 
 def pre_extra_script_main(env):
     ''' Script to be executed in pre_extra_script '''
-    if env.GetOption('clean'):
-        return
-    if pio_tools.has_cmd_line_target(["idedata", "debug"]):
+    if not script_entry.is_pre_script_needed(env):
         return
+    configure_perf_tools(env)
+    configure_warm_helper(env)
+    # The release of the previous build may still be read from the build folder
+    package_scheduler.wait_for_packaging( env.get('PIOENV',"unknown") )
     #env.AddPreAction("buildprog", pre_build_action)
     pre_build_action(None, None, env)
 
@@ -535,9 +1119,177 @@ def post_extra_script_main(env, projenv):
     # pylint: disable=unused-argument
     ''' Script to be executed in post_extra_script '''
     #env.AddPreAction("buildprog", pre_build_action)
+    configure_perf_tools(env)
+    configure_warm_helper(env)
+    if get_fmw_info_mode(env) == FMW_INFO_MODE_PATCH:
+        elf_target = "$BUILD_DIR/${PROGNAME}${PROGSUFFIX}"
+        env.Depends(elf_target, get_fmw_info_stamp_path(env))
+        env.AddPostAction(elf_target, post_link_action)
     env.AddPostAction("buildprog", post_build_action)
     env.AddPostAction("upload", post_build_action)
 
-if __name__ == "__main__":
+def save_env_dumps( env, projenv ):
+    ''' Save compressed env/projenv dumps for debug, when custom_env_dump is enabled '''
+    mode = str( pio_tools.get_project_option(env, "custom_env_dump", ENV_DUMP_MODE_OFF) ).strip().lower()
+    if mode in [ENV_DUMP_MODE_OFF, '', 'no', 'false', '0']:
+        return
+    if mode not in [ENV_DUMP_MODE_SCRIPTS, ENV_DUMP_MODE_FULL]:
+        mode = ENV_DUMP_MODE_SCRIPTS
+    with perf_tools.phase("env_dump"):
+        for name, env_i in [('env', env), ('projenv', projenv)]:
+            dump_path = env_snapshot.get_env_dump_path(env.get('PIOENV',"unknown"), name)
+            diff = env_snapshot.save_env_dump(env_i, dump_path, mode == ENV_DUMP_MODE_FULL)
+            if diff is None:
+                print(f"\t>> {name} dump saved to {dump_path}")
+            else:
+                print(f"\t>> {name} dump saved to {dump_path}: {len(diff['changed'])} changed, "
+                      f"{len(diff['added'])} added, {len(diff['removed'])} removed since last build")
+
+def find_built_envs( p_build_folder=BUILD_OUTPUT_FOLDER ) -> dict:
+    ''' Find {env name: env snapshot path or None} of every env inside .pio/build/ '''
+    envs = {}
+    if not os.path.isdir(p_build_folder):
+        return envs
+    for env_name in sorted(os.listdir(p_build_folder)):
+        build_dir = os.path.join(p_build_folder, env_name)
+        if not os.path.isdir(build_dir):
+            continue
+        snapshot_path = env_snapshot.get_env_snapshot_path(build_dir)
+        if os.path.isfile(snapshot_path):
+            envs[env_name] = snapshot_path
+        elif os.path.isfile(os.path.join(build_dir, IDEDATA_FILE)):
+            envs[env_name] = None
+    return envs
+
+def _package_release_from_snapshot( p_snapshot_path ) -> str:
+    ''' Process pool worker: package one env from its snapshot '''
+    env = env_snapshot.load_env_snapshot(p_snapshot_path)
+    configure_perf_tools(env)
+    configure_warm_helper(env)
+    env_name = env.get('PIOENV',"unknown")
+    with pio_tools.file_lock( package_scheduler.get_lock_path(env_name), package_scheduler.PACKAGING_LOCK_TIMEOUT ):
+        footprint, over_budget = get_firmware_footprint( env, RELEASE_OUTPUT_FOLDER + env_name + "/" )
+        zip_path = package_release( env, p_save_info=False, p_footprint=footprint )
+    if is_over_budget_failure(env, over_budget):
+        raise RuntimeError(f"{zip_path} exceeds its memory budget: " + ", ".join(over_budget))
+    return zip_path
+
+def release_cli_main( p_args ) -> int:
+    ''' Package every built env in parallel, without SCons '''
+    envs = find_built_envs()
+    if p_args.environment:
+        envs = {k: v for k, v in envs.items() if k in p_args.environment}
+    for env_name in [k for k, v in envs.items() if v is None]:
+        print(f"\t{env_name}: no {env_snapshot.ENV_SNAPSHOT_FILE}, build it once with post_extra_script")
+        envs.pop(env_name)
+    if len(envs) == 0:
+        print("\tNo built environment found inside", BUILD_OUTPUT_FOLDER)
+        return 1
+
+    failed = 0
+    from concurrent.futures import ProcessPoolExecutor #pylint: disable=C0415
+    with ProcessPoolExecutor(max_workers=p_args.jobs) as pool:
+        futures = {env_name: pool.submit(_package_release_from_snapshot, snapshot_path)
+                   for env_name, snapshot_path in envs.items()}
+        for env_name, future in futures.items():
+            try:
+                print(f"\t{env_name}: {future.result()}")
+            except Exception as excep:
+                failed += 1
+                print(f"\t{env_name}: FAILED. Reason: {excep}")
+    return 1 if failed else 0
+
+def store_cli_main( p_args ) -> int:
+    ''' List stored releases or write one back as a zip '''
+    store = release_store.ReleaseStore()
+    if p_args.store_command == "get":
+        manifest = store.find_release(p_args.environment, p_args.name)
+        if manifest is None:
+            print(f"\tRelease {p_args.name} of {p_args.environment} not found in", store.root)
+            return 1
+        zip_path = p_args.output or os.path.join(RELEASE_OUTPUT_FOLDER, p_args.environment, manifest['zip_name'])
+        print("\t" + store.materialize(manifest, zip_path))
+        return 0
+    if p_args.store_command == "gc":
+        print(f"\t{store.collect_garbage() / (1024 * 1024):.1f} MB freed")
+        return 0
+    for manifest in store.list_releases(p_args.environment):
+        created = datetime.datetime.fromtimestamp(manifest['created']).strftime("%Y-%m-%d %H:%M")
+        print(f"\t{manifest['env']:<24} {created}  {manifest['zip_name']}")
+    print(f"\tStore size: {store.get_size() / (1024 * 1024):.1f} MB")
+    return 0
+
+def ledger_cli_main( p_args ) -> int:
+    ''' List builds of the build ledger '''
+    if not os.path.isfile(build_ledger.LEDGER_FILE):
+        print("\tNo build ledger in", build_ledger.LEDGER_FILE)
+        return 1
+    if p_args.trend:
+        for created, version_name, size, wall_ms in build_ledger.get_size_trend(
+                p_args.environment or "", p_args.trend, p_args.limit):
+            created = datetime.datetime.fromtimestamp(created).strftime("%Y-%m-%d %H:%M")
+            timing  = "" if wall_ms is None else f"{wall_ms:10.0f} ms"
+            print(f"\t{created}  {version_name:<48} {size:>10} B {timing}")
+        return 0
+    builds = build_ledger.find_builds( p_args.environment, None if p_args.contains else p_args.commit,
+                                       p_args.version, p_args.limit if not p_args.contains else -1 )
+    if p_args.contains:
+        # Oldest build of each env whose commit contains the requested one
+        found    = {}
+        contains = git_tools.get_commits_containing(p_args.contains)
+        for build in reversed(builds):
+            if( ( build['env'] not in found ) and contains(build['git_commit']) ):
+                found[build['env']] = build
+        builds = list(found.values())
+    for build in builds:
+        created = datetime.datetime.fromtimestamp(build['created']).strftime("%Y-%m-%d %H:%M")
+        print(f"\t{created}  {build['env']:<16} {build['version_name']:<48} {build['zip_name'] or ''}")
+    return 0 if builds else 1
+
+def cli_main( p_argv=None ) -> int:
+    ''' Command line entry point '''
+    import argparse #pylint: disable=C0415
+    parser = argparse.ArgumentParser(description="Navitas PlatformIO firmware manager")
+    parser.add_argument("-d", "--project-dir", default=".", help="PlatformIO project folder")
+    commands = parser.add_subparsers(dest="command")
+    commands.add_parser("info", help="show Git information (default)")
+    release_parser = commands.add_parser("release", help="package release zips of built envs")
+    release_parser.add_argument("-e", "--environment", action="append",
+                                help="env to package, may be repeated (default: every built env)")
+    release_parser.add_argument("-j", "--jobs", type=int, default=None,
+                                help="number of parallel processes (default: CPU count)")
+    store_parser = commands.add_parser("store", help="stored releases of every env")
+    store_commands = store_parser.add_subparsers(dest="store_command")
+    list_parser = store_commands.add_parser("list", help="list stored releases (default)")
+    list_parser.add_argument("-e", "--environment", help="only releases of this env")
+    get_parser = store_commands.add_parser("get", help="write a stored release zip")
+    get_parser.add_argument("-e", "--environment", required=True, help="env of the release")
+    get_parser.add_argument("name", help="zip name or part of it, like the version")
+    get_parser.add_argument("-o", "--output", help="zip path (default: inside .pio/release/<env>/)")
+    store_commands.add_parser("gc", help="delete objects no stored release uses")
+    ledger_parser = commands.add_parser("ledger", help="builds recorded in the build ledger")
+    ledger_parser.add_argument("-e", "--environment", help="only builds of this env")
+    ledger_parser.add_argument("-c", "--commit", help="only builds of this commit (or hash prefix)")
+    ledger_parser.add_argument("-v", "--version", help="only builds of this version (e.g. 1.2.3)")
+    ledger_parser.add_argument("--contains", metavar="COMMIT",
+                               help="first build of each env containing this commit")
+    ledger_parser.add_argument("--trend", metavar="ARTIFACT",
+                               help="size and build time of an artifact of -e env "
+                                    "(e.g. firmware.bin, or flash/ram of the .elf)")
+    ledger_parser.add_argument("-n", "--limit", type=int, default=20, help="number of builds")
+    args = parser.parse_args(p_argv)
+    os.chdir(args.project_dir)
+    if args.command == "release":
+        return release_cli_main(args)
+    if args.command == "ledger":
+        return ledger_cli_main(args)
+    if args.command == "store":
+        if args.store_command is None:
+            args.environment = None
+        return store_cli_main(args)
     git_tools.show_git_info()
     input("Enter to continue...")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit( cli_main() )
@@ -0,0 +1,170 @@
+'''
+    PlatformIO Advanced Script for NavitasTecnologia
+    See: https://docs.platformio.org/en/latest/scripting/actions.html
+
+    "patch" mode of lib/firmware_info: the C sources reserve a fixed-layout,
+    magic-tagged record that is filled in the linked .elf, so the sources
+    never change between builds and no-change builds do not recompile/relink.
+'''
+# pylint: disable=broad-except
+# ------------------
+# Importing Modules
+# ------------------
+import os
+import mmap
+import struct
+
+# ------------------
+# Constants
+# ------------------
+FMW_INFO_MAGIC         = b"NAVITAS_FMWINFO\0"
+FMW_INFO_LAYOUT        = 1
+FMW_INFO_FIELDS        = [
+    # (field, C type, size)
+    ('magic'          , 'char'    , 16),
+    ('layout'         , 'uint32_t', 4 ),
+    ('version_number' , 'uint32_t', 4 ),
+    ('epoch'          , 'uint32_t', 4 ),
+    ('version'        , 'char'    , 64),
+    ('gmt_date'       , 'char'    , 24),
+    ('commit'         , 'char'    , 16),
+    ('board_name'     , 'char'    , 32),
+]
+FMW_INFO_MACROS        = {
+    'NAVITAS_PROJECT_VERSION'        : 'version',
+    'NAVITAS_PROJECT_VERSION_NUMBER' : 'version_number',
+    'NAVITAS_PROJECT_GMT_DATE'       : 'gmt_date',
+    'NAVITAS_PROJECT_EPOCH'          : 'epoch',
+    'NAVITAS_PROJECT_COMMIT'         : 'commit',
+    'NAVITAS_PROJECT_BOARD_NAME'     : 'board_name',
+}
+ELF_MAGIC              = b"\x7fELF"
+ELF_DATA_BIG_ENDIAN    = 2
+
+# ------------------
+# Functions
+# ------------------
+def _get_record_format( endianness:str ) -> str:
+    ''' struct format of the record '''
+    return endianness + "".join(
+        f"{size}s" if c_type == 'char' else 'I' for _, c_type, size in FMW_INFO_FIELDS )
+
+def get_record_values( info:dict, version_name:str, version_number:int, board_name:str,
+                       epoch:int ) -> dict:
+    ''' Get record field values from firmware info '''
+    return {
+        'version_number' : int(version_number),
+        'epoch'          : int(epoch),
+        'version'        : version_name,
+        'gmt_date'       : info.get('Date', ''),
+        'commit'         : info.get('GIT_Commit', ''),
+        'board_name'     : board_name,
+    }
+
+def pack_record( values:dict, endianness:str = '<' ) -> bytes:
+    ''' Pack record, truncating strings so they stay null terminated '''
+    packed = []
+    for field, c_type, size in FMW_INFO_FIELDS:
+        if field == 'magic':
+            packed.append(FMW_INFO_MAGIC)
+        elif field == 'layout':
+            packed.append(FMW_INFO_LAYOUT)
+        elif c_type == 'char':
+            packed.append( str(values.get(field, '')).encode('UTF-8')[:size - 1] )
+        else:
+            packed.append( int(values.get(field, 0)) & 0xFFFFFFFF )
+    return struct.pack(_get_record_format(endianness), *packed)
+
+def get_patch_mode_sources( board_flag:str ):
+    ''' Get (firmware_info.h, firmware_info.c) text; only the board flag varies between builds '''
+    struct_txt = "".join(
+        f"    {c_type:<8} {field}[{size}];\n" if c_type == 'char' else f"    {c_type:<8} {field};\n"
+        for field, c_type, size in FMW_INFO_FIELDS )
+    macros_txt = "".join(
+        f"#define k{macro:<31} (navitas_fmw_info()->{field})\n"
+        for macro, field in FMW_INFO_MACROS.items() )
+    init_txt = "".join(
+        f'    "{FMW_INFO_MAGIC[:-1].decode()}",\n' if field == 'magic' else
+        f'    {FMW_INFO_LAYOUT}u,\n' if field == 'layout' else
+        '    "",\n' if c_type == 'char' else '    0u,\n'
+        for field, c_type, _ in FMW_INFO_FIELDS )
+    lib_h_txt = f'''///
+/// @file firmware_info.h
+/// @author wrgallo@hotmail.com
+/// @brief Firmware Info, patched into the firmware after linking
+///
+#pragma once
+
+#ifdef __cplusplus
+extern "C" {{
+#endif
+
+#include <stdint.h>
+#include <stdbool.h>
+
+typedef struct {{
+{struct_txt}}} navitas_fmw_info_t;
+
+const navitas_fmw_info_t * navitas_fmw_info(void);
+
+{macros_txt}
+extern const bool     k{board_flag};
+
+#ifdef __cplusplus
+}}
+#endif
+'''
+    lib_c_txt = f'''#include "firmware_info.h"
+
+/* Filled by the post-link step, do not edit */
+__attribute__((used)) const navitas_fmw_info_t kNAVITAS_FMW_INFO = {{
+{init_txt}}};
+
+const navitas_fmw_info_t * navitas_fmw_info(void)
+{{
+    const navitas_fmw_info_t * info = &kNAVITAS_FMW_INFO;
+    /* Hide the initializer from the optimizer (and LTO) */
+    __asm__ volatile("" : "+r"(info));
+    return info;
+}}
+
+const bool     k{board_flag} = 1;
+'''
+    return lib_h_txt, lib_c_txt
+
+def patch_record( file_path:str, values:dict ) -> int:
+    ''' Write values into every record found in an .elf or .bin, returns records patched '''
+    patched = 0
+    with open(file_path, 'r+b') as file:
+        with mmap.mmap(file.fileno(), 0) as data:
+            endianness = '<'
+            if( ( data[:4] == ELF_MAGIC ) and ( data[5] == ELF_DATA_BIG_ENDIAN ) ):
+                endianness = '>'
+            layout = struct.pack(endianness + 'I', FMW_INFO_LAYOUT)
+            record = pack_record(values, endianness)
+            offset = data.find(FMW_INFO_MAGIC + layout)
+            while offset >= 0:
+                data[offset : offset + len(record)] = record
+                patched += 1
+                offset = data.find(FMW_INFO_MAGIC + layout, offset + len(record))
+            data.flush()
+    return patched
+
+def read_record( file_path:str ):
+    ''' Read values of the first record found in an .elf or .bin, or None '''
+    if not os.path.isfile(file_path):
+        return None
+    with open(file_path, 'rb') as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            endianness = '<'
+            if( ( data[:4] == ELF_MAGIC ) and ( data[5] == ELF_DATA_BIG_ENDIAN ) ):
+                endianness = '>'
+            offset = data.find(FMW_INFO_MAGIC + struct.pack(endianness + 'I', FMW_INFO_LAYOUT))
+            if offset < 0:
+                return None
+            record_format = _get_record_format(endianness)
+            raw = struct.unpack(record_format, data[offset : offset + struct.calcsize(record_format)])
+    values = {}
+    for (field, c_type, _), value in zip(FMW_INFO_FIELDS, raw):
+        values[field] = value.split(b'\0')[0].decode('UTF-8', 'replace') if c_type == 'char' else value
+    return values
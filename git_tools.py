@@ -6,8 +6,313 @@
 # ------------------
 # Importing Modules
 # ------------------
+import os
+import zlib
 import subprocess
+import pio_tools
+import perf_tools
+import warm_helper
 
+# ------------------
+# Constants
+# ------------------
+GIT_SNAPSHOT_RUN_CACHE = "git_snapshot"
+GIT_BACKEND_ENV_VAR    = "NAVITAS_GIT_BACKEND"  # auto, python or subprocess
+GIT_DEFAULT_ABBREV     = 7
+
+# ------------------
+# Snapshot
+# ------------------
+_SNAPSHOT_CACHE = {}
+
+class GitSnapshot:
+    ''' Repository metadata collected at once '''
+    FIELDS = ['project', 'version', 'branch', 'commit', 'origin', 'has_commits']
+
+    def __init__(self, project='', version='', branch='', commit='', origin='', has_commits=False):
+        self.project     = project
+        self.version     = version
+        self.branch      = branch
+        self.commit      = commit
+        self.origin      = origin
+        self.has_commits = has_commits
+
+    def as_dict(self) -> dict:
+        ''' Get snapshot as a JSON serializable dict '''
+        return {key: getattr(self, key) for key in self.FIELDS}
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        ''' Create snapshot from a dict created with as_dict() '''
+        return cls(**{key: data[key] for key in cls.FIELDS if key in data})
+
+def _run_git( args ):
+    ''' Run git without a shell, returning (return code, stdout) '''
+    try:
+        proc = subprocess.run(
+            ['git'] + args,
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=False )
+        return proc.returncode, proc.stdout.decode(errors='replace').strip()
+    except Exception:
+        return -1, ''
+
+def query_git_snapshot() -> GitSnapshot:
+    ''' Collect every Git field with four concurrent git calls '''
+    # Imports logging, only the subprocess backend needs it
+    from concurrent.futures import ThreadPoolExecutor #pylint: disable=C0415
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        rev_parse = pool.submit(_run_git, ['rev-parse', '--show-toplevel', '--abbrev-ref', 'HEAD'])
+        commit    = pool.submit(_run_git, ['log', '--pretty=format:%h', '-n', '1'])
+        describe  = pool.submit(_run_git, ['describe', '--tags', '--abbrev=0'])
+        origin    = pool.submit(_run_git, ['config', '--get', 'remote.origin.url'])
+        rev_parse_rc, rev_parse_out = rev_parse.result()
+        commit_rc   , commit_out    = commit.result()
+        describe_rc , describe_out  = describe.result()
+        origin_rc   , origin_out    = origin.result()
+
+    # rev-parse still prints the toplevel when HEAD has no commits
+    lines    = rev_parse_out.splitlines()
+    snapshot = GitSnapshot()
+    snapshot.has_commits = ( rev_parse_rc == 0 ) and ( commit_rc == 0 ) and ( len(lines) == 2 )
+    if len(lines) > 0:
+        snapshot.project = lines[0].replace('\\', '/').split('/')[-1]
+    if snapshot.has_commits:
+        snapshot.branch  = lines[1]
+        snapshot.commit  = commit_out.replace("'", "")
+        if describe_rc == 0:
+            snapshot.version = describe_out
+        if origin_rc == 0:
+            snapshot.origin = origin_out
+    return snapshot
+
+# ------------------
+# Pure-Python Reader
+# ------------------
+def find_git_dir( path='.' ):
+    ''' Find (toplevel, git_dir, common_dir), following "gitdir:" files used by submodules '''
+    current = os.path.realpath(path)
+    while True:
+        dot_git = os.path.join(current, '.git')
+        if os.path.isdir(dot_git):
+            git_dir = dot_git
+            break
+        if os.path.isfile(dot_git):
+            content = _read_text(dot_git)
+            if not content.startswith('gitdir:'):
+                return None
+            git_dir = os.path.realpath( os.path.join(current, content[len('gitdir:'):].strip()) )
+            break
+        parent = os.path.dirname(current)
+        if parent == current:
+            return None
+        current = parent
+    common_dir = git_dir
+    commondir_file = os.path.join(git_dir, 'commondir')
+    if os.path.isfile(commondir_file):
+        common_dir = os.path.realpath( os.path.join(git_dir, _read_text(commondir_file)) )
+    return current, git_dir, common_dir
+
+def _read_text( path ) -> str:
+    ''' Read a small text file from the git directory '''
+    with open(path, 'r', encoding='UTF-8', errors='replace') as file:
+        return file.read().strip()
+
+def _read_git_config( common_dir, file_name='config' ) -> dict:
+    ''' Parse .git/config (or another git config file) into {"section.subsection.key": value} '''
+    config  = {}
+    section = ''
+    try:
+        lines = _read_text( os.path.join(common_dir, file_name) ).splitlines()
+    except Exception:
+        return config
+    for line in lines:
+        line = line.strip()
+        if( ( line == '' ) or line.startswith(('#', ';')) ):
+            continue
+        if line.startswith('['):
+            header  = line[1:line.index(']')] if ']' in line else line[1:]
+            name, _, subsection = header.strip().partition(' ')
+            section = name.lower()
+            if subsection:
+                section += '.' + subsection.strip().strip('"')
+            continue
+        key, _, value = line.partition('=')
+        value = value.strip()
+        if value.startswith('"') and value.endswith('"') and len(value) > 1:
+            value = value[1:-1]
+        config[ f"{section}.{key.strip().lower()}" ] = value
+    return config
+
+def get_excludes_file( common_dir ) -> str:
+    ''' Get core.excludesFile path: repository config, then global configs, then the XDG default '''
+    xdg_home = os.environ.get('XDG_CONFIG_HOME') or os.path.join(os.path.expanduser('~'), '.config')
+    for folder, file_name in [(common_dir, 'config'), (os.path.expanduser('~'), '.gitconfig'),
+                              (os.path.join(xdg_home, 'git'), 'config')]:
+        excludes_file = _read_git_config(folder, file_name).get('core.excludesfile')
+        if excludes_file:
+            return os.path.expanduser(excludes_file)
+    return os.path.join(xdg_home, 'git', 'ignore')
+
+def _read_packed_refs( common_dir ):
+    ''' Parse packed-refs into ({ref: sha}, {ref: peeled sha}) '''
+    refs   = {}
+    peeled = {}
+    packed_refs = os.path.join(common_dir, 'packed-refs')
+    if not os.path.isfile(packed_refs):
+        return refs, peeled
+    last_ref = None
+    for line in _read_text(packed_refs).splitlines():
+        if line.startswith('#') or ( line.strip() == '' ):
+            continue
+        if line.startswith('^'):
+            if last_ref is not None:
+                peeled[last_ref] = line[1:].strip()
+            continue
+        sha, _, ref = line.partition(' ')
+        refs[ref.strip()] = sha.strip()
+        last_ref = ref.strip()
+    return refs, peeled
+
+def _resolve_ref( git_dir, common_dir, ref, packed_refs, depth=0 ):
+    ''' Resolve a (possibly symbolic) ref to a full SHA1, or None '''
+    if depth > 5:
+        return None
+    for base in [git_dir, common_dir]:
+        ref_path = os.path.join(base, ref)
+        if os.path.isfile(ref_path):
+            value = _read_text(ref_path)
+            if value.startswith('ref:'):
+                return _resolve_ref(git_dir, common_dir, value[4:].strip(), packed_refs, depth + 1)
+            return value
+    return packed_refs.get(ref)
+
+def _read_loose_tag_target( common_dir, sha ):
+    ''' Peel a loose annotated tag object, or None if it is not a loose tag '''
+    object_path = os.path.join(common_dir, 'objects', sha[:2], sha[2:])
+    if not os.path.isfile(object_path):
+        return None
+    with open(object_path, 'rb') as file:
+        raw = zlib.decompressobj().decompress( file.read(), 4096 )
+    header, _, body = raw.partition(b'\0')
+    if not header.startswith(b'tag '):
+        return sha
+    first_line = body.split(b'\n', 1)[0].decode()
+    if first_line.startswith('object '):
+        return first_line[len('object '):].strip()
+    return None
+
+def _read_tags( common_dir, packed_refs, packed_peeled ) -> dict:
+    ''' Get {tag name: peeled commit SHA1 or None when it can not be peeled} '''
+    tags = {}
+    for ref, sha in packed_refs.items():
+        if ref.startswith('refs/tags/'):
+            tags[ ref[len('refs/tags/'):] ] = packed_peeled.get(ref, sha)
+    tags_dir = os.path.join(common_dir, 'refs', 'tags')
+    for root, _, files in os.walk(tags_dir):
+        for file_name in files:
+            tag_path = os.path.join(root, file_name)
+            tag_name = os.path.relpath(tag_path, tags_dir).replace('\\', '/')
+            try:
+                tags[tag_name] = _read_loose_tag_target(common_dir, _read_text(tag_path))
+            except Exception:
+                tags[tag_name] = None
+    return tags
+
+def _get_abbrev_length( common_dir, config: dict ) -> int:
+    ''' Mimic git's core.abbrev=auto: half the bits of the packed object count '''
+    abbrev = config.get('core.abbrev', 'auto')
+    if abbrev.isdigit():
+        return max(4, int(abbrev))
+    count     = 0
+    packs_dir = os.path.join(common_dir, 'objects', 'pack')
+    if os.path.isdir(packs_dir):
+        for file_name in os.listdir(packs_dir):
+            if not file_name.endswith('.idx'):
+                continue
+            with open(os.path.join(packs_dir, file_name), 'rb') as file:
+                header = file.read(8 + 256 * 4)
+            fanout_end = 8 + 256 * 4 if header[:4] == b'\377tOc' else 256 * 4
+            count += int.from_bytes(header[fanout_end - 4 : fanout_end], 'big')
+    return max(GIT_DEFAULT_ABBREV, ( count.bit_length() + 1 ) // 2)
+
+def read_git_snapshot( path='.' ):
+    ''' Read a GitSnapshot straight from the .git directory, without spawning git.
+        Returns None when there is no repository; "version" is None when
+        it needs a describe walk that only the git binary can do. '''
+    found = find_git_dir(path)
+    if found is None:
+        return None
+    toplevel, git_dir, common_dir = found
+    config = _read_git_config(common_dir)
+    packed_refs, packed_peeled = _read_packed_refs(common_dir)
+
+    snapshot = GitSnapshot()
+    snapshot.project = os.path.basename(toplevel)
+    head = _read_text( os.path.join(git_dir, 'HEAD') )
+    if head.startswith('ref:'):
+        head_ref  = head[4:].strip()
+        head_sha  = _resolve_ref(git_dir, common_dir, head_ref, packed_refs)
+        snapshot.branch = head_ref[len('refs/heads/'):] if head_ref.startswith('refs/heads/') else head_ref
+    else:
+        head_sha  = head
+        snapshot.branch = 'HEAD'
+    snapshot.has_commits = head_sha is not None
+    if not snapshot.has_commits:
+        snapshot.branch = ''
+        return snapshot
+    snapshot.commit = head_sha[ : _get_abbrev_length(common_dir, config) ]
+    snapshot.origin = config.get('remote.origin.url', '')
+
+    tags = _read_tags(common_dir, packed_refs, packed_peeled)
+    tags_at_head = [name for name, target in tags.items() if target == head_sha]
+    if len(tags) == 0:
+        snapshot.version = ''
+    elif( ( len(tags_at_head) == 1 ) and ( None not in tags.values() ) ):
+        snapshot.version = tags_at_head[0]
+    else:
+        # Needs to walk the history (describe distance) or to choose between tags
+        snapshot.version = None
+    return snapshot
+
+def get_git_snapshot( refresh=False ) -> GitSnapshot:
+    ''' Get Git snapshot, memoized for this process and shared along the "pio run" '''
+    key = os.getcwd()
+    if( ( not refresh ) and ( key in _SNAPSHOT_CACHE ) ):
+        return _SNAPSHOT_CACHE[key]
+    with perf_tools.phase("git"):
+        cached = None if refresh else pio_tools.load_run_cache(GIT_SNAPSHOT_RUN_CACHE)
+        if( isinstance(cached, dict) and ( cached.get('cwd') == key ) ):
+            snapshot = GitSnapshot.from_dict(cached)
+        else:
+            warm     = warm_helper.request("git_snapshot")
+            snapshot = GitSnapshot.from_dict(warm) if warm else _query_git_snapshot_with_backend()
+            pio_tools.save_run_cache(GIT_SNAPSHOT_RUN_CACHE, dict(snapshot.as_dict(), cwd=key))
+    _SNAPSHOT_CACHE[key] = snapshot
+    return snapshot
+
+def _query_git_snapshot_with_backend() -> GitSnapshot:
+    ''' Query snapshot with the backend selected by NAVITAS_GIT_BACKEND '''
+    backend = os.getenv(GIT_BACKEND_ENV_VAR, 'auto').strip().lower()
+    if backend == 'subprocess':
+        return query_git_snapshot()
+    snapshot = None
+    try:
+        snapshot = read_git_snapshot()
+    except Exception as excep:
+        print(f'Failed to read .git directory. Reason: {excep}')
+    if snapshot is None:
+        return GitSnapshot() if backend == 'python' else query_git_snapshot()
+    if snapshot.version is None:
+        snapshot.version = ''
+        if backend != 'python':
+            describe_rc, describe_out = _run_git(['describe', '--tags', '--abbrev=0'])
+            if describe_rc == 0:
+                snapshot.version = describe_out
+    return snapshot
+
+# ------------------
+# Functions
+# ------------------
 def show_git_info():
     ''' Print Repository Information '''
     print("Git information")
@@ -18,75 +323,68 @@ def show_git_info():
 
 def get_branch_has_commits():
     ''' Check if current branch has commits '''
-    try:
-        looking_for = 'No commits yet'
-        cmd = " git status -u no --no-renames --ignored no"
-        out = subprocess.check_output(cmd, shell=True).decode().strip()
-        if looking_for in out:
-            return 0
-        return 1
-    except Exception:
-        pass
-    return 0
+    return int( get_git_snapshot().has_commits )
 
 def get_git_proj_name() -> str:
     ''' Get Git project name '''
-    project = ''
-    try:
-        projcmd = "git rev-parse --show-toplevel"
-        project = subprocess.check_output(projcmd, shell=True).decode().strip()
-        project = project.split("/")
-        project = project[-1]
-    except Exception:
-        pass
-    return project
+    return get_git_snapshot().project
 
 def get_git_proj_version() -> str:
     ''' Get 0.0.0 version from latest Git tag '''
-    version = ''
-    if get_branch_has_commits():
-        try:
-            tagcmd = "git tag -l"
-            values = subprocess.check_output(tagcmd, shell=True).decode().strip()
-            if len(values) > 1:
-                tagcmd = "git describe --tags --abbrev=0"
-                version = subprocess.check_output(tagcmd, shell=True).decode().strip()
-        except Exception:
-            pass
-    return version
+    return get_git_snapshot().version
 
 def get_git_commit() -> str:
     ''' Get latest commit short from Git '''
-    commit = ''
-    if get_branch_has_commits():
-        try:
-            revcmd = "git log --pretty=format:'%h' -n 1"
-            commit = subprocess.check_output(revcmd, shell=True).decode().strip().replace("'","")
-        except Exception:
-            pass
-    return commit
+    return get_git_snapshot().commit
 
 def get_git_branch() -> str:
     ''' Get branch name from Git '''
-    branch = ''
-    if get_branch_has_commits():
-        try:
-            branchcmd = "git rev-parse --abbrev-ref HEAD"
-            branch = subprocess.check_output(branchcmd, shell=True).decode().strip()
-        except Exception:
-            pass
-    return branch
+    return get_git_snapshot().branch
 
 def get_git_origin() -> str:
     ''' Get git origin url '''
-    origin = ''
-    if get_branch_has_commits():
-        try:
-            cmd = "git config --get remote.origin.url"
-            origin = subprocess.check_output(cmd, shell=True).decode().strip()
-        except Exception:
-            pass
-    return origin
+    return get_git_snapshot().origin
+
+def is_ancestor( ancestor:str, commit:str ) -> bool:
+    ''' Check if commit contains ancestor '''
+    return _run_git(['merge-base', '--is-ancestor', ancestor, commit])[0] == 0
+
+def get_committed_file( file_path:str ):
+    ''' Get content of a file (relative to the current folder) at HEAD, or None '''
+    return_code, out = _run_git(['show', 'HEAD:./' + file_path.replace('\\', '/')])
+    return out if return_code == 0 else None
+
+def get_commits_containing( commit:str ):
+    ''' Get a memoized check "does this (possibly abbreviated) commit contain commit". Commits
+        reachable from a ref are listed once with rev-list, only the others run a merge-base '''
+    return_code, full_sha = _run_git(['rev-parse', '--verify', '-q', commit + '^{commit}'])
+    if return_code != 0:
+        return lambda other: False
+    _, descendants = _run_git(['rev-list', '--ancestry-path', '--all', '^' + full_sha])
+    _, reachable   = _run_git(['rev-list', '--all'])
+    commits  = {'descendants': set(descendants.split()) | {full_sha}, 'reachable': set(reachable.split())}
+    prefixes = {}
+    results  = {}
+
+    def _has_prefix( kind:str, other:str ) -> bool:
+        key = (kind, len(other))
+        if key not in prefixes:
+            prefixes[key] = {x[:len(other)] for x in commits[kind]}
+        return other in prefixes[key]
+
+    def _contains( other:str ) -> bool:
+        other = ( other or '' ).lower()
+        if other == '':
+            return False
+        if other not in results:
+            if _has_prefix('descendants', other):
+                results[other] = True
+            elif _has_prefix('reachable', other):
+                results[other] = False
+            else:
+                results[other] = is_ancestor(full_sha, other)
+        return results[other]
+    return _contains
 
 def get_files_pending_commit():
     ''' Get list of files pending commit'''
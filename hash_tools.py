@@ -0,0 +1,73 @@
+'''
+    PlatformIO Advanced Script for NavitasTecnologia
+    See: https://docs.platformio.org/en/latest/scripting/actions.html
+'''
+# pylint: disable=broad-except
+# ------------------
+# Importing Modules
+# ------------------
+import os
+import zlib
+from hashlib import md5, sha256
+import warm_helper
+
+# ------------------
+# Constants
+# ------------------
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# ------------------
+# Functions
+# ------------------
+_DIGEST_CACHE = {}
+
+def _get_cache_key( p_file_path ):
+    ''' Digest cache key: real path plus (mtime, size, inode) '''
+    stat = os.stat(p_file_path)
+    return ( os.path.realpath(p_file_path), stat.st_mtime_ns, stat.st_size, stat.st_ino )
+
+def get_file_digests( p_file_path ) -> dict:
+    ''' Get MD5, SHA-256 and CRC32 of a file, reading it only once per build '''
+    key = _get_cache_key(p_file_path)
+    if key in _DIGEST_CACHE:
+        return _DIGEST_CACHE[key]
+    if key[2] >= warm_helper.MIN_REMOTE_DIGEST_SIZE:
+        warm = warm_helper.request("digests", path=key[0])
+        if warm is not None:
+            _DIGEST_CACHE[key] = warm
+            return warm
+    md5_hash    = md5()
+    sha256_hash = sha256()
+    crc32       = 0
+    size        = 0
+    with open(p_file_path, 'rb') as file:
+        buffer = bytearray(HASH_CHUNK_SIZE)
+        view   = memoryview(buffer)
+        while True:
+            read_len = file.readinto(buffer)
+            if not read_len:
+                break
+            chunk = view[:read_len]
+            md5_hash.update(chunk)
+            sha256_hash.update(chunk)
+            crc32 = zlib.crc32(chunk, crc32)
+            size += read_len
+    digests = {
+        'md5'    : md5_hash.hexdigest(),
+        'sha256' : sha256_hash.hexdigest(),
+        'crc32'  : crc32 & 0xFFFFFFFF,
+        'size'   : size,
+    }
+    _DIGEST_CACHE[key] = digests
+    return digests
+
+def get_cached_digests( p_file_path ):
+    ''' Get digests only if the file was already hashed and did not change '''
+    try:
+        return _DIGEST_CACHE.get( _get_cache_key(p_file_path) )
+    except OSError:
+        return None
+
+def clear_digest_cache():
+    ''' Forget every digest '''
+    _DIGEST_CACHE.clear()
@@ -0,0 +1,225 @@
+'''
+    PlatformIO Advanced Script for NavitasTecnologia
+    See: https://docs.platformio.org/en/latest/scripting/actions.html
+
+    Release packaging scheduler: the build and the upload both trigger the
+    packaging of an env, coalesced into one job per build. The job runs in a
+    background thread (the upload starts right after linking) joined before the
+    process exits, or is handed off to a detached process. A lock per env makes
+    a clean, or the next build, wait for the packaging reading its build folder.
+'''
+# pylint: disable=broad-except
+# ------------------
+# Importing Modules
+# ------------------
+import io
+import os
+import sys
+import time
+import atexit
+import threading
+import contextlib
+import script_entry
+
+# A clean only holds the lock of a packaging in progress, the file lock tools are imported then
+pio_tools = script_entry.LazyModule("pio_tools")
+
+# ------------------
+# Constants
+# ------------------
+PACKAGING_MODE_SYNC       = "sync"
+PACKAGING_MODE_BACKGROUND = "background"
+PACKAGING_MODE_DETACHED   = "detached"
+PACKAGING_MODES           = [PACKAGING_MODE_SYNC, PACKAGING_MODE_BACKGROUND, PACKAGING_MODE_DETACHED]
+PACKAGING_FOLDER          = ".pio/packaging/"
+PACKAGING_LOCK_TIMEOUT    = 600.0   # seconds a clean (or the next build) waits for the packaging
+HANDOFF_TIMEOUT           = 30.0    # seconds the detached process has to take the lock
+
+# ------------------
+# State
+# ------------------
+_JOBS        = {}
+_JOBS_LOCK   = threading.Lock()
+_HELD_LOCKS  = contextlib.ExitStack()
+_EXIT_STATE  = {'registered': False, 'output': None}
+
+class _ThreadOutput:
+    ''' sys.stdout stand-in: packaging threads write into their own buffer, printed when
+        they are joined, other threads (SCons, the upload) write through '''
+    def __init__(self, stream):
+        self.stream  = stream
+        self.buffers = {}
+
+    def write(self, text):
+        ''' Write into the buffer of this thread, if it has one '''
+        buffer = self.buffers.get(threading.get_ident())
+        if buffer is None:
+            return self.stream.write(text)
+        return buffer.write(text)
+
+    def flush(self):
+        ''' Flush the stream, buffers are flushed when printed '''
+        if threading.get_ident() not in self.buffers:
+            self.stream.flush()
+
+    def __getattr__(self, attr):
+        return getattr(self.stream, attr)
+
+class PackagingJob:
+    ''' Packaging of one env '''
+    def __init__(self, key:str, mode:str):
+        self.key      = key
+        self.mode     = mode
+        self.thread   = None
+        self.result   = None
+        self.error    = None
+        self.output   = ""
+        self.reported = False
+        self.started  = time.monotonic()
+        self.elapsed  = None
+
+# ------------------
+# Functions
+# ------------------
+def get_lock_path( key:str ) -> str:
+    ''' Lock held while the release of an env is packaged '''
+    return os.path.join(PACKAGING_FOLDER, key + ".lock")
+
+def get_log_path( key:str ) -> str:
+    ''' Output of the detached packaging of an env '''
+    return os.path.join(PACKAGING_FOLDER, key + ".log")
+
+def get_job( key:str ):
+    ''' Get the job submitted for key in this process, or None '''
+    return _JOBS.get(key)
+
+def submit( key:str, function, mode:str = PACKAGING_MODE_BACKGROUND, command:list = None ) -> bool:
+    ''' Package once per key, returns False when a job of key was already submitted.
+        function() packages in this process, command in a detached one (detached mode) '''
+    with _JOBS_LOCK:
+        if key in _JOBS:
+            return False
+        job = PackagingJob(key, mode)
+        _JOBS[key] = job
+    if mode == PACKAGING_MODE_DETACHED:
+        if( ( command is not None ) and _hand_off(job, command) ):
+            return True
+        print("\t>> Packaging the release in background instead")
+        job.mode = PACKAGING_MODE_BACKGROUND
+    if job.mode == PACKAGING_MODE_BACKGROUND:
+        _start_thread(job, function)
+    else:
+        with pio_tools.file_lock( get_lock_path(key), PACKAGING_LOCK_TIMEOUT ):
+            job.result = function()
+        job.elapsed = time.monotonic() - job.started
+        job.reported = True
+    return True
+
+def _run( job:PackagingJob, function ):
+    ''' Package holding the lock of the env '''
+    try:
+        with pio_tools.file_lock( get_lock_path(job.key), PACKAGING_LOCK_TIMEOUT ):
+            job.result = function()
+    except Exception as excep:
+        job.error = excep
+    job.elapsed = time.monotonic() - job.started
+
+def _start_thread( job:PackagingJob, function ):
+    ''' Package in a background thread, joined before the process exits '''
+    if sys.stdout is not _EXIT_STATE['output']:
+        _EXIT_STATE['output'] = _ThreadOutput(sys.stdout)
+        sys.stdout = _EXIT_STATE['output']
+    output = _EXIT_STATE['output']
+
+    def _target():
+        output.buffers[threading.get_ident()] = io.StringIO()
+        try:
+            _run(job, function)
+        finally:
+            job.output = output.buffers.pop(threading.get_ident()).getvalue()
+
+    job.thread = threading.Thread(target=_target, name=f"packaging-{job.key}")
+    job.thread.start()
+    if not _EXIT_STATE['registered']:
+        _EXIT_STATE['registered'] = True
+        # Since Python 3.9 thread pools refuse work once the main thread ends, before atexit:
+        # join from the threading exit hooks, called in reverse order (before the pools' one)
+        import concurrent.futures.thread #pylint: disable=C0415,W0611
+        getattr(threading, '_register_atexit', atexit.register)(_join_at_exit)
+    print("\t>> Packaging the release in background")
+
+def _hand_off( job:PackagingJob, command:list ) -> bool:
+    ''' Start command detached, returns once it holds the lock of the env '''
+    import subprocess #pylint: disable=C0415
+    lock_path = get_lock_path(job.key)
+    log_path  = get_log_path(job.key)
+    try:
+        os.makedirs(PACKAGING_FOLDER, exist_ok=True)
+        if os.name == 'nt':
+            options = {'creationflags': subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP}
+        else:
+            options = {'start_new_session': True}
+        with open(log_path, 'ab') as log_file:
+            process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=log_file, #pylint: disable=R1732
+                                       stderr=subprocess.STDOUT, **options)
+        deadline = time.monotonic() + HANDOFF_TIMEOUT
+        while( ( time.monotonic() < deadline ) and ( process.poll() is None ) ):
+            if pio_tools.is_file_locked(lock_path):
+                print(f"\t>> Packaging the release in a detached process (output in {log_path})")
+                return True
+            time.sleep(0.05)
+        if process.poll() == 0:
+            print(f"\t>> Release packaged by a detached process (output in {log_path})")
+            return True
+        print(f"\t>> Detached packaging did not start, see {log_path}")
+    except Exception as excep:
+        print(f'Failed to start the detached packaging. Reason: {excep}')
+    return False
+
+def report( job:PackagingJob ) -> bool:
+    ''' Print output of a finished background job once, returns False if it failed '''
+    if not job.reported:
+        job.reported = True
+        if job.output:
+            sys.stdout.write(job.output)
+        if job.error is None:
+            print(f"\t>> Release packaged in background in {job.elapsed:.1f} s: {job.result}")
+        else:
+            print(f'Failed to package the release of {job.key}. Reason: {job.error}')
+    return job.error is None
+
+def join( key:str = None ) -> bool:
+    ''' Wait for the background jobs (of key, or every one), returns False if one failed '''
+    succeeded = True
+    for job in [x for x in list(_JOBS.values()) if key in [None, x.key]]:
+        if job.thread is None:
+            continue
+        if job.thread.is_alive():
+            print(f"\t>> Waiting for the release packaging of {job.key}")
+        job.thread.join()
+        succeeded = report(job) and succeeded
+    return succeeded
+
+def _join_at_exit():
+    ''' Let background jobs finish before the process exits '''
+    join()
+    output = _EXIT_STATE['output']
+    if sys.stdout is output:
+        sys.stdout = output.stream
+
+def wait_for_packaging( key:str ):
+    ''' Wait for the release of key being packaged by another process (background or detached) '''
+    lock_path = get_lock_path(key)
+    if pio_tools.is_file_locked(lock_path):
+        print(f"\t>> Waiting for the release packaging of {key}")
+        with pio_tools.file_lock( lock_path, PACKAGING_LOCK_TIMEOUT ):
+            pass
+
+def hold_packaging_lock( key:str ):
+    ''' Hold the packaging lock of key until this process exits: a clean does not delete the
+        build folder while its release is packaged, nor while the clean runs '''
+    if not os.path.isfile( get_lock_path(key) ):
+        return
+    if pio_tools.is_file_locked( get_lock_path(key) ):
+        print(f"\t>> Waiting for the release packaging of {key}")
+    _HELD_LOCKS.enter_context( pio_tools.file_lock(get_lock_path(key), PACKAGING_LOCK_TIMEOUT) )
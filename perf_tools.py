@@ -0,0 +1,236 @@
+'''
+    PlatformIO Advanced Script for NavitasTecnologia
+    See: https://docs.platformio.org/en/latest/scripting/actions.html
+
+    Per-phase instrumentation of the build scripts: wall time, subprocesses,
+    bytes read/written and peak memory, saved as a JSON report. Disabled phases
+    cost one flag check.
+'''
+# pylint: disable=broad-except
+# ------------------
+# Importing Modules
+# ------------------
+import os
+import sys
+import json
+import time
+import datetime
+import threading
+import contextlib
+import functools
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# ------------------
+# Constants
+# ------------------
+PERF_REPORT_FILE       = "navitas_perf.json"
+PERF_REPORT_VERSION    = 1
+PERF_PROFILE_PREFIX    = "navitas_profile_"
+PERF_MODE_OFF          = "off"
+PERF_MODE_JSON         = "json"
+PERF_MODE_SUMMARY      = "summary"
+PERF_MODES             = [PERF_MODE_OFF, PERF_MODE_JSON, PERF_MODE_SUMMARY]
+SUBPROCESS_EVENTS      = ["subprocess.Popen", "os.system", "os.spawn", "os.startfile"]
+PROC_IO_FILE           = "/proc/self/io"
+
+# ------------------
+# State
+# ------------------
+_NULL_PHASE = contextlib.nullcontext()
+_STATE      = {
+    'enabled'       : False,
+    'mode'          : PERF_MODE_OFF,
+    'profile'       : False,
+    'report_folder' : None,
+    'pioenv'        : '',
+    'phases'        : [],
+    'subprocesses'  : 0,
+    'hook'          : False,
+    'output_files'  : [],
+}
+# Phases being measured, per thread (the release can be packaged in a background thread)
+_THREAD_STATE = threading.local()
+
+# ------------------
+# Counters
+# ------------------
+def _audit_hook( event, args ): # pylint: disable=unused-argument
+    ''' Count subprocesses spawned while enabled '''
+    if( _STATE['enabled'] and ( event in SUBPROCESS_EVENTS ) ):
+        _STATE['subprocesses'] += 1
+
+def _read_io_counters():
+    ''' Get (bytes read, bytes written) of this process, or (None, None) '''
+    try:
+        with open(PROC_IO_FILE, 'r', encoding='ascii') as file:
+            values = dict( line.split(':', 1) for line in file.read().splitlines() if ':' in line )
+        return int(values['rchar']), int(values['wchar'])
+    except Exception:
+        return None, None
+
+def _read_peak_memory_kb():
+    ''' Get peak resident memory of this process in KB, or None '''
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+def _get_counters() -> dict:
+    ''' Get current counters '''
+    read_bytes, write_bytes = _read_io_counters()
+    return {
+        'time'         : time.perf_counter(),
+        'subprocesses' : _STATE['subprocesses'] if _STATE['hook'] else None,
+        'read_bytes'   : read_bytes,
+        'write_bytes'  : write_bytes,
+    }
+
+# ------------------
+# Functions
+# ------------------
+def configure( mode:str, profile:bool = False, report_folder:str = None, pioenv:str = '' ):
+    ''' Enable ("json" or "summary") or disable ("off") instrumentation '''
+    mode = str(mode or PERF_MODE_OFF).strip().lower()
+    if mode in ['1', 'true', 'yes', 'on']:
+        mode = PERF_MODE_JSON
+    if mode not in PERF_MODES:
+        print(f'\tUnknown perf report mode "{mode}", using "{PERF_MODE_OFF}"')
+        mode = PERF_MODE_OFF
+    if pioenv != _STATE['pioenv']:
+        # Worker processes package several envs, each report only has its own phases
+        _STATE['phases'] = []
+    _STATE['mode']          = mode
+    _STATE['enabled']       = ( mode != PERF_MODE_OFF ) or bool(profile)
+    _STATE['profile']       = bool(profile)
+    _STATE['report_folder'] = report_folder
+    _STATE['pioenv']        = pioenv
+    if( _STATE['enabled'] and ( not _STATE['hook'] ) and hasattr(sys, 'addaudithook') ):
+        # Audit hooks can not be removed, the hook checks 'enabled' instead
+        sys.addaudithook(_audit_hook)
+        _STATE['hook'] = True
+
+def is_enabled() -> bool:
+    ''' Check if instrumentation is enabled '''
+    return _STATE['enabled']
+
+def get_output_files() -> list:
+    ''' Get file names written to the report folder '''
+    return [PERF_REPORT_FILE] + list(_STATE['output_files'])
+
+def get_phases() -> list:
+    ''' Get every phase measured by this process so far '''
+    return list(_STATE['phases'])
+
+def phase( name:str ):
+    ''' Context manager measuring a phase, nested phases are named "parent/child" '''
+    if not _STATE['enabled']:
+        return _NULL_PHASE
+    return _measure_phase(name)
+
+def timed( name:str ):
+    ''' Decorator measuring every call of a function as a phase '''
+    def _decorator( function ):
+        @functools.wraps(function)
+        def _wrapper( *args, **kwargs ):
+            if not _STATE['enabled']:
+                return function(*args, **kwargs)
+            with _measure_phase(name):
+                return function(*args, **kwargs)
+        return _wrapper
+    return _decorator
+
+@contextlib.contextmanager
+def _measure_phase( name:str ):
+    ''' Measure a phase, saving the report when a top level phase ends '''
+    if not hasattr(_THREAD_STATE, 'stack'):
+        _THREAD_STATE.stack = []
+    stack    = _THREAD_STATE.stack
+    top      = len(stack) == 0
+    profiler = None
+    if( top and _STATE['profile'] ):
+        import cProfile #pylint: disable=C0415
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another thread is being profiled (only one profiler at a time since Python 3.12)
+            profiler = None
+    stack.append(name)
+    path  = "/".join(stack)
+    first = len(_STATE['phases'])
+    start = _get_counters()
+    try:
+        yield
+    finally:
+        end = _get_counters()
+        stack.pop()
+        record = {
+            'name'    : path,
+            'depth'   : len(stack),
+            'wall_ms' : round( ( end['time'] - start['time'] ) * 1000.0, 3 ),
+        }
+        for key in ['subprocesses', 'read_bytes', 'write_bytes']:
+            record[key] = None if start[key] is None else end[key] - start[key]
+        record['peak_rss_kb'] = _read_peak_memory_kb()
+        _STATE['phases'].append(record)
+        if profiler is not None:
+            profiler.disable()
+            _save_profile(profiler, name)
+        if top:
+            save_report()
+            if _STATE['mode'] == PERF_MODE_SUMMARY:
+                print("\t>> Timing:", get_summary(record, _STATE['phases'][first:-1]))
+
+def _save_profile( profiler, name:str ):
+    ''' Save cProfile stats of a top level phase '''
+    if _STATE['report_folder'] is None:
+        return
+    file_name = PERF_PROFILE_PREFIX + name + ".prof"
+    try:
+        os.makedirs(_STATE['report_folder'], exist_ok=True)
+        profiler.dump_stats( os.path.join(_STATE['report_folder'], file_name) )
+        if file_name not in _STATE['output_files']:
+            _STATE['output_files'].append(file_name)
+        print(f"\t>> Profile saved to {os.path.join(_STATE['report_folder'], file_name)}")
+    except Exception as excep:
+        print(f'Failed to save profile {file_name}. Reason: {excep}')
+
+def get_summary( record:dict, nested:list ) -> str:
+    ''' One line summary of a phase and its direct children '''
+    def _mb(value):
+        return "?" if value is None else f"{value / (1024 * 1024):.1f} MB"
+    children = [x for x in nested if( ( x['depth'] == record['depth'] + 1 ) and
+                                      x['name'].startswith(record['name'] + "/") )]
+    text = f"{record['name']} {record['wall_ms']:.0f} ms"
+    if record['subprocesses'] is not None:
+        text += f" ({record['subprocesses']} proc)"
+    for child in children:
+        text += f" | {child['name'].split('/')[-1]} {child['wall_ms']:.0f} ms"
+    text += f" | read {_mb(record['read_bytes'])}, written {_mb(record['write_bytes'])}"
+    if record['peak_rss_kb'] is not None:
+        text += f" | peak {record['peak_rss_kb'] / 1024:.0f} MB"
+    return text
+
+def save_report():
+    ''' Save every phase measured by this process '''
+    if _STATE['report_folder'] is None:
+        return
+    report = {
+        'version' : PERF_REPORT_VERSION,
+        'pioenv'  : _STATE['pioenv'],
+        'pid'     : os.getpid(),
+        'date'    : datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'phases'  : _STATE['phases'],
+    }
+    report_path = os.path.join(_STATE['report_folder'], PERF_REPORT_FILE)
+    try:
+        os.makedirs(_STATE['report_folder'], exist_ok=True)
+        tmp_path = f"{report_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='UTF-8') as file:
+            file.write( json.dumps(report, indent=4) )
+        os.replace(tmp_path, report_path)
+    except Exception as excep:
+        print(f'Failed to save {report_path}. Reason: {excep}')
@@ -7,114 +7,133 @@
 # Importing Modules
 # ------------------
 import os
+import json
+import time
 import shutil
+import contextlib
+import env_resolver
+from script_entry import has_cmd_line_target #pylint: disable=W0611
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+# ------------------
+# Constants
+# ------------------
+RUN_CACHE_FOLDER = ".pio/run_cache/"
+LOCK_TIMEOUT     = 60.0
+LOCK_RETRY_DELAY = 0.005
 
 def get_default_firmware_path(env):
     ''' Find firmware file name '''
-    fmw_path = get_from_env_recursive(env, '$PROG_PATH')
-    bin_path = fmw_path.replace( fmw_path.split('.')[-1] , 'bin' )
-    if os.path.isfile( bin_path ):
-        fmw_path = bin_path
-    return fmw_path
+    return env_resolver.get_resolver(env).get_firmware_path()
 
 def get_from_env_recursive(env, p_value, p_path_to_copy_n_paste = ''):
-    ''' Find p_value from env '''
-    # TODO use env.get( p_value, p_value ), env.subst( p_value )
-
-    if isinstance(p_value, list):
-        # List of values
-        out_value = ""
-        for i, p_value_i in enumerate(p_value):
-            p_value_i = p_value_i.replace('\'', '').replace('\"','').strip()
-            out_value += get_from_env_recursive(env, p_value_i, p_path_to_copy_n_paste)
-            if i != ( len(p_value) - 1 ):
-                out_value += " "
-        return out_value
+    ''' Find p_value from env, copying (folder path) or collecting (set) the files it uses '''
+    collect_files = isinstance(p_path_to_copy_n_paste, set) or ( p_path_to_copy_n_paste != '' )
+    out_value, files = env_resolver.resolve_env_value(env, p_value, collect_files)
+    if isinstance(p_path_to_copy_n_paste, set):
+        p_path_to_copy_n_paste.update(files)
+    elif collect_files:
+        # Copy each file to folder once
+        os.makedirs( p_path_to_copy_n_paste, exist_ok=True )
+        for file_i in sorted(files):
+            shutil.copy2( file_i, p_path_to_copy_n_paste )
+    return out_value
 
-    elif ( isinstance(p_value, str) and p_value.count(' ') > 1 ):
-        # Space separated values
-        tags = [
-            xi.replace('\'', '').replace('\"','').strip()
-            for xi in p_value.split()
-        ]
-        tags_parsed = [get_from_env_recursive(env, t, p_path_to_copy_n_paste) for t in tags]
-        return ' '.join(tags_parsed)
+def get_run_id() -> str:
+    ''' Identify the current "pio run" invocation (shared by every env it spawns) '''
+    return os.getenv('NAVITAS_RUN_ID', str(os.getppid()))
 
-    elif str(p_value).count('$') > 1:
-        # String with multiple tags
-        tags = [ xi.replace('\\','').strip()
-            for xi in p_value.split('$')
-            if xi not in ['', '"', "'"]
-        ]
-        tags_parsed = [get_from_env_recursive(env, '$' + t, p_path_to_copy_n_paste) for t in tags]
-        parsed      = p_value
-        #return ' '.join(tags_parsed)
-        for i,tag_i in enumerate( tags ):
-            parsed = parsed.replace(f'${tag_i}', tags_parsed[i], 1)
-        return parsed
+def load_run_cache( name:str, max_age:float = 600.0 ):
+    ''' Load data cached by another env of the same "pio run" invocation '''
+    cache_path = os.path.join(RUN_CACHE_FOLDER, name + ".json")
+    try:
+        with open(cache_path, 'r', encoding='UTF-8') as file:
+            cached = json.loads(file.read())
+        if( ( cached['run_id'] == get_run_id() ) and
+            ( time.time() - cached['time'] < max_age ) ):
+            return cached['data']
+    except Exception:
+        pass
+    return None
 
-    elif( ('${' in str(p_value) ) and ('}' in str(p_value) ) ):
-        # Value is a function to be called
-        fun_str  = p_value[2:].split('(')[0]
-        params   = p_value[p_value.index('(')+1:].split(')')[0].strip().split(',')
-        if len(params) == 0:
-            return str(env[fun_str]())
-        if( len(params)==1 and ( params[0] == '__env__') ):
-            return str(env[fun_str](env))
-        return env.subst( p_value )
+def save_run_cache( name:str, data ):
+    ''' Share data with the other envs of the same "pio run" invocation '''
+    cache_path = os.path.join(RUN_CACHE_FOLDER, name + ".json")
+    try:
+        os.makedirs(RUN_CACHE_FOLDER, exist_ok=True)
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='UTF-8') as file:
+            file.write( json.dumps({'run_id': get_run_id(), 'time': time.time(), 'data': data}) )
+        os.replace(tmp_path, cache_path)
+    except Exception as excep:
+        print(f'Failed to save run cache "{name}". Reason: {excep}')
 
-    elif str(p_value).count('$') == 1:
-        #/ Value is another key
-        add_bracets = ( (p_value[0] == '{') and (p_value[-1] == '}') )
-        key         = p_value[ p_value.index('$') + 1: ].replace('\'', '').replace('\"','').strip()
-        if add_bracets:
-            key = key[:-1]
-        out_param   = ''
-        if key in ['UPLOAD_PORT']:
-            # Ignore these values
-            out_param = ''
-        elif key in env:
-            # Get value from env
-            out_param = get_from_env_recursive(env, env[key], p_path_to_copy_n_paste)
-        elif key.upper() == "SOURCE":
-            # Get firmware file
-            fmw_path = get_default_firmware_path(env)
-            out_param = get_from_env_recursive(env, fmw_path, p_path_to_copy_n_paste)
+def _try_lock( file ) -> bool:
+    ''' Try to lock a file opened for writing, without waiting '''
+    try:
+        if fcntl is not None:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
         else:
-            # Not found
-            print( f'"{key}" not found!' )
-            return f"${key}"
-        return '{%s}' % out_param if add_bracets else out_param
+            file.seek(0)
+            msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+        return True
+    except OSError:
+        return False
 
-    # Path to file
-    if os.path.isfile( str(p_value) ):
-        # Copy File to folder
-        if( ( p_path_to_copy_n_paste != '' ) and
-            ( not "python" in p_value.lower() ) ):
-            if not os.path.exists(p_path_to_copy_n_paste):
-                os.makedirs( p_path_to_copy_n_paste )
-            shutil.copy2( p_value.replace("\\","/") , p_path_to_copy_n_paste )
-        # Rename file
-        p_value = p_value.split('\\')[-1]
+def _unlock( file ):
+    ''' Unlock a file locked by _try_lock() '''
+    if fcntl is not None:
+        fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+    else:
+        file.seek(0)
+        msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
 
-    # Value
-    return str(p_value)
+@contextlib.contextmanager
+def file_lock( lock_path:str, timeout:float = LOCK_TIMEOUT ):
+    ''' Lock shared by every process (envs built in parallel), released even if the process dies.
+        After timeout it goes on without the lock rather than failing the build '''
+    os.makedirs(os.path.dirname(os.path.abspath(lock_path)), exist_ok=True)
+    with open(lock_path, 'a+', encoding='UTF-8') as file:
+        deadline = time.monotonic() + timeout
+        locked   = _try_lock(file)
+        while( ( not locked ) and ( time.monotonic() < deadline ) ):
+            time.sleep(LOCK_RETRY_DELAY)
+            locked = _try_lock(file)
+        if not locked:
+            print(f'\tTimeout waiting for {lock_path}, going on without it')
+        try:
+            yield locked
+        finally:
+            if locked:
+                _unlock(file)
 
-def has_cmd_line_target( cmd, targets=None, dump_targets=False ):
-    ''' Check if there is a command with that name in targets '''
-    # Get default targets from SCons
-    if targets is None:
-        from SCons.Script import COMMAND_LINE_TARGETS #pylint: disable=W0611,E0401,C0415
-        targets = COMMAND_LINE_TARGETS
-    # Debug dump targets
-    if dump_targets:
-        with open("dump_targets.txt", "w", encoding="utf-8") as file:
-            file.write( str(targets) )
-    # Check for each item inside a list
-    if isinstance(cmd, list):
-        for cmd_i in cmd:
-            if len([c for c in targets if cmd_i in c]) > 0:
-                return True
+def is_file_locked( lock_path:str ) -> bool:
+    ''' Check if a file_lock() is held, by this or another process '''
+    if not os.path.isfile(lock_path):
         return False
-    # Check for a single item
-    return len([c for c in targets if cmd in c]) > 0
+    with open(lock_path, 'a+', encoding='UTF-8') as file:
+        if _try_lock(file):
+            _unlock(file)
+            return False
+    return True
+
+def get_project_option( env, option:str, default=None ):
+    ''' Get "custom_*" option from platformio.ini, overridable by NAVITAS_* environment variables '''
+    env_var = "NAVITAS_" + option.upper().replace("CUSTOM_", "", 1)
+    if env_var in os.environ:
+        return os.environ[env_var]
+    try:
+        return env.GetProjectOption(option, default)
+    except Exception:
+        return default
+
+def get_project_flag( env, option:str, default:bool = False ) -> bool:
+    ''' Get yes/no "custom_*" option, see get_project_option() '''
+    value = get_project_option(env, option, None)
+    if value is None:
+        return default
+    return str(value).strip().lower() in ['1', 'true', 'yes', 'on']
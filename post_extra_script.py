@@ -6,7 +6,7 @@
 # ------------------
 # Importing Modules
 # ------------------
-import firmware_manager as fmw
+import script_entry
 from SCons.Script import Import #pylint: disable=C0415,W0611,E0401
 
 # ------------------
@@ -15,14 +15,12 @@ from SCons.Script import Import #pylint: disable=C0415,W0611,E0401
 print( "\n", "-"*70, "\n\n", '\tpost_extra_script' )
 
 try:
-    if not fmw.pio_tools.has_cmd_line_target("idedata"):
+    if script_entry.is_post_script_needed():
+        import firmware_manager as fmw #pylint: disable=C0415
         Import("env", "projenv")
 
-        # Dump global construction environment (for debug purpose)
-        with open("dump_env.ini"    ,"w",encoding="utf-8") as file:
-            file.write( str( env.Dump() ) )
-        with open("dump_projenv.ini","w",encoding="utf-8") as file:
-            file.write( str( projenv.Dump() ) )
+        # Dump construction environments (for debug purpose, see custom_env_dump)
+        fmw.save_env_dumps(env, projenv)
 
         fmw.post_extra_script_main(env, projenv)
 except Exception as e:
@@ -6,7 +6,7 @@
 # ------------------
 # Importing Modules
 # ------------------
-import firmware_manager as fmw
+import script_entry
 from SCons.Script import Import #pylint: disable=C0415,W0611,E0401
 
 #TODO: Try to update the library
@@ -18,7 +18,14 @@ from SCons.Script import Import #pylint: disable=C0415,W0611,E0401
 print( "\n", "-"*70, "\n\n", '\tpre_extra_script' )
 try:
     Import("env")
-    fmw.pre_extra_script_main(env)
+    # Nothing heavy is imported when there is nothing to do (e.g. the IDE asking for "idedata")
+    if script_entry.is_pre_script_needed(env):
+        import firmware_manager as fmw #pylint: disable=C0415
+        fmw.pre_extra_script_main(env)
+    elif env.GetOption('clean'):
+        # Do not delete the build folder while its release is packaged (background or detached)
+        import package_scheduler #pylint: disable=C0415
+        package_scheduler.hold_packaging_lock( env.get('PIOENV',"unknown") )
 except Exception as e:
     print(e)
 print( "\n", "-"*70, "\n" )
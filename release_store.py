@@ -0,0 +1,195 @@
+'''
+    PlatformIO Advanced Script for NavitasTecnologia
+    See: https://docs.platformio.org/en/latest/scripting/actions.html
+
+    Content-addressed store of release zips: every (still compressed) zip member
+    is stored once by its SHA-256, each release is a small manifest, and any
+    stored release can be written back as a zip by raw member copy.
+'''
+# pylint: disable=broad-except
+# ------------------
+# Importing Modules
+# ------------------
+import os
+import json
+import time
+import zipfile
+import hashlib
+import release_tools
+
+# ------------------
+# Constants
+# ------------------
+STORE_FOLDER           = ".pio/release/.store/"
+STORE_VERSION          = 1
+OBJECTS_FOLDER         = "objects"
+MANIFESTS_FOLDER       = "manifests"
+DEFAULT_MAX_RELEASES   = 100
+DEFAULT_MAX_MB         = 512
+GC_GRACE_SECONDS       = 3600   # objects younger than this may belong to a release being stored
+MEMBER_FIELDS          = ['compress_type', 'CRC', 'file_size', 'flag_bits', 'external_attr',
+                          'create_system', 'create_version', 'extract_version']
+
+# ------------------
+# Store
+# ------------------
+class ReleaseStore:
+    ''' Release zips of every env, deduplicated by member content '''
+    def __init__(self, root=STORE_FOLDER):
+        self.root = root
+
+    def _object_path( self, object_id:str ) -> str:
+        return os.path.join(self.root, OBJECTS_FOLDER, object_id[:2], object_id[2:])
+
+    def _manifest_path( self, env_name:str, zip_name:str ) -> str:
+        return os.path.join(self.root, MANIFESTS_FOLDER, env_name, os.path.splitext(zip_name)[0] + ".json")
+
+    def _write_atomic( self, file_path:str, data:bytes ):
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        tmp_path = f"{file_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as file:
+            file.write(data)
+        os.replace(tmp_path, file_path)
+
+    def _save_manifest( self, manifest:dict ):
+        self._write_atomic( self._manifest_path(manifest['env'], manifest['zip_name']),
+                            json.dumps(manifest, indent=1).encode('UTF-8') )
+
+    def has_release( self, env_name:str, zip_name:str, fingerprint:str = None ) -> bool:
+        ''' Check if a release is stored (with the same fingerprint, when given) '''
+        manifest = self.load_manifest(env_name, zip_name)
+        if manifest is None:
+            return False
+        return ( fingerprint is None ) or ( manifest.get('fingerprint') == fingerprint )
+
+    def load_manifest( self, env_name:str, zip_name:str ):
+        ''' Load manifest of a release, or None '''
+        try:
+            with open(self._manifest_path(env_name, zip_name), 'r', encoding='UTF-8') as file:
+                return json.loads(file.read())
+        except Exception:
+            return None
+
+    def add_release( self, zip_path:str, env_name:str, info:dict = None, fingerprint:str = None ) -> dict:
+        ''' Store a release zip, returns its manifest '''
+        members = []
+        with zipfile.ZipFile(zip_path, 'r') as zip_file, open(zip_path, 'rb') as raw_file:
+            for zinfo in zip_file.infolist():
+                raw_data    = release_tools.read_raw_member(raw_file, zinfo)
+                object_id   = hashlib.sha256(raw_data).hexdigest()
+                object_path = self._object_path(object_id)
+                if os.path.isfile(object_path):
+                    os.utime(object_path)
+                else:
+                    self._write_atomic(object_path, raw_data)
+                member = {'name': zinfo.filename, 'object': object_id, 'size': len(raw_data),
+                          'date_time': list(zinfo.date_time), 'extra': zinfo.extra.hex()}
+                member.update( {field: getattr(zinfo, field) for field in MEMBER_FIELDS} )
+                members.append(member)
+        now = time.time()
+        manifest = {
+            'version'     : STORE_VERSION,
+            'env'         : env_name,
+            'zip_name'    : os.path.basename(zip_path),
+            'fingerprint' : fingerprint,
+            'created'     : now,
+            'last_used'   : now,
+            'info'        : info or {},
+            'members'     : members,
+        }
+        self._save_manifest(manifest)
+        return manifest
+
+    def list_releases( self, env_name:str = None ) -> list:
+        ''' Get manifests of an env (or of every env), most recently used first '''
+        manifests   = []
+        envs_folder = os.path.join(self.root, MANIFESTS_FOLDER)
+        if not os.path.isdir(envs_folder):
+            return manifests
+        for env_i in sorted(os.listdir(envs_folder)):
+            if( ( env_name is not None ) and ( env_i != env_name ) ):
+                continue
+            for file_name in os.listdir(os.path.join(envs_folder, env_i)):
+                if not file_name.endswith(".json"):
+                    continue
+                try:
+                    with open(os.path.join(envs_folder, env_i, file_name), 'r', encoding='UTF-8') as file:
+                        manifests.append( json.loads(file.read()) )
+                except Exception as excep:
+                    print(f'Failed to read manifest {file_name}. Reason: {excep}')
+        manifests.sort(key=lambda x: x['last_used'], reverse=True)
+        return manifests
+
+    def find_release( self, env_name:str, name:str ):
+        ''' Find manifest by zip name, or by part of it (e.g. a version), most recent first '''
+        releases = self.list_releases(env_name)
+        for manifest in releases:
+            if name in [manifest['zip_name'], os.path.splitext(manifest['zip_name'])[0]]:
+                return manifest
+        for manifest in releases:
+            if name in manifest['zip_name']:
+                return manifest
+        return None
+
+    def materialize( self, manifest:dict, zip_path:str ) -> str:
+        ''' Write a stored release back as a zip '''
+        os.makedirs(os.path.dirname(os.path.abspath(zip_path)), exist_ok=True)
+        tmp_path = f"{zip_path}.{os.getpid()}.tmp"
+        with zipfile.ZipFile(tmp_path, 'w') as zip_file:
+            for member in manifest['members']:
+                zinfo = zipfile.ZipInfo(member['name'], tuple(member['date_time']))
+                for field in MEMBER_FIELDS:
+                    setattr(zinfo, field, member[field])
+                zinfo.extra = bytes.fromhex(member['extra'])
+                with open(self._object_path(member['object']), 'rb') as file:
+                    release_tools.write_raw_member(zip_file, zinfo, member['name'], file)
+        os.replace(tmp_path, zip_path)
+        manifest['last_used'] = time.time()
+        self._save_manifest(manifest)
+        return zip_path
+
+    def evict( self, env_name:str, max_releases:int = DEFAULT_MAX_RELEASES, max_mb:float = DEFAULT_MAX_MB ) -> int:
+        ''' Forget least recently used releases of an env beyond max_releases or max_mb
+            (the most recent one is always kept), then delete unreferenced objects '''
+        evicted  = 0
+        objects  = set()
+        size     = 0
+        for i, manifest in enumerate( self.list_releases(env_name) ):
+            new_objects = {x['object']: x['size'] for x in manifest['members'] if x['object'] not in objects}
+            new_size    = size + sum(new_objects.values())
+            if( ( i > 0 ) and ( ( i >= max_releases ) or ( new_size > max_mb * 1024 * 1024 ) ) ):
+                os.remove( self._manifest_path(env_name, manifest['zip_name']) )
+                evicted += 1
+                continue
+            objects.update(new_objects)
+            size = new_size
+        if evicted:
+            self.collect_garbage()
+        return evicted
+
+    def collect_garbage( self ) -> int:
+        ''' Delete objects no release uses anymore, returns bytes freed '''
+        used = { x['object'] for manifest in self.list_releases() for x in manifest['members'] }
+        freed   = 0
+        too_new = time.time() - GC_GRACE_SECONDS
+        objects_folder = os.path.join(self.root, OBJECTS_FOLDER)
+        for root, _, files in os.walk(objects_folder):
+            for file_name in files:
+                object_path = os.path.join(root, file_name)
+                object_id   = os.path.basename(root) + file_name
+                try:
+                    stat = os.stat(object_path)
+                    if( ( object_id in used ) or ( stat.st_mtime > too_new ) ):
+                        continue
+                    os.remove(object_path)
+                    freed += stat.st_size
+                except Exception as excep:
+                    print(f'Failed to delete {object_path}. Reason: {excep}')
+        return freed
+
+    def get_size( self ) -> int:
+        ''' Get bytes used by objects '''
+        size = 0
+        for root, _, files in os.walk(os.path.join(self.root, OBJECTS_FOLDER)):
+            size += sum( os.path.getsize(os.path.join(root, x)) for x in files )
+        return size
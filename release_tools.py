@@ -0,0 +1,353 @@
+'''
+    PlatformIO Advanced Script for NavitasTecnologia
+    See: https://docs.platformio.org/en/latest/scripting/actions.html
+
+    Release zip assembly straight from the source files, without a staging folder.
+'''
+# pylint: disable=broad-except
+# ------------------
+# Importing Modules
+# ------------------
+import os
+import bz2
+import copy
+import time
+import zlib
+import json
+import shutil
+import struct
+import zipfile
+import tempfile
+from hashlib import sha256
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import hash_tools
+
+# ------------------
+# Constants
+# ------------------
+ZIP_LOCAL_HEADER_FORMAT  = "<4s2B4HL2L2H"
+ZIP_LOCAL_HEADER_SIZE    = struct.calcsize(ZIP_LOCAL_HEADER_FORMAT)
+ZIP_DATA_DESCRIPTOR_FLAG = 0x08
+ZIP64_EXTRA_ID           = 0x0001
+ZIP_LZMA_EOS_FLAG        = 0x02
+COMPRESSION_METHODS      = {
+    'stored'  : zipfile.ZIP_STORED,
+    'deflate' : zipfile.ZIP_DEFLATED,
+    'bzip2'   : zipfile.ZIP_BZIP2,
+    'lzma'    : zipfile.ZIP_LZMA,
+}
+DEFAULT_COMPRESSION      = 'deflate'
+INCOMPRESSIBLE_RATIO     = 0.97
+INCOMPRESSIBLE_SAMPLE    = 64 * 1024
+MAX_INFLIGHT_BYTES       = 256 * 1024 * 1024
+STREAM_CHUNK_SIZE        = 1024 * 1024
+SPOOL_MAX_SIZE           = 8 * 1024 * 1024  # compressed members over it wait on disk to be written
+
+# ------------------
+# Release Manifest
+# ------------------
+class ReleaseManifest:
+    ''' Ordered list of release zip entries, later entries replace earlier ones '''
+    FILE  = 'file'
+    BYTES = 'bytes'
+    RAW   = 'raw'
+
+    def __init__(self):
+        self.entries = {}
+
+    def add_file(self, src_path, arcname):
+        ''' Add a file from disk '''
+        self.entries[_normalize_arcname(arcname)] = (self.FILE, os.path.realpath(src_path))
+
+    def add_tree(self, src_dir, arc_prefix):
+        ''' Add every file inside a folder '''
+        for root, _, files in os.walk(src_dir):
+            for file in files:
+                file_path = os.path.join(root, file)
+                self.add_file(file_path, arc_prefix + '/' + os.path.relpath(file_path, src_dir))
+
+    def add_bytes(self, arcname, data):
+        ''' Add a file generated in memory '''
+        if isinstance(data, str):
+            data = data.encode('UTF-8')
+        self.entries[_normalize_arcname(arcname)] = (self.BYTES, data)
+
+    def add_zip_members(self, zip_path, arc_prefix=''):
+        ''' Add every member of another zip, copied still compressed '''
+        zip_path = os.path.realpath(zip_path)
+        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+            for zinfo in zip_ref.infolist():
+                if zinfo.is_dir():
+                    continue
+                self.entries[_normalize_arcname(arc_prefix + '/' + zinfo.filename)] = \
+                    (self.RAW, (zip_path, zinfo))
+
+    def remove(self, arcname):
+        ''' Remove an entry, if it exists '''
+        self.entries.pop(_normalize_arcname(arcname), None)
+
+    def get_fingerprint(self, *extra) -> str:
+        ''' Hash every entry name and content, plus any extra setting '''
+        fingerprint = sha256( json.dumps([str(x) for x in extra]).encode() )
+        for arcname, (kind, value) in self.entries.items():
+            if kind == self.FILE:
+                identity = hash_tools.get_file_digests(value)['sha256']
+            elif kind == self.BYTES:
+                identity = sha256(value).hexdigest()
+            else:
+                src_path, zinfo = value
+                identity = f"{src_path}|{zinfo.filename}|{zinfo.CRC}|{zinfo.file_size}|{zinfo.compress_size}"
+            fingerprint.update( f"{arcname}|{kind}|{identity}\n".encode() )
+        return fingerprint.hexdigest()
+
+    def write(self, zip_path, method=DEFAULT_COMPRESSION, level=None, workers=None) -> dict:
+        ''' Write every entry straight into a zip file, compressing members in parallel '''
+        compression = CompressionSettings(method, level)
+        stats    = {'members': 0, 'file_size': 0, 'compress_size': 0, 'stored': 0}
+        tmp_path = f"{zip_path}.{os.getpid()}.tmp"
+        try:
+            with zipfile.ZipFile( tmp_path, 'w' ) as ziph, \
+                 ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+                pending        = deque()
+                inflight_bytes = 0
+                for arcname, (kind, value) in self.entries.items():
+                    size = _get_entry_size(kind, value)
+                    while( pending and ( inflight_bytes + size > MAX_INFLIGHT_BYTES ) ):
+                        inflight_bytes -= _write_job(ziph, pending.popleft(), stats)
+                    pending.append( (pool.submit(_prepare_member, arcname, kind, value, compression), size) )
+                    inflight_bytes += size
+                while pending:
+                    _write_job(ziph, pending.popleft(), stats)
+            os.replace(tmp_path, zip_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return stats
+
+def save_fingerprint( fingerprint_path:str, zip_path:str, fingerprint:str, members:int ):
+    ''' Store the fingerprint of a written release zip next to it '''
+    data = {
+        'zip_name'    : os.path.basename(zip_path),
+        'zip_size'    : os.path.getsize(zip_path),
+        'members'     : members,
+        'fingerprint' : fingerprint,
+    }
+    with open(fingerprint_path, 'w', encoding='UTF-8') as file:
+        file.write( json.dumps(data, indent=4) )
+
+def is_release_up_to_date( fingerprint_path:str, zip_path:str, fingerprint:str, members:int ) -> bool:
+    ''' Check if zip_path is a valid archive created from the same fingerprint '''
+    try:
+        with open(fingerprint_path, 'r', encoding='UTF-8') as file:
+            data = json.loads(file.read())
+        if( ( data['fingerprint'] != fingerprint ) or
+            ( data['zip_name'] != os.path.basename(zip_path) ) or
+            ( data['members'] != members ) or
+            ( data['zip_size'] != os.path.getsize(zip_path) ) ):
+            return False
+        with zipfile.ZipFile(zip_path, 'r') as ziph:
+            return len(ziph.infolist()) == members
+    except Exception:
+        return False
+
+def _normalize_arcname( arcname:str ) -> str:
+    ''' Use zip style separators, without leading slashes '''
+    return arcname.replace('\\', '/').lstrip('/')
+
+def get_stats_summary( stats:dict ) -> str:
+    ''' Describe write() statistics in one line '''
+    saved = stats['file_size'] - stats['compress_size']
+    ratio = 100.0 * saved / stats['file_size'] if stats['file_size'] else 0.0
+    return ( f"{stats['members']} files, {stats['file_size']/1e6:.2f} MB -> "
+             f"{stats['compress_size']/1e6:.2f} MB (saved {saved/1e6:.2f} MB, {ratio:.0f}%, "
+             f"{stats['stored']} stored uncompressed)" )
+
+# ------------------
+# Compression Engine
+# ------------------
+class CompressionSettings:
+    ''' Zip compression method and level '''
+    def __init__(self, method=DEFAULT_COMPRESSION, level=None):
+        method = str(method or DEFAULT_COMPRESSION).strip().lower()
+        if method not in COMPRESSION_METHODS:
+            print(f'Unknown compression "{method}", using "{DEFAULT_COMPRESSION}"')
+            method = DEFAULT_COMPRESSION
+        self.method = COMPRESSION_METHODS[method]
+        self.level  = None if level in [None, ''] else int(level)
+
+    def get_compressor(self):
+        ''' Get a streaming compressor (compress() and flush()) the way zipfile expects it, or None '''
+        if self.method == zipfile.ZIP_DEFLATED:
+            level = zlib.Z_DEFAULT_COMPRESSION if self.level is None else self.level
+            return zlib.compressobj(level, zlib.DEFLATED, -15)
+        if self.method == zipfile.ZIP_BZIP2:
+            return bz2.BZ2Compressor(9 if self.level is None else max(1, self.level))
+        if self.method == zipfile.ZIP_LZMA:
+            return zipfile.LZMACompressor()
+        return None
+
+    def compress(self, data) -> bytes:
+        ''' Compress data the way zipfile expects it for this method '''
+        compressor = self.get_compressor()
+        if compressor is None:
+            return bytes(data)
+        return compressor.compress(data) + compressor.flush()
+
+def _get_sample_offsets( size:int ) -> list:
+    ''' Offsets of the start, middle and end samples of is_incompressible() '''
+    return [0, ( size - INCOMPRESSIBLE_SAMPLE ) // 2, size - INCOMPRESSIBLE_SAMPLE]
+
+def _is_sample_incompressible( sample ) -> bool:
+    ''' Check a sample with the fastest deflate level '''
+    return len(zlib.compress(sample, 1)) > INCOMPRESSIBLE_RATIO * len(sample)
+
+def is_incompressible( data ) -> bool:
+    ''' Check samples from the start, middle and end of data with the fastest deflate level '''
+    if len(data) < 4 * INCOMPRESSIBLE_SAMPLE:
+        return False
+    return all( _is_sample_incompressible(data[offset : offset + INCOMPRESSIBLE_SAMPLE])
+                for offset in _get_sample_offsets(len(data)) )
+
+def is_file_incompressible( file, size:int ) -> bool:
+    ''' Same as is_incompressible(), reading the samples from an open file '''
+    if size < 4 * INCOMPRESSIBLE_SAMPLE:
+        return False
+    for offset in _get_sample_offsets(size):
+        file.seek(offset)
+        if not _is_sample_incompressible( file.read(INCOMPRESSIBLE_SAMPLE) ):
+            return False
+    return True
+
+def _get_entry_size( kind, value ) -> int:
+    ''' Get uncompressed size of a manifest entry '''
+    if kind == ReleaseManifest.FILE:
+        return os.path.getsize(value)
+    if kind == ReleaseManifest.BYTES:
+        return len(value)
+    return value[1].compress_size
+
+def _prepare_member( arcname, kind, value, compression ):
+    ''' Build (arcname, ZipInfo, raw data) of a member, runs inside the thread pool '''
+    if kind == ReleaseManifest.RAW:
+        src_path, zinfo = value
+        with open(src_path, 'rb') as src_file:
+            return arcname, zinfo, read_raw_member(src_file, zinfo)
+    if kind == ReleaseManifest.FILE:
+        return _prepare_file_member(arcname, value, compression)
+    zinfo = zipfile.ZipInfo(arcname, time.localtime(time.time())[:6])
+    zinfo.external_attr = 0o644 << 16
+    zinfo.CRC           = zlib.crc32(value)
+    zinfo.file_size     = len(value)
+    zinfo.compress_type = zipfile.ZIP_STORED
+    raw_data            = value
+    if( ( compression.method != zipfile.ZIP_STORED ) and ( not is_incompressible(value) ) ):
+        compressed = compression.compress(value)
+        if len(compressed) < INCOMPRESSIBLE_RATIO * len(value):
+            zinfo.compress_type = compression.method
+            raw_data = compressed
+    if zinfo.compress_type == zipfile.ZIP_LZMA:
+        zinfo.flag_bits |= ZIP_LZMA_EOS_FLAG
+    return arcname, zinfo, raw_data
+
+def _prepare_file_member( arcname, src_path, compression ):
+    ''' Build (arcname, ZipInfo, raw data) of a file streamed through the compressor in chunks.
+        Raw data is a spooled temporary file when compressed, the source path when stored '''
+    zinfo   = zipfile.ZipInfo.from_file(src_path, arcname)
+    digests = hash_tools.get_cached_digests(src_path)
+    crc     = digests['crc32'] if digests is not None else 0
+    zinfo.compress_type = zipfile.ZIP_STORED
+    with open(src_path, 'rb') as file:
+        compressor = None
+        if( ( compression.method != zipfile.ZIP_STORED ) and ( not is_file_incompressible(file, zinfo.file_size) ) ):
+            compressor = compression.get_compressor()
+        if( ( compressor is None ) and ( digests is not None ) ):
+            zinfo.CRC = crc
+            return arcname, zinfo, src_path
+        file.seek(0)
+        raw_file  = None if compressor is None else tempfile.SpooledTemporaryFile(SPOOL_MAX_SIZE) #pylint: disable=R1732
+        file_size = 0
+        for chunk in iter(lambda: file.read(STREAM_CHUNK_SIZE), b''):
+            file_size += len(chunk)
+            if digests is None:
+                crc = zlib.crc32(chunk, crc)
+            if raw_file is not None:
+                raw_file.write( compressor.compress(chunk) )
+    zinfo.CRC       = crc
+    zinfo.file_size = file_size
+    if raw_file is None:
+        return arcname, zinfo, src_path
+    raw_file.write( compressor.flush() )
+    if raw_file.tell() >= INCOMPRESSIBLE_RATIO * file_size:
+        raw_file.close()
+        return arcname, zinfo, src_path
+    zinfo.compress_type = compression.method
+    if zinfo.compress_type == zipfile.ZIP_LZMA:
+        zinfo.flag_bits |= ZIP_LZMA_EOS_FLAG
+    raw_file.seek(0)
+    return arcname, zinfo, raw_file
+
+def _write_job( ziph, job, stats:dict ) -> int:
+    ''' Wait for a prepared member and append it to the zip, returns its size '''
+    future, size = job
+    arcname, zinfo, raw_data = future.result()
+    if isinstance(raw_data, str):
+        with open(raw_data, 'rb') as raw_file:
+            compress_size = write_raw_member(ziph, zinfo, arcname, raw_file)
+    elif hasattr(raw_data, 'read'):
+        with raw_data:
+            compress_size = write_raw_member(ziph, zinfo, arcname, raw_data)
+    else:
+        compress_size = write_raw_member(ziph, zinfo, arcname, raw_data)
+    stats['members']       += 1
+    stats['file_size']     += zinfo.file_size
+    stats['compress_size'] += compress_size
+    stats['stored']        += int( zinfo.compress_type == zipfile.ZIP_STORED )
+    return size
+
+# ------------------
+# Raw Member Copy
+# ------------------
+def read_raw_member( src_file, zinfo:zipfile.ZipInfo ) -> bytes:
+    ''' Read the still compressed data of a zip member '''
+    src_file.seek(zinfo.header_offset)
+    header = struct.unpack(ZIP_LOCAL_HEADER_FORMAT, src_file.read(ZIP_LOCAL_HEADER_SIZE))
+    src_file.seek(header[10] + header[11], os.SEEK_CUR)
+    return src_file.read(zinfo.compress_size)
+
+def _strip_zip64_extra( extra:bytes ) -> bytes:
+    ''' Remove zip64 extra field, FileHeader() adds it again when needed '''
+    out = b''
+    while len(extra) >= 4:
+        field_id, field_len = struct.unpack('<HH', extra[:4])
+        if field_id != ZIP64_EXTRA_ID:
+            out += extra[:4 + field_len]
+        extra = extra[4 + field_len:]
+    return out
+
+def write_raw_member( ziph:zipfile.ZipFile, zinfo:zipfile.ZipInfo, arcname:str, raw_data ) -> int:
+    ''' Append an already compressed member (bytes, or a file read from its position to the end)
+        to a zip opened for writing, returns its compressed size '''
+    new_info = copy.copy(zinfo)
+    new_info.filename      = arcname
+    new_info.flag_bits    &= ~ZIP_DATA_DESCRIPTOR_FLAG
+    new_info.extra         = _strip_zip64_extra(zinfo.extra)
+    if hasattr(raw_data, 'read'):
+        position = raw_data.tell()
+        new_info.compress_size = raw_data.seek(0, os.SEEK_END) - position
+        raw_data.seek(position)
+    else:
+        new_info.compress_size = len(raw_data)
+    ziph.fp.seek(ziph.start_dir)
+    new_info.header_offset = ziph.fp.tell()
+    zip64 = ( new_info.file_size > zipfile.ZIP64_LIMIT ) or \
+            ( new_info.compress_size > zipfile.ZIP64_LIMIT )
+    ziph.fp.write(new_info.FileHeader(zip64))
+    if hasattr(raw_data, 'read'):
+        shutil.copyfileobj(raw_data, ziph.fp, STREAM_CHUNK_SIZE)
+    else:
+        ziph.fp.write(raw_data)
+    ziph.start_dir = ziph.fp.tell()
+    ziph.filelist.append(new_info)
+    ziph.NameToInfo[new_info.filename] = new_info
+    return new_info.compress_size
@@ -0,0 +1,72 @@
+'''
+    PlatformIO Advanced Script for NavitasTecnologia
+    See: https://docs.platformio.org/en/latest/scripting/actions.html
+
+    Entry layer of the extra scripts: checks the SCons command line targets
+    before any heavy module is imported (the IDE runs "idedata" constantly),
+    and imports subsystems lazily, on first use. Only sys and importlib here.
+'''
+# ------------------
+# Importing Modules
+# ------------------
+import sys
+import importlib
+
+# ------------------
+# Constants
+# ------------------
+PRE_SCRIPT_SKIP_TARGETS  = ["idedata", "debug"]
+POST_SCRIPT_SKIP_TARGETS = ["idedata"]
+
+# ------------------
+# Lazy Import
+# ------------------
+class LazyModule:
+    ''' Module imported on first attribute access (thread safe, the import lock is used) '''
+    def __init__(self, name:str):
+        self.__dict__['_name'] = name
+
+    def __getattr__(self, attr:str):
+        module = sys.modules.get(self._name)
+        if module is None:
+            module = importlib.import_module(self._name)
+        return getattr(module, attr)
+
+    def __setattr__(self, attr:str, value):
+        setattr(importlib.import_module(self._name), attr, value)
+
+    def __repr__(self) -> str:
+        state = "loaded" if self._name in sys.modules else "not loaded"
+        return f"<lazy module '{self._name}' ({state})>"
+
+# ------------------
+# Command Line Targets
+# ------------------
+def has_cmd_line_target( cmd, targets=None, dump_targets=False ):
+    ''' Check if there is a command with that name in targets '''
+    # Get default targets from SCons
+    if targets is None:
+        from SCons.Script import COMMAND_LINE_TARGETS #pylint: disable=W0611,E0401,C0415
+        targets = COMMAND_LINE_TARGETS
+    # Debug dump targets
+    if dump_targets:
+        with open("dump_targets.txt", "w", encoding="utf-8") as file:
+            file.write( str(targets) )
+    # Check for each item inside a list
+    if isinstance(cmd, list):
+        for cmd_i in cmd:
+            if len([c for c in targets if cmd_i in c]) > 0:
+                return True
+        return False
+    # Check for a single item
+    return len([c for c in targets if cmd in c]) > 0
+
+def is_pre_script_needed( env ) -> bool:
+    ''' Check if pre_extra_script has anything to do: not cleaning, debugging or answering the IDE '''
+    if env.GetOption('clean'):
+        return False
+    return not has_cmd_line_target(PRE_SCRIPT_SKIP_TARGETS)
+
+def is_post_script_needed() -> bool:
+    ''' Check if post_extra_script has anything to do: not answering the IDE '''
+    return not has_cmd_line_target(POST_SCRIPT_SKIP_TARGETS)
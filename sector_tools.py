@@ -0,0 +1,220 @@
+'''
+    PlatformIO Advanced Script for NavitasTecnologia
+    See: https://docs.platformio.org/en/latest/scripting/actions.html
+
+    Per flash sector hashes of firmware images, standalone (bundled in release zips),
+    to write only the sectors that changed since the last upload.
+    Usage: python sector_tools.py manifest <manifest.json> <offset> <image> [<offset> <image> ...]
+           python sector_tools.py flash    <manifest.json> [port] [--baud 460800] [--dry-run]
+           python sector_tools.py md5      <offset> <size> [--port port] [--baud 460800]
+
+    Manifest: for each image, its flash offset, size, MD5 and the MD5 of every
+    64 KB block and 4 KB sector (the last one may be shorter). MD5 is what the
+    esptool flasher stub computes on the device, so comparing costs no transfer.
+'''
+# pylint: disable=broad-except
+# ------------------
+# Importing Modules
+# ------------------
+import os
+import sys
+import json
+import mmap
+import hashlib
+import argparse
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+# ------------------
+# Constants
+# ------------------
+SECTOR_MANIFEST_FILE   = "sectors.json"
+SECTOR_MANIFEST_VER    = 1
+SECTOR_SIZE            = 4 * 1024
+BLOCK_SIZE             = 64 * 1024
+HASH_BATCH_SIZE        = 4 * 1024 * 1024    # bytes hashed by each thread job
+DEFAULT_BAUD           = 460800
+ESPTOOL_FOLDER         = "tool-esptoolpy"
+
+# ------------------
+# Manifest
+# ------------------
+def _hash_batch( data, start:int, end:int, unit:int ) -> list:
+    ''' MD5 of every unit inside data[start:end] (hashlib releases the GIL) '''
+    view = memoryview(data)
+    try:
+        return [ hashlib.md5(view[i : min(i + unit, end)]).hexdigest() for i in range(start, end, unit) ]
+    finally:
+        view.release()
+
+def hash_units( data, unit:int ) -> list:
+    ''' MD5 of every unit of data, batched over threads for big images '''
+    size = len(data)
+    if size <= HASH_BATCH_SIZE:
+        return _hash_batch(data, 0, size, unit)
+    batch = HASH_BATCH_SIZE - HASH_BATCH_SIZE % unit
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as pool:
+        jobs = [ pool.submit(_hash_batch, data, i, min(i + batch, size), unit) for i in range(0, size, batch) ]
+        return [ digest for job in jobs for digest in job.result() ]
+
+def hash_image( image_path:str, offset:int ) -> dict:
+    ''' Get manifest entry of an image written at offset '''
+    size = os.path.getsize(image_path)
+    entry = {'name': os.path.basename(image_path), 'offset': offset, 'size': size}
+    if size == 0:
+        return dict(entry, md5=hashlib.md5(b'').hexdigest(), blocks=[], sectors=[])
+    with open(image_path, 'rb') as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            entry['md5']     = hashlib.md5(data).hexdigest()
+            entry['blocks']  = hash_units(data, BLOCK_SIZE)
+            entry['sectors'] = hash_units(data, SECTOR_SIZE)
+    return entry
+
+def create_manifest( images:list ) -> dict:
+    ''' Get sector manifest of [(offset, image path)] '''
+    for offset, image_path in images:
+        if offset % SECTOR_SIZE:
+            raise ValueError(f"{image_path} offset 0x{offset:x} is not sector aligned")
+    return {
+        'version'     : SECTOR_MANIFEST_VER,
+        'hash'        : 'md5',
+        'sector_size' : SECTOR_SIZE,
+        'block_size'  : BLOCK_SIZE,
+        'images'      : [ hash_image(image_path, offset) for offset, image_path in sorted(images) ],
+    }
+
+def save_manifest( manifest:dict, manifest_path:str ):
+    ''' Save manifest as compact JSON '''
+    with open(manifest_path, 'w', encoding='UTF-8') as file:
+        file.write( json.dumps(manifest, separators=(',', ':')) )
+
+# ------------------
+# Differential Flashing
+# ------------------
+def find_changed_regions( manifest:dict, read_md5 ) -> list:
+    ''' Get [(image, start, end)] byte ranges (inside each image) that differ from the device,
+        read_md5(address, size) returns the MD5 hex digest of a flash region '''
+    changed = []
+    for image in manifest['images']:
+        size, start = image['size'], None
+        if read_md5(image['offset'], size) == image['md5']:
+            continue
+        sectors_per_block = manifest['block_size'] // manifest['sector_size']
+        for block_i, block_md5 in enumerate(image['blocks']):
+            block_start = block_i * manifest['block_size']
+            block_end   = min(size, block_start + manifest['block_size'])
+            if read_md5(image['offset'] + block_start, block_end - block_start) == block_md5:
+                sector_md5s = []
+            else:
+                sector_md5s = image['sectors'][block_i * sectors_per_block : (block_i + 1) * sectors_per_block]
+            for sector_i in range(block_start // manifest['sector_size'],
+                                  (block_end + manifest['sector_size'] - 1) // manifest['sector_size']):
+                sector_start = sector_i * manifest['sector_size']
+                sector_end   = min(size, sector_start + manifest['sector_size'])
+                is_same = ( not sector_md5s ) or \
+                    ( read_md5(image['offset'] + sector_start, sector_end - sector_start) ==
+                      sector_md5s[sector_i - block_i * sectors_per_block] )
+                if( is_same and ( start is not None ) ):
+                    changed.append( (image, start, sector_start) )
+                    start = None
+                elif( ( not is_same ) and ( start is None ) ):
+                    start = sector_start
+        if start is not None:
+            changed.append( (image, start, size) )
+    return changed
+
+def _import_esptool( folder:str ):
+    ''' Import esptool bundled next to this script, or installed '''
+    sys.path.insert(0, os.path.join(folder, ESPTOOL_FOLDER))
+    import esptool #pylint: disable=C0415,E0401
+    return esptool
+
+def _connect( esptool, port:str, baud:int ):
+    ''' Connect to the chip and run the flasher stub (esptool v3 and v4 APIs) '''
+    if not port:
+        from serial.tools import list_ports #pylint: disable=C0415,E0401
+        ports = sorted(x.device for x in list_ports.comports())
+        if not ports:
+            raise RuntimeError("no serial port found")
+        port = ports[0]
+    detect_chip = getattr(getattr(esptool, 'cmds', None), 'detect_chip', None) or esptool.ESPLoader.detect_chip
+    esp = detect_chip(port, baud)
+    esp = esp.run_stub()
+    return port, esp
+
+def flash_changed( manifest_path:str, port:str = None, baud:int = DEFAULT_BAUD, dry_run:bool = False ) -> int:
+    ''' Write only the sectors that differ from the device, returns bytes written '''
+    folder = os.path.dirname(os.path.abspath(manifest_path))
+    with open(manifest_path, 'r', encoding='UTF-8') as file:
+        manifest = json.loads(file.read())
+    esptool  = _import_esptool(folder)
+    port, esp = _connect(esptool, port, baud)
+    try:
+        changed = find_changed_regions(manifest, esp.flash_md5sum)
+        chip    = esp.CHIP_NAME.lower().replace('-', '')
+    finally:
+        esp._port.close() #pylint: disable=W0212
+    total = sum(end - start for _, start, end in changed)
+    print(f"{len(changed)} changed regions, {total} of "
+          f"{sum(x['size'] for x in manifest['images'])} bytes to write")
+    if( dry_run or ( not changed ) ):
+        return 0 if dry_run else total
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        args = ['--chip', chip, '--port', port, '--baud', str(baud), 'write_flash', '-z',
+                '--flash_mode', 'keep', '--flash_freq', 'keep', '--flash_size', 'keep']
+        for i, (image, start, end) in enumerate(changed):
+            with open(os.path.join(folder, image['name']), 'rb') as file:
+                file.seek(start)
+                data = file.read(end - start)
+            part_path = os.path.join(tmp_dir, f"part{i}.bin")
+            with open(part_path, 'wb') as file:
+                file.write(data)
+            args += [hex(image['offset'] + start), part_path]
+        esptool.main(args)
+    return total
+
+def read_flash_md5( offset:int, size:int, port:str = None, baud:int = DEFAULT_BAUD ) -> str:
+    ''' Get MD5 of a flash region of the device '''
+    esptool   = _import_esptool( os.path.dirname(os.path.abspath(__file__)) )
+    port, esp = _connect(esptool, port, baud)
+    try:
+        return esp.flash_md5sum(offset, size)
+    finally:
+        esp._port.close() #pylint: disable=W0212
+
+def main( argv ) -> int:
+    ''' Command line entry point '''
+    parser   = argparse.ArgumentParser(description="Per flash sector hashes and differential flashing")
+    commands = parser.add_subparsers(dest="command")
+    manifest_parser = commands.add_parser("manifest", help="create sector manifest of images")
+    manifest_parser.add_argument("manifest")
+    manifest_parser.add_argument("images", nargs="+", help="<offset> <image> pairs")
+    flash_parser = commands.add_parser("flash", help="write only the sectors that changed (esptool)")
+    flash_parser.add_argument("manifest")
+    flash_parser.add_argument("port", nargs="?", help="serial port (default: first one found)")
+    flash_parser.add_argument("--baud", type=int, default=DEFAULT_BAUD)
+    flash_parser.add_argument("--dry-run", action="store_true", help="only compare with the device")
+    md5_parser = commands.add_parser("md5", help="print MD5 of a flash region of the device (esptool)")
+    md5_parser.add_argument("offset", type=lambda x: int(x, 0))
+    md5_parser.add_argument("size", type=lambda x: int(x, 0))
+    md5_parser.add_argument("--port", help="serial port (default: first one found)")
+    md5_parser.add_argument("--baud", type=int, default=DEFAULT_BAUD)
+    args = parser.parse_args(argv)
+    if( ( args.command == "manifest" ) and ( len(args.images) % 2 == 0 ) ):
+        images = [ (int(args.images[i], 0), args.images[i + 1]) for i in range(0, len(args.images), 2) ]
+        save_manifest( create_manifest(images), args.manifest )
+    elif args.command == "flash":
+        flash_changed( args.manifest, args.port, args.baud, args.dry_run )
+    elif args.command == "md5":
+        print( read_flash_md5(args.offset, args.size, args.port, args.baud) )
+    else:
+        parser.print_help()
+        return 2
+    return 0
+
+if __name__ == "__main__":
+    try:
+        sys.exit( main(sys.argv[1:]) )
+    except Exception as excep:
+        print("ERROR:", excep)
+        sys.exit(1)
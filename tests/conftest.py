@@ -0,0 +1,49 @@
+'''
+    Shared fixtures: the scripts and the benchmark stand-ins (fake_env) are imported
+    from the repository root, like SCons imports them from the project folder
+'''
+# ------------------
+# Importing Modules
+# ------------------
+import os
+import sys
+import pytest
+
+REPO_FOLDER  = os.path.realpath(os.path.join(os.path.dirname(__file__), '..'))
+BENCH_FOLDER = os.path.join(REPO_FOLDER, 'benchmarks')
+sys.path[:0] = [REPO_FOLDER, BENCH_FOLDER]
+#pylint: disable=C0413
+import fake_env
+
+# ------------------
+# Fixtures
+# ------------------
+@pytest.fixture
+def scons_targets( monkeypatch ):
+    ''' Set the SCons command line targets (stand-in SCons.Script module) '''
+    def _set( targets ):
+        for name, module in fake_env.get_scons_modules(targets).items():
+            monkeypatch.setitem(sys.modules, name, module)
+    return _set
+
+@pytest.fixture
+def git_home( tmp_path, monkeypatch ):
+    ''' Empty HOME and XDG_CONFIG_HOME: no global git config nor excludes file '''
+    home = tmp_path / "home"
+    home.mkdir()
+    monkeypatch.setenv('HOME', str(home))
+    monkeypatch.setenv('XDG_CONFIG_HOME', str(home / ".config"))
+    return home
+
+@pytest.fixture
+def git_repo( tmp_path, git_home, monkeypatch ): #pylint: disable=W0613,W0621
+    ''' Throwaway repository with one commit, as the working directory '''
+    repo = tmp_path / "repo"
+    (repo / "src").mkdir(parents=True)
+    (repo / ".gitignore").write_text(".pio\n*.o\n")
+    (repo / "src" / "main.c").write_text("int main(void) { return 0; }\n")
+    fake_env.run_git(str(repo), 'init', '-q')
+    fake_env.run_git(str(repo), 'add', '-A')
+    fake_env.run_git(str(repo), 'commit', '-q', '-m', 'initial')
+    monkeypatch.chdir(repo)
+    return repo
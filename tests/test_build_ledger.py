@@ -0,0 +1,103 @@
+'''
+    Build ledger queries, and the ledger command line
+'''
+# ------------------
+# Importing Modules
+# ------------------
+import os
+import subprocess
+import pytest
+import fake_env
+import git_tools
+import build_ledger
+import firmware_manager
+
+# ------------------
+# Functions
+# ------------------
+def _info( env:str, commit:str, version:str = "1.0.0" ) -> dict:
+    ''' Firmware info of a build '''
+    return {'PIOENV': env, 'Board': env.lower(), 'Version': version, 'GIT_Commit': f"'{commit}'",
+            'GIT_Branch': 'master', 'build_epoch': 0}
+
+def _artifacts( size:int ) -> dict:
+    ''' Digests of the artifacts of a build '''
+    return {'firmware.bin': {'size': size, 'sha256': 'ab' * 32, 'md5': 'cd' * 16}}
+
+def _commit( message:str ) -> str:
+    ''' Commit a change, returns its abbreviated hash '''
+    with open("change.txt", 'a', encoding='UTF-8') as file:
+        file.write(message + "\n")
+    fake_env.run_git('.', 'add', '-A')
+    fake_env.run_git('.', 'commit', '-q', '-m', message)
+    return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD']).decode().strip()
+
+@pytest.fixture
+def ledger( tmp_path ):
+    ''' Ledger file path '''
+    return str(tmp_path / "ledger.db")
+
+# ------------------
+# Tests
+# ------------------
+def test_find_builds( ledger ):
+    ''' Filters by env (PlatformIO name or macro name), commit prefix and version, newest first '''
+    build_ledger.record_build(_info("ESP32", "abc1234"), "fw_1.0.0", _artifacts(100), p_ledger_path=ledger)
+    build_ledger.record_build(_info("ESP32", "abd5678", "1.0.1"), "fw_1.0.1", _artifacts(110), p_ledger_path=ledger)
+    build_ledger.record_build(_info("STM32", "abc1234"), "fw_1.0.0", _artifacts(90), p_ledger_path=ledger)
+    assert [x['version_name'] for x in build_ledger.find_builds("esp32", p_ledger_path=ledger)] == \
+           ["fw_1.0.1", "fw_1.0.0"]
+    assert {x['env'] for x in build_ledger.find_builds(commit="abc", p_ledger_path=ledger)} == {"ESP32", "STM32"}
+    assert [x['git_commit'] for x in build_ledger.find_builds(version="1.0.1", p_ledger_path=ledger)] == ["abd5678"]
+    assert len(build_ledger.find_builds(limit=1, p_ledger_path=ledger)) == 1
+
+def test_size_trend( ledger ):
+    ''' Artifact and footprint sizes, oldest first, with the top level phase time '''
+    phases = [{'name': 'package', 'wall_ms': 10.0}, {'name': 'package/zip', 'wall_ms': 7.0},
+              {'name': 'hash', 'wall_ms': 5.0}]
+    for i in range(3):
+        build_ledger.record_build(_info("ESP32", "abc1234", f"1.0.{i}"), f"fw_1.0.{i}", _artifacts(100 + i),
+                                  phases, footprint={'flash': 1000 + i, 'ram': 200}, p_ledger_path=ledger)
+    trend = build_ledger.get_size_trend("esp32", "firmware.bin", p_ledger_path=ledger)
+    assert [(x[1], x[2], x[3]) for x in trend] == [("fw_1.0.0", 100, 15.0), ("fw_1.0.1", 101, 15.0),
+                                                   ("fw_1.0.2", 102, 15.0)]
+    assert [x[2] for x in build_ledger.get_size_trend("esp32", "flash", 2, p_ledger_path=ledger)] == [1001, 1002]
+
+def test_fmw_info_history( ledger ):
+    ''' Firmware info states, newest first '''
+    for version in ["1.0.0", "1.0.1"]:
+        build_ledger.record_fmw_info(_info("ESP32", "abc1234", version), p_ledger_path=ledger)
+    assert [x['Version'] for x in build_ledger.get_fmw_info_history(p_ledger_path=ledger)] == ["1.0.1", "1.0.0"]
+
+def test_commits_containing( git_repo, monkeypatch ): #pylint: disable=W0613
+    ''' Descendants on every branch contain a commit, others do not; git runs a bounded number of times '''
+    base   = _commit("base")
+    before = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD~1']).decode().strip()
+    after  = _commit("after")
+    fake_env.run_git('.', 'checkout', '-q', '-b', 'side', base)
+    side   = _commit("side")
+    fake_env.run_git('.', 'checkout', '-q', '--detach')
+    dangling = _commit("dangling")
+    fake_env.run_git('.', 'checkout', '-q', 'master')
+    calls = []
+    run_git = git_tools._run_git #pylint: disable=W0212
+    monkeypatch.setattr(git_tools, '_run_git', lambda args: calls.append(args) or run_git(args))
+    contains = git_tools.get_commits_containing(base)
+    for _ in range(100):
+        assert [contains(x) for x in [base, after, side, before, dangling, ""]] == \
+               [True, True, True, False, True, False]
+    assert len(calls) == 4
+
+def test_ledger_cli_contains( git_repo, monkeypatch, capsys ):
+    ''' First build of each env containing a commit '''
+    old  = _commit("old")
+    fix  = _commit("fix")
+    new  = _commit("new")
+    ledger = os.path.join(".pio", "navitas_ledger.db")
+    monkeypatch.setattr(build_ledger, 'LEDGER_FILE', ledger)
+    for commit in [old, fix, new]:
+        for env in ["ESP32", "STM32"]:
+            build_ledger.record_build(_info(env, commit), f"fw_{env}_{commit}", _artifacts(100), p_ledger_path=ledger)
+    assert firmware_manager.cli_main(["-d", str(git_repo), "ledger", "--contains", fix]) == 0
+    lines = capsys.readouterr().out.splitlines()
+    assert sorted(x.split()[-1] for x in lines) == [f"fw_ESP32_{fix}", f"fw_STM32_{fix}"]
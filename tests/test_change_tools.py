@@ -0,0 +1,118 @@
+'''
+    change_tools must answer like "git ls-files -m --others --exclude-standard"
+'''
+# ------------------
+# Importing Modules
+# ------------------
+import os
+import json
+import time
+import subprocess
+import pytest
+import change_tools
+
+# ------------------
+# Functions
+# ------------------
+def _git_pending():
+    ''' Files pending commit according to git '''
+    out = subprocess.check_output(['git', 'ls-files', '-m', '--others', '--exclude-standard'])
+    return sorted(out.decode().splitlines())
+
+def _pending():
+    ''' Files pending commit according to the stat cache, kept out of the repository '''
+    return change_tools.get_files_pending_commit(cache_file=os.path.join("..", "change_cache.json"))
+
+def _settle():
+    ''' Let directory mtimes get older than the racy window, so the cache trusts them '''
+    time.sleep( change_tools.RACY_DIR_NS / 1e9 + 0.02 )
+
+@pytest.fixture
+def scanned_repo( git_repo ):
+    ''' Repository with an ignored-only and an empty directory, cache built '''
+    (git_repo / "build").mkdir()
+    (git_repo / "build" / "object.o").write_text("ignored")
+    (git_repo / "empty").mkdir()
+    (git_repo / "src" / "deep").mkdir()
+    _settle()
+    assert _pending() == _git_pending() == []
+    _settle()
+    return git_repo
+
+# ------------------
+# Tests
+# ------------------
+@pytest.mark.parametrize("new_file", ["top.c", "src/new.c", "build/new.c", "empty/new.c", "src/deep/new.c"])
+def test_new_file( scanned_repo, new_file ):
+    ''' A new file is found in any directory, even one that held only ignored files or none '''
+    (scanned_repo / new_file).write_text("new")
+    assert _pending() == _git_pending() == [new_file]
+
+def test_new_ignored_file( scanned_repo ):
+    ''' New ignored files are not listed '''
+    (scanned_repo / "empty" / "other.o").write_text("ignored")
+    assert _pending() == _git_pending() == []
+
+def test_new_empty_directory_then_file( scanned_repo ):
+    ''' A file created in a directory created after the last scan is found '''
+    (scanned_repo / "later").mkdir()
+    assert _pending() == _git_pending() == []
+    _settle()
+    (scanned_repo / "later" / "file.c").write_text("new")
+    assert _pending() == _git_pending() == ["later/file.c"]
+
+def test_modified_and_deleted( scanned_repo ):
+    ''' Modified and deleted tracked files are listed, deleted untracked ones are not '''
+    (scanned_repo / "empty" / "temp.c").write_text("new")
+    assert _pending() == _git_pending() == ["empty/temp.c"]
+    _settle()
+    (scanned_repo / "src" / "main.c").write_text("int main(void) { return 1; }\n")
+    os.remove(scanned_repo / "empty" / "temp.c")
+    assert _pending() == _git_pending() == ["src/main.c"]
+    os.remove(scanned_repo / "src" / "main.c")
+    assert _pending() == _git_pending() == ["src/main.c"]
+
+def test_gitignore_edits( scanned_repo ):
+    ''' Editing or deleting .gitignore lists the files it no longer ignores '''
+    (scanned_repo / ".gitignore").write_text(".pio\n")
+    assert _pending() == _git_pending() == [".gitignore", "build/object.o"]
+    _settle()
+    (scanned_repo / ".gitignore").write_text(".pio\n*.o\n*.c\n")
+    (scanned_repo / "empty" / "new.c").write_text("ignored now")
+    assert _pending() == _git_pending() == [".gitignore"]
+    os.remove(scanned_repo / ".gitignore")
+    assert _pending() == _git_pending() == [".gitignore", "build/object.o", "empty/new.c"]
+
+def test_nested_gitignore( scanned_repo ):
+    ''' A new .gitignore in a sub-directory hides the files it ignores '''
+    (scanned_repo / "src" / "deep" / "skip.c").write_text("new")
+    assert _pending() == _git_pending() == ["src/deep/skip.c"]
+    _settle()
+    (scanned_repo / "src" / "deep" / ".gitignore").write_text("skip.c\n")
+    assert _pending() == _git_pending() == ["src/deep/.gitignore"]
+
+def test_excludes_file( scanned_repo, git_home ):
+    ''' core.excludesFile (the XDG default) is part of the cached state '''
+    (scanned_repo / "empty" / "notes.txt").write_text("new")
+    assert _pending() == _git_pending() == ["empty/notes.txt"]
+    (git_home / ".config" / "git").mkdir(parents=True)
+    (git_home / ".config" / "git" / "ignore").write_text("*.txt\n")
+    assert _pending() == _git_pending() == []
+
+def test_project_in_sub_directory( git_repo, monkeypatch ):
+    ''' Ignored directories of a project inside a sub-directory of the repository are not watched '''
+    project = git_repo / "proj"
+    (project / "src").mkdir(parents=True)
+    (project / "src" / "app.c").write_text("int app;\n")
+    for env_name in ["esp32", "stm32"]:
+        (project / ".pio" / "build" / env_name / "src").mkdir(parents=True)
+    monkeypatch.chdir(project)
+    cache_file = os.path.join(".pio", "cache.json")
+    _settle()
+    assert change_tools.get_files_pending_commit(cache_file) == _git_pending() == ["src/app.c"]
+    with open(cache_file, 'r', encoding='UTF-8') as file:
+        dirs = json.loads(file.read())['dirs']
+    assert sorted(dirs) == [".", "src"]
+    _settle()
+    (project / "src" / "new.c").write_text("new")
+    assert change_tools.get_files_pending_commit(cache_file) == _git_pending() == ["src/app.c", "src/new.c"]
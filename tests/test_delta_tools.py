@@ -0,0 +1,100 @@
+'''
+    Binary deltas: apply_delta(create_delta(old, new)) must rebuild new exactly
+'''
+# ------------------
+# Importing Modules
+# ------------------
+import os
+import random
+import pytest
+import delta_tools
+
+# ------------------
+# Functions
+# ------------------
+def _image( size:int, seed:int = 1 ) -> bytes:
+    ''' Firmware-like image: random code blocks with repeated constants '''
+    rng = random.Random(seed)
+    blocks = []
+    while sum(len(x) for x in blocks) < size:
+        length = rng.randrange(64, 2048)
+        blocks.append( rng.getrandbits(8 * length).to_bytes(length, 'little') + b"\xff" * rng.randrange(0, 256) )
+    return b''.join(blocks)[:size]
+
+def _round_trip( tmp_path, old:bytes, new:bytes ) -> dict:
+    ''' Create and apply a delta, returns the delta statistics '''
+    (tmp_path / "old.bin").write_bytes(old)
+    (tmp_path / "new.bin").write_bytes(new)
+    stats = delta_tools.create_delta(str(tmp_path / "old.bin"), str(tmp_path / "new.bin"),
+                                     str(tmp_path / "delta.bin"))
+    delta_tools.apply_delta(str(tmp_path / "old.bin"), str(tmp_path / "delta.bin"), str(tmp_path / "out.bin"))
+    assert (tmp_path / "out.bin").read_bytes() == new
+    return stats
+
+# ------------------
+# Tests
+# ------------------
+OLD_IMAGE = _image(256 * 1024)
+
+@pytest.mark.parametrize("name, new", [
+    ("identical" , OLD_IMAGE),
+    ("insertion" , OLD_IMAGE[:5000] + os.urandom(3000) + OLD_IMAGE[5000:]),
+    ("deletion"  , OLD_IMAGE[:20000] + OLD_IMAGE[27000:]),
+    ("patched"   , OLD_IMAGE[:100] + b"\x00\x01\x02\x03" + OLD_IMAGE[104:]),
+    ("moved"     , OLD_IMAGE[128 * 1024:] + OLD_IMAGE[:128 * 1024]),
+    ("unrelated" , _image(200 * 1024, seed=2)),
+    ("empty"     , b""),
+    ("tiny"      , b"abc"),
+])
+def test_round_trip( tmp_path, name, new ):
+    ''' Every kind of change rebuilds the exact target '''
+    stats = _round_trip(tmp_path, OLD_IMAGE, new)
+    if name in ["identical", "insertion", "deletion", "patched", "moved"]:
+        assert stats['delta_size'] < len(new) // 10
+
+def test_empty_source( tmp_path ):
+    ''' A delta from an empty image inserts everything '''
+    _round_trip(tmp_path, b"", OLD_IMAGE[:5000])
+    _round_trip(tmp_path, b"", b"")
+
+def test_find_matches_are_ordered( ):
+    ''' COPY regions are in target order, inside both images, and really match '''
+    new = OLD_IMAGE[:20000] + os.urandom(500) + OLD_IMAGE[20000:]
+    position = 0
+    for start, end, src_start in delta_tools.find_matches(OLD_IMAGE, new):
+        assert position <= start < end <= len(new)
+        assert src_start + end - start <= len(OLD_IMAGE)
+        position = end
+    assert position > 0
+
+def test_verify_without_target( tmp_path ):
+    ''' Verify mode returns the target sha256 without writing it '''
+    stats = _round_trip(tmp_path, OLD_IMAGE, OLD_IMAGE[::-1])
+    assert delta_tools.apply_delta(str(tmp_path / "old.bin"), str(tmp_path / "delta.bin")) == stats['target_sha256']
+
+def test_wrong_source( tmp_path ):
+    ''' A delta refuses to apply to another source image '''
+    _round_trip(tmp_path, OLD_IMAGE, OLD_IMAGE[1000:])
+    (tmp_path / "old.bin").write_bytes(OLD_IMAGE[:-1] + b"\x00")
+    with pytest.raises(ValueError, match="source image"):
+        delta_tools.apply_delta(str(tmp_path / "old.bin"), str(tmp_path / "delta.bin"), str(tmp_path / "bad.bin"))
+    assert not os.path.exists(tmp_path / "bad.bin")
+
+@pytest.mark.parametrize("damage", ["truncated", "header", "corrupted", "garbage"])
+def test_damaged_delta( tmp_path, damage ):
+    ''' Damaged deltas raise ValueError and leave nothing behind '''
+    _round_trip(tmp_path, OLD_IMAGE, OLD_IMAGE[:30000] + os.urandom(2000) + OLD_IMAGE[30000:])
+    delta = bytearray((tmp_path / "delta.bin").read_bytes())
+    if damage == "truncated":
+        delta = delta[:len(delta) * 2 // 3]
+    elif damage == "header":
+        delta = delta[:delta_tools.DELTA_HEADER.size - 1]
+    elif damage == "corrupted":
+        for offset in range(delta_tools.DELTA_HEADER.size + 10, len(delta), 97):
+            delta[offset] ^= 0x5a
+    else:
+        delta = delta[:delta_tools.DELTA_HEADER.size] + os.urandom(4000)
+    (tmp_path / "delta.bin").write_bytes(bytes(delta))
+    with pytest.raises(ValueError):
+        delta_tools.apply_delta(str(tmp_path / "old.bin"), str(tmp_path / "delta.bin"), str(tmp_path / "bad.bin"))
+    assert sorted(os.listdir(tmp_path)) == ["delta.bin", "new.bin", "old.bin", "out.bin"]
@@ -0,0 +1,192 @@
+'''
+    Footprint of hand-built .elf fixtures: flash/RAM per section by load and run address
+'''
+# ------------------
+# Importing Modules
+# ------------------
+import struct
+import pytest
+import elf_tools
+
+# ------------------
+# Constants
+# ------------------
+EM_ARM          = 40
+SHT_PROGBITS    = 1
+SHT_STRTAB      = 3
+SHF_EXECINSTR   = 0x4
+AX              = elf_tools.SHF_ALLOC | SHF_EXECINSTR
+WA              = elf_tools.SHF_ALLOC | elf_tools.SHF_WRITE
+# Full program header formats (elf_tools only reads the leading fields)
+PROGRAM_FORMATS = {32: "IIIIIIII", 64: "IIQQQQQQ"}
+
+# ------------------
+# Functions
+# ------------------
+def _strtab( names ) -> tuple:
+    ''' String table and {name: offset} '''
+    table, offsets = b"\0", {}
+    for name in names:
+        offsets[name] = len(table)
+        table        += name.encode() + b"\0"
+    return table, offsets
+
+def _build_elf( path, sections, segments=(), symbols=(), machine=EM_ARM, bits=32, endianness='<' ):
+    ''' Write an ELF with sections [(name, type, flags, addr, size)], PT_LOAD segments
+        [(vaddr, paddr, memsz)] and symbols [(name, size, type, section name)] '''
+    header_fmt, section_fmt, symbol_fmt = elf_tools.ELF_FORMATS[bits][:3]
+    header_size  = struct.calcsize(endianness + header_fmt)
+    program_size = struct.calcsize(endianness + PROGRAM_FORMATS[bits])
+    section_size = struct.calcsize(endianness + section_fmt)
+    symbol_size  = struct.calcsize(endianness + symbol_fmt)
+    sections     = list(sections) + [(".symtab", elf_tools.SHT_SYMTAB, 0, 0, 0), (".strtab", SHT_STRTAB, 0, 0, 0),
+                                     (".shstrtab", SHT_STRTAB, 0, 0, 0)]
+    indexes      = {x[0]: i + 1 for i, x in enumerate(sections)}
+    shstrtab, section_names = _strtab(x[0] for x in sections)
+    strtab, symbol_names    = _strtab(x[0] for x in symbols)
+    symtab = b"\0" * symbol_size
+    for name, size, kind, section in symbols:
+        info    = ( 1 << 4 ) | kind
+        fields  = ( (symbol_names[name], info, 0, indexes[section], 0x1000, size) if bits == 64 else
+                    (symbol_names[name], 0x1000, size, info, 0, indexes[section]) )
+        symtab += struct.pack(endianness + symbol_fmt, *fields)
+    contents = {".symtab": symtab, ".strtab": strtab, ".shstrtab": shstrtab}
+
+    body, headers = b"", [b"\0" * section_size]
+    offset = header_size + program_size * len(segments)
+    for name, sh_type, flags, addr, size in sections:
+        content = contents.get(name, b"" if sh_type == elf_tools.SHT_NOBITS else b"\xaa" * size)
+        link    = indexes[".strtab"] if name == ".symtab" else 0
+        entsize = symbol_size if name == ".symtab" else 0
+        headers.append( struct.pack(endianness + section_fmt, section_names[name], sh_type, flags, addr,
+                                    offset + len(body), size or len(content), link, 0, 4, entsize) )
+        body += content
+    programs = b"".join(
+        struct.pack(endianness + PROGRAM_FORMATS[bits], *(
+            (1, 0, header_size, vaddr, paddr, memsz, memsz, 4) if bits == 64 else
+            (1, header_size, vaddr, paddr, memsz, memsz, 0, 4) ))
+        for vaddr, paddr, memsz in segments )
+    header = bytearray(struct.pack(endianness + header_fmt, 2, machine, 1, 0,
+                                   header_size if segments else 0, offset + len(body), 0, header_size,
+                                   program_size, len(segments), section_size, len(headers), len(headers) - 1))
+    header[:7] = b"\x7fELF" + bytes([2 if bits == 64 else 1, 2 if endianness == '>' else 1, 1])
+    path.write_bytes(bytes(header) + programs + body + b"".join(headers))
+    return str(path)
+
+# ------------------
+# Tests
+# ------------------
+def test_esp32_iram_counts_as_ram(tmp_path):
+    ''' ESP32 loads every segment at its run address: IRAM/RTC code is told apart by address '''
+    elf = _build_elf(tmp_path / "esp32.elf", machine=elf_tools.EM_XTENSA, sections=[
+        (".iram0.vectors", SHT_PROGBITS,          AX, 0x40080000, 0x400),
+        (".iram0.text",    SHT_PROGBITS,          AX, 0x40080400, 0x1000),
+        (".dram0.data",    SHT_PROGBITS,          WA, 0x3FFB0000, 0x200),
+        (".dram0.bss",     elf_tools.SHT_NOBITS,  WA, 0x3FFB0200, 0x800),
+        (".flash.rodata",  SHT_PROGBITS,  elf_tools.SHF_ALLOC, 0x3F400020, 0x3000),
+        (".flash.text",    SHT_PROGBITS,          AX, 0x400D0020, 0x8000),
+        (".rtc.text",      SHT_PROGBITS,          AX, 0x400C0000, 0x100),
+        (".comment",       SHT_PROGBITS,           0, 0,          0x40),
+    ], segments=[(0x40080000, 0x40080000, 0x1400), (0x3FFB0000, 0x3FFB0000, 0xA00),
+                 (0x3F400020, 0x3F400020, 0x3000), (0x400D0020, 0x400D0020, 0x8000),
+                 (0x400C0000, 0x400C0000, 0x100)])
+    footprint = elf_tools.get_footprint(elf)
+    assert footprint['sections'] == {
+        ".iram0.vectors" : [0x400,  elf_tools.REGION_BOTH],
+        ".iram0.text"    : [0x1000, elf_tools.REGION_BOTH],
+        ".dram0.data"    : [0x200,  elf_tools.REGION_BOTH],
+        ".dram0.bss"     : [0x800,  elf_tools.REGION_RAM],
+        ".flash.rodata"  : [0x3000, elf_tools.REGION_FLASH],
+        ".flash.text"    : [0x8000, elf_tools.REGION_FLASH],
+        ".rtc.text"      : [0x100,  elf_tools.REGION_BOTH],
+    }
+    assert footprint['flash'] == 0x400 + 0x1000 + 0x200 + 0x3000 + 0x8000 + 0x100
+    assert footprint['ram'] == 0x400 + 0x1000 + 0x200 + 0x800 + 0x100
+
+def test_esp8266_text_runs_from_iram(tmp_path):
+    ''' ESP8266 .text is IRAM, .irom0.text is flash mapped '''
+    elf = _build_elf(tmp_path / "esp8266.elf", machine=elf_tools.EM_XTENSA, sections=[
+        (".text",       SHT_PROGBITS, AX, 0x40100000, 0x6000),
+        (".irom0.text", SHT_PROGBITS, AX, 0x40201010, 0x20000),
+        (".rodata",     SHT_PROGBITS, elf_tools.SHF_ALLOC, 0x3FFE8000, 0x800),
+    ], segments=[(0x40100000, 0x40100000, 0x6000), (0x40201010, 0x40201010, 0x20000),
+                 (0x3FFE8000, 0x3FFE8000, 0x800)])
+    sections = elf_tools.get_footprint(elf)['sections']
+    assert sections[".text"][1] == elf_tools.REGION_BOTH
+    assert sections[".irom0.text"][1] == elf_tools.REGION_FLASH
+    assert sections[".rodata"][1] == elf_tools.REGION_BOTH
+
+def test_code_copied_to_ram_counts_as_ram(tmp_path):
+    ''' Cortex-M code run from SRAM is told apart by its load address (LMA != VMA) '''
+    elf = _build_elf(tmp_path / "stm32.elf", sections=[
+        (".isr_vector", SHT_PROGBITS,          elf_tools.SHF_ALLOC, 0x08000000, 0x188),
+        (".text",       SHT_PROGBITS,          AX, 0x08000188, 0x4000),
+        (".ramfunc",    SHT_PROGBITS,          AX, 0x20000000, 0x100),
+        (".data",       SHT_PROGBITS,          WA, 0x20000100, 0x80),
+        (".bss",        elf_tools.SHT_NOBITS,  WA, 0x20000180, 0x400),
+    ], segments=[(0x08000000, 0x08000000, 0x4188), (0x20000000, 0x08004188, 0x180),
+                 (0x20000180, 0x20000180, 0x400)])
+    footprint = elf_tools.get_footprint(elf)
+    assert footprint['sections'][".ramfunc"][1] == elf_tools.REGION_BOTH
+    assert footprint['sections'][".text"][1] == elf_tools.REGION_FLASH
+    assert footprint['flash'] == 0x188 + 0x4000 + 0x100 + 0x80
+    assert footprint['ram'] == 0x100 + 0x80 + 0x400
+
+def test_without_program_headers_writable_is_ram(tmp_path):
+    ''' Relocatable objects have no program headers: writable sections are the RAM ones '''
+    elf = _build_elf(tmp_path / "object.elf", sections=[
+        (".text", SHT_PROGBITS,         AX, 0, 0x100),
+        (".data", SHT_PROGBITS,         WA, 0, 0x10),
+        (".bss",  elf_tools.SHT_NOBITS, WA, 0, 0x20),
+    ])
+    footprint = elf_tools.get_footprint(elf)
+    assert (footprint['flash'], footprint['ram']) == (0x110, 0x30)
+
+@pytest.mark.parametrize("bits, endianness", [(32, '<'), (32, '>'), (64, '<'), (64, '>')])
+def test_symbols_largest_first(tmp_path, bits, endianness):
+    ''' Sized functions/objects of every ELF class and endianness, largest first '''
+    elf = _build_elf(tmp_path / "symbols.elf", bits=bits, endianness=endianness, sections=[
+        (".text", SHT_PROGBITS,         AX, 0x1000, 0x200),
+        (".bss",  elf_tools.SHT_NOBITS, WA, 0x8000, 0x100),
+    ], segments=[(0x1000, 0x1000, 0x200), (0x8000, 0x8000, 0x100)], symbols=[
+        ("small_func", 0x10,  elf_tools.STT_FUNC,   ".text"),
+        ("big_buffer", 0x100, elf_tools.STT_OBJECT, ".bss"),
+        ("empty_func", 0,     elf_tools.STT_FUNC,   ".text"),
+    ])
+    footprint = elf_tools.get_footprint(elf, top_symbols=1)
+    assert footprint['symbols_total'] == 2
+    assert footprint['symbols'] == [["big_buffer", 0x100, "object", ".bss", elf_tools.REGION_RAM]]
+    assert (footprint['flash'], footprint['ram']) == (0x200, 0x100)
+
+def test_not_an_elf(tmp_path):
+    ''' Anything else is rejected '''
+    (tmp_path / "firmware.bin").write_bytes(b"\xe9" + b"\0" * 100)
+    with pytest.raises(ValueError):
+        elf_tools.get_footprint(str(tmp_path / "firmware.bin"))
+
+def test_diff_footprints():
+    ''' Growth per region, and per symbol only where both sizes are known '''
+    old = {'flash': 1000, 'ram': 500, 'sections': {'.text': [900, 'flash'], '.bss': [500, 'ram']},
+           'symbols_total': 3, 'symbols': [['a', 300], ['b', 200]]}
+    new = {'flash': 1100, 'ram': 450, 'sections': {'.text': [1000, 'flash'], '.bss': [450, 'ram']},
+           'symbols_total': 2, 'symbols': [['a', 350], ['c', 100]]}
+    diff = elf_tools.diff_footprints(old, new)
+    assert (diff['flash'], diff['ram']) == (100, -50)
+    assert diff['sections'] == [['.text', 100], ['.bss', -50]]
+    # The new list is complete ('b' was removed), 'c' may have been below the old truncated one
+    assert diff['symbols'] == [['b', -200], ['a', 50]]
+
+@pytest.mark.parametrize("value, expected", [
+    ("123456", 123456), ("320K", 320 * 1024), ("4M", 4 * 1024 * 1024), ("1.5kb", 1536), ("", None),
+])
+def test_parse_size(value, expected):
+    ''' Bytes with K/M suffixes '''
+    assert elf_tools.parse_size(value) == expected
+
+def test_check_budgets():
+    ''' Only regions above a set budget are reported '''
+    footprint = {'flash': 2000, 'ram': 100}
+    assert elf_tools.check_budgets(footprint, {'flash': 2000, 'ram': None}) == []
+    messages = elf_tools.check_budgets(footprint, {'flash': 1500, 'ram': 200})
+    assert messages == ["flash 2000 B exceeds its budget of 1500 B by 500 B"]
+    assert "25.0% of 400 B" in elf_tools.get_summary(footprint, None, {'ram': 400})
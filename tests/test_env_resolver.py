@@ -0,0 +1,101 @@
+'''
+    Resolver of SCons variable expressions, used to build the shipped upload command
+'''
+# ------------------
+# Importing Modules
+# ------------------
+import os
+import pytest
+import fake_env
+import env_resolver
+
+# ------------------
+# Fixtures
+# ------------------
+@pytest.fixture
+def build( tmp_path ):
+    ''' Build folder with the firmware and the ESP32 images, tool packages without files '''
+    build_dir = tmp_path / "build"
+    for name in ["firmware.bin", "firmware.elf", "bootloader.bin", "partitions.bin"]:
+        fake_env.write_synthetic_file(str(build_dir / name), 64)
+    fake_env.write_synthetic_file(str(tmp_path / "packages" / "tool-esptoolpy" / "esptool.py"), 64)
+    (tmp_path / "packages" / "tool-openocd" / "scripts").mkdir(parents=True)
+    env_resolver.clear_resolver_cache()
+    return build_dir
+
+def _resolve( env, value, collect_files=False ):
+    ''' Resolve with a new resolver of env '''
+    return env_resolver.EnvResolver(env).resolve(value, collect_files)
+
+# ------------------
+# Tests
+# ------------------
+def test_esptool_upload_command(tmp_path, build):
+    ''' Files are collected and replaced by their names, the port is left to the upload script '''
+    env = fake_env.make_esptool_env(str(tmp_path), str(build))
+    text, files = _resolve(env, "$UPLOADCMD", True)
+    assert text == ( "python.exe esptool.py --chip esp32 --port --baud 460800 write_flash -z "
+                     "0x1000 bootloader.bin 0x8000 partitions.bin 0x10000 firmware.bin" )
+    assert files == { os.path.realpath(str(x)) for x in [
+        build / "bootloader.bin", build / "partitions.bin", build / "firmware.bin",
+        tmp_path / "packages" / "tool-esptoolpy" / "esptool.py"] }
+
+def test_openocd_upload_command(tmp_path, build):
+    ''' $SOURCE inside a quoted Tcl command is the .bin, folders are not files '''
+    env = fake_env.make_openocd_env(str(tmp_path), str(build))
+    text, files = _resolve(env, "$UPLOADCMD", True)
+    scripts = str(tmp_path / "packages" / "tool-openocd" / "scripts")
+    assert text == ( f"openocd -s {scripts} -f interface/stlink.cfg -c transport select hla_swd "
+                     "-f target/stm32f4x.cfg -c program {firmware.bin} 0x08000000 verify reset; shutdown;" )
+    assert files == {os.path.realpath(str(build / "firmware.bin"))}
+
+def test_source_without_bin(tmp_path, build):
+    ''' $SOURCE is $PROG_PATH when there is no .bin next to it '''
+    os.remove(build / "firmware.bin")
+    env = fake_env.make_openocd_env(str(tmp_path), str(build))
+    assert _resolve(env, "$SOURCE")[0] == str(build / "firmware.elf")
+
+@pytest.mark.parametrize("value, expected", [
+    ("${NAME}.bin"              , "firmware.bin"),
+    ("$BUILD_DIR/$NAME.bin"     , "/out/firmware.bin"),
+    ('"$BUILD_DIR/${NAME}.elf"' , "/out/firmware.elf"),
+    ("'$FLAGS' $FLAGS"          , "-a -b -a -b"),
+    ("$$NAME ${NAME}x"          , "$NAME firmwarex"),
+    ("$FLAGS_LIST end"          , "-c one two end"),
+])
+def test_variable_forms(value, expected):
+    ''' $NAME, ${NAME}, quoted forms, $$ and list values '''
+    env = fake_env.FakeEnv(NAME="firmware", BUILD_DIR="/out", FLAGS="-a -b", FLAGS_LIST=["-c", "one two"])
+    assert _resolve(env, value)[0] == expected
+
+def test_missing_variable(capsys):
+    ''' A missing variable is left as is '''
+    env = fake_env.FakeEnv(NAME="firmware")
+    assert _resolve(env, "$MISSING/$NAME")[0] == "$MISSING/firmware"
+    assert '"MISSING" not found!' in capsys.readouterr().out
+
+def test_cycle_guard(capsys):
+    ''' Variables referencing themselves, directly or through another one, stop there '''
+    env = fake_env.FakeEnv(A="a$B", B="b$A", C="x $C")
+    assert _resolve(env, "$A")[0] == "ab$A"
+    assert _resolve(env, "$C")[0] == "x $C"
+    assert 'references itself!' in capsys.readouterr().out
+
+def test_cache_follows_env_changes(tmp_path, build):
+    ''' A resolved value is cached until a variable it depends on changes '''
+    env = fake_env.FakeEnv(BUILD_DIR=str(build), NAME="firmware", PROG_PATH="$BUILD_DIR/$NAME.elf",
+                           OUT="$PROG_PATH")
+    assert env_resolver.resolve_env_value(env, "$OUT")[0] == str(build / "firmware.elf")
+    env['NAME'] = "app"
+    assert env_resolver.resolve_env_value(env, "$OUT")[0] == str(build / "app.elf")
+    # $SOURCE also depends on the .bin existing
+    assert env_resolver.get_resolver(env).get_firmware_path() == str(build / "app.elf")
+    fake_env.write_synthetic_file(str(build / "app.bin"), 64)
+    assert env_resolver.get_resolver(env).get_firmware_path() == str(build / "app.bin")
+
+def test_collected_files_are_deduplicated(tmp_path, build):
+    ''' A file referenced many times, or by another path to it, is collected once '''
+    env = fake_env.FakeEnv(BUILD_DIR=str(build), OTHER=str(tmp_path / "build" / ".." / "build"))
+    text, files = _resolve(env, "$BUILD_DIR/firmware.bin {$BUILD_DIR/firmware.bin} $OTHER/firmware.bin", True)
+    assert text == "firmware.bin {firmware.bin} firmware.bin"
+    assert files == {os.path.realpath(str(build / "firmware.bin"))}
@@ -0,0 +1,112 @@
+'''
+    Shared firmware info: envs built in parallel on one checkout increase the version once
+'''
+# ------------------
+# Importing Modules
+# ------------------
+import os
+import sys
+import json
+import time
+import subprocess
+import pytest
+import fake_env
+import pio_tools
+import firmware_manager
+
+# ------------------
+# Constants
+# ------------------
+# Runs pre_build_action of one env in a new process (like one "pio run -e <env>"): argv is the
+# scripts folder, the env name, its board and a marker file written once the pending files are listed
+CHILD_CODE = r'''
+import sys
+scripts_folder, env_name, board, marker = sys.argv[1:5]
+sys.path[:0] = [scripts_folder, scripts_folder + "/benchmarks"]
+import fake_env, change_tools, firmware_manager
+list_pending = change_tools.get_files_pending_commit
+def _listed(*args, **kwargs):
+    files = list_pending(*args, **kwargs)
+    open(marker, 'w').close()
+    return files
+change_tools.get_files_pending_commit = _listed
+env = fake_env.FakeEnv({'custom_fmw_update_policy': 'always', 'custom_fmw_info_sources': 'env'},
+                       PIOENV=env_name, BOARD=board, BUILD_DIR=".pio/build/" + env_name)
+firmware_manager.pre_build_action(None, None, env)
+'''
+
+# ------------------
+# Functions
+# ------------------
+def _read_json( path ) -> dict:
+    ''' Read a JSON file '''
+    with open(path, 'r', encoding='UTF-8') as file:
+        return json.loads(file.read())
+
+def _build( envs:list, run_id:str, hold_lock:bool = False ):
+    ''' Run pre_build_action of each (env, board) in parallel processes of their own "pio run".
+        hold_lock: every process lists its pending files before the first one takes the lock '''
+    markers = [os.path.abspath(f".pio/listed_{name}") for name, _ in envs]
+    for marker in markers:
+        if os.path.exists(marker):
+            os.remove(marker)
+    os.makedirs(os.path.dirname(firmware_manager.FMW_INFO_LOCK_FILE), exist_ok=True)
+    with pio_tools.file_lock(firmware_manager.FMW_INFO_LOCK_FILE) if hold_lock else open(os.devnull) as _:
+        procs = [subprocess.Popen([sys.executable, "-c", CHILD_CODE, firmware_manager.THIS_PATH.as_posix(),
+                                   name, board, marker],
+                                  env=dict(os.environ, NAVITAS_RUN_ID=f"{run_id}_{name}"),
+                                  stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+                 for (name, board), marker in zip(envs, markers)]
+        deadline = time.monotonic() + 60
+        while( hold_lock and ( time.monotonic() < deadline ) and
+               ( not all(os.path.exists(x) for x in markers) ) ):
+            time.sleep(0.01)
+    outputs = [x.communicate(timeout=60)[0].decode() for x in procs]
+    assert all(x.returncode == 0 for x in procs), outputs
+    return outputs
+
+@pytest.fixture
+def project( git_repo ):
+    ''' Repository whose committed firmware info is version 1.0.0 '''
+    os.makedirs("scripts")
+    info = {'Version': '1.0.0', 'Description': '', 'Date': '', 'GIT_Project': '', 'GIT_Version': '',
+            'GIT_Branch': '', 'GIT_Commit': '', 'GIT_Origin': ''}
+    for path in [firmware_manager.CUR_FMW_INFO, firmware_manager.OLD_FMW_INFO]:
+        with open(path, 'w', encoding='UTF-8') as file:
+            file.write(json.dumps(info, indent=4))
+    fake_env.run_git('.', 'add', '-A')
+    fake_env.run_git('.', 'commit', '-q', '-m', 'firmware info')
+    return git_repo
+
+def _change_source( project, text:str ):
+    ''' Make the tree dirty '''
+    (project / "src" / "main.c").write_text(text)
+
+# ------------------
+# Tests
+# ------------------
+def test_parallel_envs_increase_once( project ):
+    ''' Two "pio run -e" listing their pending files before either takes the lock '''
+    _change_source(project, "int main(void) { return 1; }\n")
+    _build([("esp32", "esp32dev"), ("stm32", "nucleo_f401re")], "parallel", hold_lock=True)
+    shared = _read_json(firmware_manager.CUR_FMW_INFO)
+    assert shared['Version'] == "1.0.1"
+    assert 'Board' not in shared and 'PIOENV' not in shared
+    for name, board in [("esp32", "esp32dev"), ("stm32", "nucleo_f401re")]:
+        env_info = _read_json(os.path.join(firmware_manager.FMW_INFO_ENV_FOLDER, name + ".json"))
+        assert (env_info['Version'], env_info['Board'], env_info['PIOENV']) == ("1.0.1", board, name.upper())
+
+def test_once_per_commit( project ):
+    ''' Later runs keep the version until the increase is committed, the next change increases it again '''
+    _change_source(project, "int main(void) { return 1; }\n")
+    _build([("esp32", "esp32dev")], "first")
+    _build([("esp32", "esp32dev"), ("stm32", "nucleo_f401re")], "second")
+    assert _read_json(firmware_manager.CUR_FMW_INFO)['Version'] == "1.0.1"
+    shared_text = (project / firmware_manager.CUR_FMW_INFO).read_text()
+    _build([("stm32", "nucleo_f401re")], "third")
+    assert (project / firmware_manager.CUR_FMW_INFO).read_text() == shared_text
+    fake_env.run_git('.', 'add', '-A')
+    fake_env.run_git('.', 'commit', '-q', '-m', 'change')
+    _change_source(project, "int main(void) { return 2; }\n")
+    _build([("esp32", "esp32dev")], "fourth")
+    assert _read_json(firmware_manager.CUR_FMW_INFO)['Version'] == "1.0.2"
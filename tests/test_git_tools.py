@@ -0,0 +1,99 @@
+'''
+    The .git reader must answer like the git binary
+'''
+# ------------------
+# Importing Modules
+# ------------------
+import os
+import pytest
+import fake_env
+import git_tools
+
+# ------------------
+# Functions
+# ------------------
+def _git( *args ):
+    ''' Run git in the current repository '''
+    fake_env.run_git('.', *args)
+
+def _commit( message:str ):
+    ''' Commit a change '''
+    with open("change.txt", 'a', encoding='UTF-8') as file:
+        file.write(message + "\n")
+    _git('add', '-A')
+    _git('commit', '-q', '-m', message)
+
+def _assert_same_as_git():
+    ''' Reader (completed by describe when needed) and git binary agree on every field '''
+    expected = git_tools.query_git_snapshot().as_dict()
+    read     = git_tools.read_git_snapshot()
+    assert {k: v for k, v in read.as_dict().items() if k != 'version'} == \
+           {k: v for k, v in expected.items() if k != 'version'}
+    assert read.version in [None, expected['version']]
+    assert git_tools._query_git_snapshot_with_backend().as_dict() == expected #pylint: disable=W0212
+
+# ------------------
+# Tests
+# ------------------
+def test_no_repository( tmp_path, monkeypatch ):
+    ''' Outside a repository there is no snapshot '''
+    monkeypatch.chdir(tmp_path)
+    assert git_tools.read_git_snapshot() is None
+
+def test_no_commits( tmp_path, git_home, monkeypatch ): #pylint: disable=W0613
+    ''' A new repository has no branch nor commit yet '''
+    monkeypatch.chdir(tmp_path)
+    _git('init', '-q')
+    assert git_tools.read_git_snapshot().as_dict() == git_tools.query_git_snapshot().as_dict()
+
+@pytest.mark.parametrize("scenario", ["untagged", "lightweight", "annotated", "packed", "after_tag",
+                                      "two_tags", "detached", "origin", "branch"])
+def test_snapshot( git_repo, scenario ): #pylint: disable=W0613
+    ''' Tags (loose, packed, annotated), detached HEAD, branches and origin '''
+    if scenario in ["lightweight", "packed", "after_tag", "two_tags"]:
+        _git('tag', 'v1.0.0')
+    if scenario == "annotated":
+        _git('tag', '-a', 'v2.0.0', '-m', 'release')
+    if scenario == "two_tags":
+        _git('tag', '-a', 'v1.0.1', '-m', 'release')
+    if scenario == "packed":
+        _commit("second")
+        _git('tag', '-a', 'v1.1.0', '-m', 'release')
+        _git('pack-refs', '--all')
+        _git('gc', '-q')
+    if scenario == "after_tag":
+        _commit("second")
+    if scenario == "detached":
+        _commit("second")
+        _git('checkout', '-q', 'HEAD~1')
+    if scenario == "origin":
+        _git('remote', 'add', 'origin', 'https://example.com/navitas/project.git')
+    if scenario == "branch":
+        _git('checkout', '-q', '-b', 'feature/reader')
+        _commit("on branch")
+    _assert_same_as_git()
+
+def test_worktree( git_repo, tmp_path, monkeypatch ):
+    ''' Linked worktrees read HEAD from their git dir and refs from the common dir '''
+    _git('tag', 'v1.0.0')
+    _git('worktree', 'add', '-q', '-b', 'other', str(tmp_path / "worktree"))
+    monkeypatch.chdir(tmp_path / "worktree")
+    _commit("in worktree")
+    _assert_same_as_git()
+    assert git_tools.find_git_dir()[2] == os.path.realpath(git_repo / ".git")
+
+def test_config_parsing( tmp_path ):
+    ''' Sections, subsections, quotes and comments of a git config file '''
+    (tmp_path / "config").write_text('[core]\n\tabbrev = 9\n; comment\n[remote "origin"]\n'
+                                     '\turl = "git@example.com:a/b.git"\n# comment\n[Core]\n\tExcludesFile = ~/ignore\n')
+    config = git_tools._read_git_config(str(tmp_path)) #pylint: disable=W0212
+    assert config == {'core.abbrev': '9', 'remote.origin.url': 'git@example.com:a/b.git',
+                      'core.excludesfile': '~/ignore'}
+
+def test_excludes_file( tmp_path, git_home ):
+    ''' core.excludesFile: repository config first, then ~/.gitconfig, then the XDG default '''
+    assert git_tools.get_excludes_file(str(tmp_path)) == str(git_home / ".config" / "git" / "ignore")
+    (git_home / ".gitconfig").write_text("[core]\n\texcludesFile = ~/global_ignore\n")
+    assert git_tools.get_excludes_file(str(tmp_path)) == str(git_home / "global_ignore")
+    (tmp_path / "config").write_text("[core]\n\texcludesfile = /repo/ignore\n")
+    assert git_tools.get_excludes_file(str(tmp_path)) == "/repo/ignore"
@@ -0,0 +1,116 @@
+'''
+    Release packaging: a release packaged from the env snapshot (background) is the
+    same zip as the one packaged with the SCons env (sync)
+'''
+# ------------------
+# Importing Modules
+# ------------------
+import os
+import sys
+import json
+import glob
+import shutil
+import zipfile
+import pytest
+import fake_env
+import hash_tools
+import env_resolver
+import env_snapshot
+import package_scheduler
+import firmware_manager
+
+# ------------------
+# Constants
+# ------------------
+OPTIONS = {
+    'custom_fmw_update_policy'       : 'always',
+    'custom_release_store'           : 'no',
+    'custom_build_ledger'            : 'no',
+    'custom_footprint_budget_action' : 'fail',
+    'custom_env_dump'                : 'scripts',
+}
+# ESP8266 like: the app offset only comes from the board manifest
+BOARD   = {'upload.offset_address': "0x10000", 'upload.maximum_size': 1048576, 'upload.maximum_ram_size': 81920}
+
+# ------------------
+# Fixtures
+# ------------------
+@pytest.fixture
+def project_env( tmp_path, git_home, scons_targets, monkeypatch ): #pylint: disable=W0613
+    ''' Built esptool project without ESP32_APP_OFFSET, as the working directory, uploading '''
+    scons_targets(["upload"])
+    project_dir = tmp_path / "project"
+    build_dir   = fake_env.create_project(str(project_dir), 256 * 1024)
+    monkeypatch.chdir(project_dir)
+    monkeypatch.setenv('PLATFORMIO_CORE_DIR', str(tmp_path / "core"))
+    env = fake_env.make_esptool_env(str(project_dir), build_dir, dict(OPTIONS), dict(BOARD))
+    del env['ESP32_APP_OFFSET']
+    firmware_manager.pre_build_action(None, None, env)
+    yield env
+    fake_env.forget_packaging_jobs(package_scheduler)
+
+# ------------------
+# Functions
+# ------------------
+def _package( env, mode:str, monkeypatch ) -> str:
+    ''' Package a new build in mode, returns the zip path '''
+    monkeypatch.setenv('NAVITAS_RELEASE_PACKAGING', mode)
+    shutil.rmtree(firmware_manager.RELEASE_OUTPUT_FOLDER, ignore_errors=True)
+    fake_env.forget_packaging_jobs(package_scheduler)
+    hash_tools.clear_digest_cache()
+    env_resolver.clear_resolver_cache()
+    assert firmware_manager.post_build_action(None, None, env) is None
+    assert package_scheduler.join(env['PIOENV'])
+    zips = glob.glob(os.path.join(firmware_manager.RELEASE_OUTPUT_FOLDER, env['PIOENV'], "*.zip"))
+    assert len(zips) == 1
+    return zips[0]
+
+# ------------------
+# Tests
+# ------------------
+def test_snapshot_keeps_board_and_options(project_env):
+    ''' Everything packaging reads from the env is in its snapshot '''
+    snapshot = env_snapshot.EnvSnapshot( env_snapshot.collect_env_snapshot(project_env) )
+    assert snapshot.BoardConfig() == BOARD
+    for option, value in OPTIONS.items():
+        assert snapshot.GetProjectOption(option) == value
+    assert snapshot.GetProjectOption('custom_release_delta', 'default') == 'default'
+
+def test_background_zip_same_as_sync(project_env, monkeypatch):
+    ''' Both modes write the same members, byte for byte '''
+    with open(_package(project_env, package_scheduler.PACKAGING_MODE_SYNC, monkeypatch), 'rb') as file:
+        sync_zip = file.read()
+    background_path = _package(project_env, package_scheduler.PACKAGING_MODE_BACKGROUND, monkeypatch)
+    with open(background_path, 'rb') as file:
+        assert file.read() == sync_zip
+    with zipfile.ZipFile(background_path) as archive:
+        manifest = json.loads(archive.read("bin/sectors.json"))
+    assert {x['name']: x['offset'] for x in manifest['images']}["firmware.bin"] == 0x10000
+
+def test_release_cli_applies_budget_action(project_env):
+    ''' Packaged again from the snapshot, an env above its budget still fails (with its zip) '''
+    with open(os.path.realpath(sys.executable), 'rb') as file:
+        if file.read(4) != b"\x7fELF":
+            pytest.skip("needs an ELF executable as firmware.elf")
+    shutil.copyfile(os.path.realpath(sys.executable), os.path.join(project_env['BUILD_DIR'], "firmware.elf"))
+    snapshot_path = env_snapshot.get_env_snapshot_path(project_env['BUILD_DIR'])
+    data = env_snapshot.save_env_snapshot(project_env, snapshot_path)
+    data['options']['custom_flash_budget'] = "1K"
+    with open(snapshot_path, 'w', encoding='UTF-8') as file:
+        file.write( json.dumps(data) )
+    with pytest.raises(RuntimeError, match="exceeds its memory budget"):
+        firmware_manager._package_release_from_snapshot(snapshot_path) #pylint: disable=W0212
+    assert glob.glob(os.path.join(firmware_manager.RELEASE_OUTPUT_FOLDER, project_env['PIOENV'], "*.zip"))
+
+def test_background_only_with_upload(project_env, scons_targets, monkeypatch):
+    ''' Without an upload to overlap, the release is packaged before the build ends,
+        and a packaging failure fails the build '''
+    assert firmware_manager.get_release_packaging_mode(project_env) == package_scheduler.PACKAGING_MODE_BACKGROUND
+    scons_targets(["buildprog"])
+    assert firmware_manager.get_release_packaging_mode(project_env) == package_scheduler.PACKAGING_MODE_SYNC
+    fake_env.forget_packaging_jobs(package_scheduler)
+    def _failing_release(*args, **kwargs):
+        raise RuntimeError("disk full")
+    monkeypatch.setattr(firmware_manager, "package_release", _failing_release)
+    with pytest.raises(RuntimeError, match="disk full"):
+        firmware_manager.post_build_action(None, None, project_env)
@@ -0,0 +1,97 @@
+'''
+    Release store: stored releases come back byte-identical, shared members are stored once
+'''
+# ------------------
+# Importing Modules
+# ------------------
+import os
+import zipfile
+import pytest
+import release_tools
+import release_store
+
+# ------------------
+# Functions
+# ------------------
+def _make_release( folder, name:str, firmware:bytes, method:str = 'deflate' ) -> str:
+    ''' Write a release zip with a shared tool member and a firmware member '''
+    manifest = release_tools.ReleaseManifest()
+    manifest.add_bytes("tools/upload.py", "print('upload')\n" * 100)
+    manifest.add_bytes("firmware.bin", firmware)
+    zip_path = str(folder / name)
+    manifest.write(zip_path, method)
+    return zip_path
+
+@pytest.fixture
+def store( tmp_path, monkeypatch ):
+    ''' Empty store, with a clock advancing one second per call '''
+    clock = [release_store.time.time()]
+    def _time():
+        clock[0] += 1.0
+        return clock[0]
+    monkeypatch.setattr(release_store.time, 'time', _time)
+    return release_store.ReleaseStore(str(tmp_path / "store"))
+
+def _object_count( store ) -> int:
+    ''' Count stored objects '''
+    return sum( len(files) for _, _, files in os.walk(os.path.join(store.root, release_store.OBJECTS_FOLDER)) )
+
+# ------------------
+# Tests
+# ------------------
+@pytest.mark.parametrize("method", ["deflate", "stored", "lzma"])
+def test_materialize_is_byte_identical( tmp_path, store, method ):
+    ''' A stored release is written back as the same zip '''
+    zip_path = _make_release(tmp_path, "fw_1.0.0.zip", b"firmware 1.0.0 " * 1000, method)
+    store.add_release(zip_path, "esp32", info={'version': '1.0.0'}, fingerprint="abc")
+    out_path = store.materialize( store.find_release("esp32", "1.0.0"), str(tmp_path / "out" / "fw.zip") )
+    with open(zip_path, 'rb') as original, open(out_path, 'rb') as restored:
+        assert original.read() == restored.read()
+    with zipfile.ZipFile(out_path) as ziph:
+        assert ziph.testzip() is None
+    assert store.has_release("esp32", "fw_1.0.0.zip", "abc")
+    assert not store.has_release("esp32", "fw_1.0.0.zip", "other")
+
+def test_shared_members_are_stored_once( tmp_path, store ):
+    ''' Releases share the objects of identical members '''
+    store.add_release(_make_release(tmp_path, "fw_1.zip", b"one" * 1000), "esp32")
+    assert _object_count(store) == 2
+    store.add_release(_make_release(tmp_path, "fw_2.zip", b"two" * 1000), "esp32")
+    store.add_release(_make_release(tmp_path, "fw_2.zip", b"two" * 1000), "stm32")
+    assert _object_count(store) == 3
+
+def test_find_release( tmp_path, store ):
+    ''' Exact zip name first, then part of the name, most recently used first '''
+    for version in ["1.0.0", "1.0.1", "1.0.10"]:
+        store.add_release(_make_release(tmp_path, f"fw_{version}.zip", version.encode() * 100), "esp32")
+    assert store.find_release("esp32", "fw_1.0.1")['zip_name'] == "fw_1.0.1.zip"
+    assert store.find_release("esp32", "1.0.1")['zip_name'] == "fw_1.0.10.zip"
+    assert store.find_release("esp32", "2.0.0") is None
+    assert store.find_release("stm32", "1.0.0") is None
+    assert [x['zip_name'] for x in store.list_releases("esp32")] == ["fw_1.0.10.zip", "fw_1.0.1.zip", "fw_1.0.0.zip"]
+
+def test_evict_by_count( tmp_path, store, monkeypatch ):
+    ''' Least recently used releases beyond the limit are forgotten, their objects deleted '''
+    monkeypatch.setattr(release_store, 'GC_GRACE_SECONDS', -1e9)
+    for i in range(4):
+        store.add_release(_make_release(tmp_path, f"fw_{i}.zip", str(i).encode() * 1000), "esp32")
+    store.materialize(store.find_release("esp32", "fw_0"), str(tmp_path / "used.zip"))
+    assert store.evict("esp32", max_releases=2) == 2
+    assert sorted(x['zip_name'] for x in store.list_releases("esp32")) == ["fw_0.zip", "fw_3.zip"]
+    assert _object_count(store) == 3
+
+def test_evict_by_size_keeps_latest( tmp_path, store ):
+    ''' The most recent release is kept even when it is alone over the size limit '''
+    store.add_release(_make_release(tmp_path, "fw_1.zip", os.urandom(64 * 1024)), "esp32")
+    store.add_release(_make_release(tmp_path, "fw_2.zip", os.urandom(64 * 1024)), "esp32")
+    assert store.evict("esp32", max_mb=0.01) == 1
+    assert [x['zip_name'] for x in store.list_releases("esp32")] == ["fw_2.zip"]
+
+def test_garbage_collection_grace( tmp_path, store, monkeypatch ):
+    ''' Unused objects are only deleted once older than the grace period '''
+    store.add_release(_make_release(tmp_path, "fw_1.zip", b"one" * 1000), "esp32")
+    os.remove( store._manifest_path("esp32", "fw_1.zip") ) #pylint: disable=W0212
+    assert store.collect_garbage() == 0
+    monkeypatch.setattr(release_store, 'GC_GRACE_SECONDS', -1e9)
+    assert store.collect_garbage() > 0
+    assert _object_count(store) == 0
@@ -0,0 +1,80 @@
+'''
+    Release zip assembly: members written straight from the sources must read back intact
+'''
+# ------------------
+# Importing Modules
+# ------------------
+import os
+import zipfile
+import pytest
+import fake_env
+import release_tools
+
+# ------------------
+# Fixtures
+# ------------------
+@pytest.fixture
+def sources( tmp_path ):
+    ''' Files to package: synthetic firmware, random, repetitive, empty, and a zip to copy from '''
+    files = {
+        'firmware.bin' : None,
+        'random.bin'   : os.urandom(512 * 1024),
+        'text.txt'     : b"repetitive line\n" * 4096,
+        'empty.txt'    : b"",
+    }
+    fake_env.write_synthetic_file(str(tmp_path / "firmware.bin"), 3 * fake_env.MB)
+    for name, data in files.items():
+        if data is not None:
+            (tmp_path / name).write_bytes(data)
+    with zipfile.ZipFile(tmp_path / "other.zip", 'w', zipfile.ZIP_DEFLATED) as ziph:
+        ziph.writestr("inner/info.json", '{"board": "esp32"}')
+    return tmp_path
+
+# ------------------
+# Tests
+# ------------------
+@pytest.mark.parametrize("method", list(release_tools.COMPRESSION_METHODS))
+def test_write_round_trip( sources, monkeypatch, method ):
+    ''' Every member reads back with a valid CRC, streamed in chunks smaller than the files '''
+    monkeypatch.setattr(release_tools, 'STREAM_CHUNK_SIZE', 64 * 1024)
+    monkeypatch.setattr(release_tools, 'SPOOL_MAX_SIZE', 256 * 1024)
+    manifest = release_tools.ReleaseManifest()
+    for name in ['firmware.bin', 'random.bin', 'text.txt', 'empty.txt']:
+        manifest.add_file(str(sources / name), "release/" + name)
+    manifest.add_bytes("release/version.txt", "1.2.3")
+    manifest.add_zip_members(str(sources / "other.zip"), "release")
+    zip_path = str(sources / "release.zip")
+    stats = manifest.write(zip_path, method, workers=2)
+
+    assert stats['members'] == 6
+    assert stats['compress_size'] <= os.path.getsize(zip_path)
+    with zipfile.ZipFile(zip_path) as ziph:
+        assert ziph.testzip() is None
+        for name in ['firmware.bin', 'random.bin', 'text.txt', 'empty.txt']:
+            assert ziph.read("release/" + name) == (sources / name).read_bytes()
+        assert ziph.read("release/version.txt") == b"1.2.3"
+        assert ziph.read("release/inner/info.json") == b'{"board": "esp32"}'
+        infos = {x.filename: x for x in ziph.infolist()}
+    assert infos["release/random.bin"].compress_type == zipfile.ZIP_STORED
+    if method != 'stored':
+        assert infos["release/text.txt"].compress_type == release_tools.COMPRESSION_METHODS[method]
+
+def test_streamed_compression_matches_one_shot( sources, monkeypatch ):
+    ''' Compressing in chunks gives the same bytes as compressing the whole file at once '''
+    monkeypatch.setattr(release_tools, 'STREAM_CHUNK_SIZE', 4096)
+    compression = release_tools.CompressionSettings('deflate', 9)
+    _, zinfo, raw_file = release_tools._prepare_file_member( #pylint: disable=W0212
+        "text.txt", str(sources / "text.txt"), compression)
+    with raw_file:
+        assert raw_file.read() == compression.compress((sources / "text.txt").read_bytes())
+    assert zinfo.file_size == os.path.getsize(sources / "text.txt")
+
+def test_incompressible_file_is_not_compressed( sources ):
+    ''' Random data is detected from samples and stored from its source path '''
+    compression = release_tools.CompressionSettings('lzma')
+    with open(sources / "random.bin", 'rb') as file:
+        assert release_tools.is_file_incompressible(file, os.path.getsize(sources / "random.bin"))
+    _, zinfo, raw_data = release_tools._prepare_file_member( #pylint: disable=W0212
+        "random.bin", str(sources / "random.bin"), compression)
+    assert raw_data == str(sources / "random.bin")
+    assert zinfo.compress_type == zipfile.ZIP_STORED
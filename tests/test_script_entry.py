@@ -0,0 +1,71 @@
+'''
+    Entry layer of the extra scripts: nothing heavy is imported when there is nothing
+    to do (the IDE asking for "idedata", a clean)
+'''
+# ------------------
+# Importing Modules
+# ------------------
+import sys
+import json
+import subprocess
+import pytest
+import conftest
+
+# ------------------
+# Constants
+# ------------------
+# Runs inside a new interpreter (like each SCons process): argv is script, targets, clean,
+# repository and benchmarks folders. Prints the repository modules the script imported
+CHILD_CODE = r'''
+import io, os, sys, json, types, contextlib
+script, targets, clean, repo_folder, bench_folder = sys.argv[1:6]
+sys.path[:0] = [repo_folder, bench_folder]
+import fake_env
+class CleanEnv(fake_env.FakeEnv):
+    def GetOption(self, name):
+        return ( name == 'clean' ) and ( clean == "1" )
+env     = CleanEnv(PIOENV="test", BUILD_DIR=os.path.join(os.getcwd(), ".pio", "build", "test"))
+exports = {'env': env, 'projenv': env}
+def Import(*names):
+    sys._getframe(1).f_globals.update({x: exports[x] for x in names})
+sys.modules.update(fake_env.get_scons_modules([x for x in targets.split(",") if x]))
+sys.modules["SCons.Script"].Import = Import
+repo_modules = {x[:-3] for x in os.listdir(repo_folder) if x.endswith(".py")}
+before       = set(sys.modules)
+script_path  = os.path.join(repo_folder, script)
+with contextlib.redirect_stdout(io.StringIO()):
+    with open(script_path, 'r', encoding='UTF-8') as file:
+        exec(compile(file.read(), script_path, 'exec'), {'__file__': script_path, '__name__': 'SCons.Script'})
+print(json.dumps(sorted((set(sys.modules) - before) & repo_modules)))
+'''
+
+# ------------------
+# Functions
+# ------------------
+def _imported_modules( cwd, script:str, targets:list, clean:bool = False ) -> list:
+    ''' Run script in a new interpreter, returns the repository modules it imported '''
+    output = subprocess.run([sys.executable, "-c", CHILD_CODE, script, ",".join(targets), "1" if clean else "0",
+                             conftest.REPO_FOLDER, conftest.BENCH_FOLDER],
+                            stdout=subprocess.PIPE, check=True, cwd=str(cwd)).stdout
+    return json.loads(output.decode('UTF-8').strip().splitlines()[-1])
+
+# ------------------
+# Tests
+# ------------------
+@pytest.mark.parametrize("script, targets", [
+    ("pre_extra_script.py" , ["idedata"]),
+    ("pre_extra_script.py" , ["debug"]),
+    ("post_extra_script.py", ["idedata"]),
+])
+def test_noop_imports_entry_layer_only(tmp_path, script, targets):
+    ''' Runs with nothing to do import script_entry only '''
+    assert _imported_modules(tmp_path, script, targets) == ["script_entry"]
+
+def test_clean_imports_package_scheduler_only(tmp_path):
+    ''' A clean only checks the packaging lock of the env '''
+    assert _imported_modules(tmp_path, "pre_extra_script.py", [], clean=True) == \
+        ["package_scheduler", "script_entry"]
+
+def test_build_imports_firmware_manager(tmp_path):
+    ''' The post script of a build registers its actions '''
+    assert "firmware_manager" in _imported_modules(tmp_path, "post_extra_script.py", [])
@@ -0,0 +1,87 @@
+'''
+    Differential flashing: writing the ranges found changed must reproduce the image
+'''
+# ------------------
+# Importing Modules
+# ------------------
+import random
+import hashlib
+import pytest
+import sector_tools
+
+# ------------------
+# Constants
+# ------------------
+SECTOR     = sector_tools.SECTOR_SIZE
+APP_OFFSET = 0x10000
+
+# ------------------
+# Functions
+# ------------------
+def _image( size:int, seed:int ) -> bytearray:
+    ''' Random image '''
+    rng = random.Random(seed)
+    return bytearray( rng.getrandbits(8 * size).to_bytes(size, 'little') )
+
+def _flash( tmp_path, old:bytes, new:bytes ) -> tuple:
+    ''' Write only the changed ranges of new over a device holding old at APP_OFFSET,
+        returns (device flash, changed ranges, read_md5 calls) '''
+    (tmp_path / "firmware.bin").write_bytes(new)
+    manifest = sector_tools.create_manifest([ (APP_OFFSET, str(tmp_path / "firmware.bin")) ])
+    device   = bytearray(b"\xff" * APP_OFFSET) + bytearray(old)
+    calls    = []
+    def _read_md5( address:int, size:int ) -> str:
+        calls.append( (address, size) )
+        return hashlib.md5(device[address : address + size]).hexdigest()
+    changed = sector_tools.find_changed_regions(manifest, _read_md5)
+    for image, start, end in changed:
+        assert start % SECTOR == 0
+        assert( ( end % SECTOR == 0 ) or ( end == image['size'] ) )
+        device[image['offset'] + start : image['offset'] + end] = new[start:end]
+    return device, [ (start, end) for _, start, end in changed ], calls
+
+# ------------------
+# Tests
+# ------------------
+@pytest.mark.parametrize("seed", range(5))
+def test_patching_changed_ranges_reproduces_image(tmp_path, seed):
+    ''' Bytes flipped anywhere: only the sectors holding them are written '''
+    rng = random.Random(seed)
+    old = _image(300 * 1024 + rng.randrange(1, SECTOR), seed)
+    new = bytearray(old)
+    flipped = { rng.randrange(len(new)) for _ in range(rng.randrange(1, 20)) }
+    for position in flipped:
+        new[position] ^= 0xff
+    device, changed, _ = _flash(tmp_path, old, new)
+    assert device[APP_OFFSET:] == new
+    assert sum(end - start for start, end in changed) <= len({x // SECTOR for x in flipped}) * SECTOR
+
+def test_short_tail_sector(tmp_path):
+    ''' The last sector of an image is shorter than 4 KB '''
+    old = _image(2 * sector_tools.BLOCK_SIZE + 1000, 7)
+    new = bytearray(old)
+    new[-1] ^= 0xff
+    device, changed, _ = _flash(tmp_path, old, new)
+    assert changed == [ (2 * sector_tools.BLOCK_SIZE, len(new)) ]
+    assert device[APP_OFFSET:] == new
+
+def test_grown_image(tmp_path):
+    ''' An image longer than the one on the device '''
+    old = _image(10 * SECTOR, 8)
+    new = old + _image(3 * SECTOR + 10, 9)
+    device, changed, _ = _flash(tmp_path, old, new)
+    assert changed == [ (10 * SECTOR, len(new)) ]
+    assert device[APP_OFFSET:] == new
+
+def test_same_image(tmp_path):
+    ''' Nothing is written, and only the whole image is hashed on the device '''
+    old = _image(100 * 1024, 10)
+    _, changed, calls = _flash(tmp_path, old, old)
+    assert changed == []
+    assert calls == [ (APP_OFFSET, len(old)) ]
+
+def test_misaligned_offset(tmp_path):
+    ''' Images must start at a sector boundary '''
+    (tmp_path / "firmware.bin").write_bytes(b"\0" * 100)
+    with pytest.raises(ValueError, match="not sector aligned"):
+        sector_tools.create_manifest([ (APP_OFFSET + 0x100, str(tmp_path / "firmware.bin")) ])
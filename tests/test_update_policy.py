@@ -0,0 +1,90 @@
+'''
+    Firmware info update policy: decided once per "pio run", without blocking on a prompt
+'''
+# ------------------
+# Importing Modules
+# ------------------
+import io
+import time
+import pytest
+import fake_env
+import git_tools
+import update_policy
+
+# ------------------
+# Fixtures
+# ------------------
+@pytest.fixture
+def run( tmp_path, monkeypatch ):
+    ''' New "pio run" (run cache folder) on branch main, no NAVITAS_* overrides '''
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('NAVITAS_RUN_ID', "run-1")
+    for name in ["FMW_UPDATE_POLICY", "FMW_UPDATE_POLICY_BRANCHES", "FMW_UPDATE_PROMPT_TIMEOUT",
+                 "FMW_UPDATE_PROMPT_DEFAULT"]:
+        monkeypatch.delenv("NAVITAS_" + name, raising=False)
+    branch = {'name': "main"}
+    monkeypatch.setattr(git_tools, "get_git_branch", lambda: branch['name'])
+    return branch
+
+class _Terminal(io.StringIO):
+    ''' stdin of a terminal nobody answers '''
+    def isatty(self):
+        return True
+
+    def readline(self, *args):
+        time.sleep(2)
+        return "y\n"
+
+def _never_called():
+    ''' Tree state callback the policy must not need '''
+    raise AssertionError("not needed by the policy")
+
+# ------------------
+# Tests
+# ------------------
+@pytest.mark.parametrize("branch, expected", [
+    ("main"        , update_policy.POLICY_ON_NEW_COMMIT),
+    ("release/1.2" , update_policy.POLICY_NEVER),
+    ("feature/x"   , update_policy.POLICY_ALWAYS),
+])
+def test_branch_rules(run, branch, expected):
+    ''' The first matching branch rule overrides custom_fmw_update_policy '''
+    run['name'] = branch
+    env = fake_env.FakeEnv({'custom_fmw_update_policy': 'always',
+                            'custom_fmw_update_policy_branches': "main:on-new-commit, release/*:never\nmain:never"})
+    assert update_policy.get_policy(env) == expected
+
+def test_unknown_policy(run):
+    ''' Unknown policies fall back to the default, "_" is accepted for "-" '''
+    assert update_policy.get_policy(fake_env.FakeEnv({'custom_fmw_update_policy': 'sometimes'})) == \
+        update_policy.DEFAULT_POLICY
+    assert update_policy.get_policy(fake_env.FakeEnv({'custom_fmw_update_policy': 'ON_DIRTY_TREE'})) == \
+        update_policy.POLICY_ON_DIRTY_TREE
+
+@pytest.mark.parametrize("default, expected", [("y", True), ("n", False)])
+def test_prompt_without_terminal(run, monkeypatch, default, expected):
+    ''' Without a terminal the prompt answers custom_fmw_update_prompt_default '''
+    monkeypatch.setattr("sys.stdin", io.StringIO("y\n"))
+    env = fake_env.FakeEnv({'custom_fmw_update_prompt_default': default})
+    assert update_policy.decide(env, _never_called, _never_called) is expected
+
+def test_prompt_timeout(run, monkeypatch):
+    ''' A terminal nobody answers gets the default after the timeout '''
+    monkeypatch.setattr("sys.stdin", _Terminal())
+    start = time.monotonic()
+    assert update_policy.ask_with_timeout("Update?", 0.1, "n") == "n"
+    assert time.monotonic() - start < 1.0
+
+def test_decision_shared_by_the_run(run, monkeypatch):
+    ''' Every env of a "pio run" reuses the first decision, a new run decides again '''
+    dirty = {'calls': 0}
+    def _is_dirty_tree():
+        dirty['calls'] += 1
+        return True
+    env = fake_env.FakeEnv({'custom_fmw_update_policy': 'on-dirty-tree'})
+    assert update_policy.decide(env, _is_dirty_tree, _never_called) is True
+    other_env = fake_env.FakeEnv({'custom_fmw_update_policy': 'never'})
+    assert update_policy.decide(other_env, _never_called, _never_called) is True
+    assert dirty['calls'] == 1
+    monkeypatch.setenv('NAVITAS_RUN_ID', "run-2")
+    assert update_policy.decide(other_env, _never_called, _never_called) is False
@@ -0,0 +1,81 @@
+'''
+    Multi-board upload runner: boards pass only when what they hold matches firmware.md5
+'''
+# ------------------
+# Importing Modules
+# ------------------
+import os
+import sys
+import hashlib
+import pytest
+import upload_runner
+import firmware_manager
+import pio_tools
+import fake_env
+
+# ------------------
+# Constants
+# ------------------
+RUNNER  = os.path.abspath(upload_runner.__file__)
+# Copy what the fake board holds into {readback}, like "dump_image" of openocd
+READ_BACK = ['{python}', '-c', 'import shutil, sys; shutil.copyfile(sys.argv[1], sys.argv[2])',
+             'boards/{target}.bin', '{readback}']
+
+# ------------------
+# Fixtures
+# ------------------
+@pytest.fixture
+def release( tmp_path, monkeypatch ):
+    ''' Extracted release: firmware.bin and firmware.md5 '''
+    monkeypatch.chdir(tmp_path)
+    fake_env.write_synthetic_file(str(tmp_path / "firmware.bin"), 64 * 1024)
+    (tmp_path / "firmware.md5").write_text(hashlib.md5((tmp_path / "firmware.bin").read_bytes()).hexdigest())
+    (tmp_path / "boards").mkdir()
+    return tmp_path
+
+def _run( verify, targets=("A", "B") ) -> dict:
+    ''' Flash the fake boards '''
+    config = {'firmware': "firmware.bin", 'verify': verify,
+              'command': [sys.executable, RUNNER, 'fake-upload', 'boards', '{target}', '{firmware}']}
+    return upload_runner.run_boards(config, list(targets), 2, 60, "report.json")
+
+# ------------------
+# Tests
+# ------------------
+def test_read_back_verify(release):
+    ''' The image read back into {readback} is compared, then removed '''
+    (release / "boards" / "B.corrupt").touch()
+    report = _run(READ_BACK)
+    assert [ (x['target'], x['result'], x['verified']) for x in report['boards'] ] == [
+        ("A", "pass", True), ("B", "fail", False) ]
+    assert report['boards'][1]['stage'] == "verify"
+    assert not [ x for x in os.listdir(release / "report") if x.endswith(".readback.bin") ]
+
+def test_printed_md5_verify(release):
+    ''' A verify command printing the MD5 of the board '''
+    report = _run([sys.executable, RUNNER, 'fake-md5', 'boards', '{target}'])
+    assert (report['passed'], report['not_verified']) == (2, 0)
+
+def test_without_verify_is_not_verified(release):
+    ''' Boards only uploaded pass, but are reported as not verified '''
+    report = _run(None)
+    assert (report['passed'], report['not_verified']) == (2, 2)
+    assert not any( x['verified'] for x in report['boards'] )
+
+def test_openocd_config_reads_image_back(tmp_path, monkeypatch):
+    ''' openocd boards are verified by reading the image back from its flash address '''
+    fmw_path = tmp_path / "firmware.bin"
+    fmw_path.write_bytes(b"\0" * 1000)
+    monkeypatch.setattr(pio_tools, "get_default_firmware_path", lambda env: str(fmw_path))
+    env = fake_env.make_openocd_env(str(tmp_path), str(tmp_path))
+    script_str = ( firmware_manager.REM_PIO_UPLOAD_START +
+                   'openocd -f interface/stlink.cfg -f target/stm32f4x.cfg '
+                   '-c "program {bin/firmware.bin} 0x08000000 verify reset; shutdown;"' +
+                   firmware_manager.REM_PIO_UPLOAD_END )
+    config = firmware_manager.get_upload_runner_config(env, script_str)
+    assert config['target_kind'] == upload_runner.TARGET_KIND_PROBE
+    assert config['verify'] == [
+        "openocd", "-f", "interface/stlink.cfg", "-f", "target/stm32f4x.cfg", "-c", "adapter serial {target}",
+        "-c", "init; reset halt; dump_image {{readback}} 0x08000000 1000; reset run; shutdown" ]
+    assert upload_runner.get_command(config['verify'], "X1", "firmware.bin", "out.bin")[-1] == \
+        "init; reset halt; dump_image {out.bin} 0x08000000 1000; reset run; shutdown"
@@ -0,0 +1,110 @@
+'''
+    Warm helper: scripts fall back to working in-process when it is not running, and
+    it stops when the scripts change or after being idle
+'''
+# ------------------
+# Importing Modules
+# ------------------
+import os
+import time
+import threading
+import subprocess
+import pytest
+import fake_env
+import git_tools
+import warm_helper
+
+pytestmark = pytest.mark.skipif(not hasattr(warm_helper._socket, 'AF_UNIX'), #pylint: disable=W0212
+                                reason="needs Unix domain sockets")
+
+# ------------------
+# Constants
+# ------------------
+START_TIMEOUT = 10.0
+
+# ------------------
+# Fixtures
+# ------------------
+@pytest.fixture
+def client( git_repo, monkeypatch ): #pylint: disable=W0613
+    ''' Enabled client of a new build script process, starting helpers is recorded only '''
+    monkeypatch.setattr(warm_helper, "_STATE", dict(warm_helper._STATE, available=None, spawned=False)) #pylint: disable=W0212
+    warm_helper.configure(True, 30)
+    spawned = []
+    popen   = subprocess.Popen
+    def _popen( args, *more, **kwargs ):
+        if( ( isinstance(args, list) ) and ( "serve" in args ) ):
+            return spawned.append(args)
+        return popen(args, *more, **kwargs)
+    monkeypatch.setattr(subprocess, "Popen", _popen)
+    return spawned
+
+@pytest.fixture
+def serve( client ): #pylint: disable=W0613
+    ''' Start warm_helper.serve() in a thread, returns the thread once the socket is up '''
+    threads = []
+    def _start( idle_timeout:float = 30 ) -> threading.Thread:
+        thread = threading.Thread(target=warm_helper.serve, args=(idle_timeout,), daemon=True)
+        thread.start()
+        threads.append(thread)
+        deadline = time.monotonic() + START_TIMEOUT
+        while not warm_helper.is_helper_running():
+            assert time.monotonic() < deadline, "warm helper did not start"
+            time.sleep(0.05)
+        return thread
+    yield _start
+    for thread in threads:
+        if thread.is_alive():
+            warm_helper._send({'op': 'stop', 'cwd': os.getcwd(), 'code': warm_helper.get_code_stamp()}) #pylint: disable=W0212
+        thread.join(START_TIMEOUT)
+
+# ------------------
+# Tests
+# ------------------
+def test_missing_socket_works_in_process(client):
+    ''' Without a helper the caller does the work, the helper is started once per process '''
+    assert not os.path.exists(warm_helper.HELPER_SOCKET_FILE)
+    assert warm_helper.request("git_snapshot") is None
+    assert warm_helper.request("pending_files") is None
+    assert len(client) == 1
+    assert client[0][-3:] == ["serve", "--idle", "30"]
+
+def test_stale_code_stamp_stops_helper(serve, client):
+    ''' A helper running other scripts does not answer and exits, a new one is started '''
+    thread = serve()
+    assert warm_helper.request("ping")['requests'] == 2
+    warm_helper._STATE.update(code_stamp="00000000", available=None) #pylint: disable=W0212
+    assert warm_helper.request("ping") is None
+    thread.join(START_TIMEOUT)
+    assert not thread.is_alive()
+    assert not os.path.exists(warm_helper.HELPER_SOCKET_FILE)
+    assert len(client) == 1
+
+def test_idle_timeout_exit(serve):
+    ''' The helper exits after idle_timeout seconds without requests '''
+    thread = serve(0.5)
+    assert warm_helper.request("ping") is not None
+    thread.join(START_TIMEOUT)
+    assert not thread.is_alive()
+    assert not os.path.exists(warm_helper.HELPER_SOCKET_FILE)
+
+def test_git_snapshot_follows_head_and_tags(git_repo, serve, monkeypatch):
+    ''' The Git snapshot is queried again only when HEAD, refs or tags change '''
+    queries = []
+    query   = git_tools._query_git_snapshot_with_backend #pylint: disable=W0212
+    def _counted_query():
+        queries.append(1)
+        return query()
+    monkeypatch.setattr(git_tools, "_query_git_snapshot_with_backend", _counted_query)
+    serve()
+    first = warm_helper.request("git_snapshot")
+    assert warm_helper.request("git_snapshot") == first
+    assert len(queries) == 1
+    (git_repo / "src" / "main.c").write_text("int main(void) { return 1; }\n")
+    fake_env.run_git(str(git_repo), 'commit', '-q', '-a', '-m', 'second')
+    second = warm_helper.request("git_snapshot")
+    assert second['commit'] != first['commit']
+    assert len(queries) == 2
+    fake_env.run_git(str(git_repo), 'tag', 'v1.2.3')
+    assert warm_helper.request("git_snapshot")['version'] != second['version']
+    assert len(queries) == 3
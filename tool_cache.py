@@ -0,0 +1,104 @@
+'''
+    PlatformIO Advanced Script for NavitasTecnologia
+    See: https://docs.platformio.org/en/latest/scripting/actions.html
+
+    Cache of uploader tool packages (tool-esptoolpy, tool-openocd, ...), each one
+    stored once as a precompressed zip and spliced into releases by raw member copy.
+'''
+# pylint: disable=broad-except
+# ------------------
+# Importing Modules
+# ------------------
+import os
+import json
+import time
+from hashlib import sha1
+import release_tools
+import warm_helper
+
+# ------------------
+# Constants
+# ------------------
+TOOL_CACHE_MAX_AGE_DAYS   = 30
+TOOL_CACHE_MAX_PER_NAME   = 3
+TOOL_PACKAGE_MANIFESTS    = ["package.json", ".piopm"]
+
+# ------------------
+# Functions
+# ------------------
+def get_tool_bundle_key( tool_dir:str, method, level ):
+    ''' Get (package name, bundle key) from the package manifest, or from a tree walk '''
+    tool_dir = os.path.realpath(tool_dir)
+    if not any( os.path.isfile(os.path.join(tool_dir, x)) for x in TOOL_PACKAGE_MANIFESTS ):
+        warm = warm_helper.request("tool_bundle_key", tool_dir=tool_dir, method=method, level=level)
+        if warm is not None:
+            return tuple(warm)
+    name     = os.path.basename(tool_dir)
+    version  = ''
+    key_hash = sha1( f"{tool_dir}|{method}|{level}".encode() )
+    manifests_found = 0
+    for manifest in TOOL_PACKAGE_MANIFESTS:
+        manifest_path = os.path.join(tool_dir, manifest)
+        if not os.path.isfile(manifest_path):
+            continue
+        with open(manifest_path, 'rb') as file:
+            content = file.read()
+        key_hash.update(content)
+        manifests_found += 1
+        try:
+            data     = json.loads(content)
+            name     = data.get('name', name)
+            version  = data.get('version', version)
+        except Exception:
+            pass
+    if manifests_found == 0:
+        # No manifest, the whole tree identifies the package
+        for root, _, files in os.walk(tool_dir):
+            for file in sorted(files):
+                stat = os.stat(os.path.join(root, file))
+                key_hash.update(f"{os.path.join(root, file)}|{stat.st_size}|{stat.st_mtime_ns}".encode())
+    name = "".join(c if ( c.isalnum() or c in '-_.' ) else '_' for c in name)
+    version = "".join(c if ( c.isalnum() or c in '-_.+' ) else '_' for c in str(version))
+    return name, f"{version or 'unknown'}-{key_hash.hexdigest()[:12]}"
+
+def get_tool_bundle( tool_dir:str, cache_folder:str, method=None, level=None ) -> str:
+    ''' Get path of the precompressed bundle of a tool package, creating it if needed '''
+    name, key   = get_tool_bundle_key(tool_dir, method, level)
+    name_folder = os.path.join(cache_folder, name)
+    bundle_path = os.path.join(name_folder, key + ".zip")
+    if os.path.isfile(bundle_path):
+        os.utime(bundle_path)
+        return bundle_path
+
+    print(f"\t>> Caching tool package '{name}' ({key})")
+    os.makedirs(name_folder, exist_ok=True)
+    bundle = release_tools.ReleaseManifest()
+    bundle.add_tree(tool_dir, '')
+    bundle.write(bundle_path, method, level)
+    evict_tool_bundles(name_folder, keep=bundle_path)
+    return bundle_path
+
+def add_tool_bundle( p_release, tool_dir:str, arc_prefix:str, cache_folder:str, method=None, level=None ):
+    ''' Add a tool package to a release from the cache, or straight from disk on failure '''
+    try:
+        bundle_path = get_tool_bundle(tool_dir, cache_folder, method, level)
+        p_release.add_zip_members(bundle_path, arc_prefix)
+    except Exception as excep:
+        print(f'Failed to use tool cache for {tool_dir}. Reason: {excep}')
+        p_release.add_tree(tool_dir, arc_prefix)
+
+def evict_tool_bundles( name_folder:str, keep:str = '' ):
+    ''' Delete bundles unused for too long, keeping only the most recently used ones '''
+    bundles = []
+    for file_name in os.listdir(name_folder):
+        file_path = os.path.join(name_folder, file_name)
+        if( file_name.endswith('.zip') and ( file_path != keep ) ):
+            bundles.append( (os.path.getmtime(file_path), file_path) )
+    bundles.sort(reverse=True)
+    max_age = time.time() - TOOL_CACHE_MAX_AGE_DAYS * 24 * 3600
+    for i, (last_use, file_path) in enumerate(bundles):
+        if( ( i >= TOOL_CACHE_MAX_PER_NAME - 1 ) or ( last_use < max_age ) ):
+            try:
+                os.remove(file_path)
+            except Exception as excep:
+                print(f'Failed to delete {file_path}. Reason: {excep}')
@@ -0,0 +1,97 @@
+'''
+    PlatformIO Advanced Script for NavitasTecnologia
+    See: https://docs.platformio.org/en/latest/scripting/actions.html
+
+    Decides, once per "pio run", if the firmware info is updated before building.
+'''
+# pylint: disable=broad-except
+# ------------------
+# Importing Modules
+# ------------------
+import sys
+import fnmatch
+import threading
+import pio_tools
+import git_tools
+
+# ------------------
+# Constants
+# ------------------
+POLICY_PROMPT          = "prompt"
+POLICY_ALWAYS          = "always"
+POLICY_NEVER           = "never"
+POLICY_ON_DIRTY_TREE   = "on-dirty-tree"
+POLICY_ON_NEW_COMMIT   = "on-new-commit"
+POLICIES               = [POLICY_PROMPT, POLICY_ALWAYS, POLICY_NEVER,
+                          POLICY_ON_DIRTY_TREE, POLICY_ON_NEW_COMMIT]
+DEFAULT_POLICY         = POLICY_PROMPT
+DEFAULT_PROMPT_TIMEOUT = 0      # seconds, 0 waits forever
+DEFAULT_PROMPT_ANSWER  = "n"
+UPDATE_DECISION_CACHE  = "update_decision"
+
+# ------------------
+# Functions
+# ------------------
+def get_policy( env ) -> str:
+    ''' Get policy from custom_fmw_update_policy, or from a custom_fmw_update_policy_branches match '''
+    policy   = pio_tools.get_project_option(env, "custom_fmw_update_policy", DEFAULT_POLICY)
+    branches = pio_tools.get_project_option(env, "custom_fmw_update_policy_branches", "")
+    branch   = git_tools.get_git_branch()
+    # e.g. "main:on-new-commit, release/*:never"
+    for rule in str(branches or "").replace("\n", ",").split(","):
+        pattern, _, branch_policy = rule.strip().rpartition(":")
+        if( pattern and fnmatch.fnmatch(branch, pattern.strip()) ):
+            policy = branch_policy
+            break
+    policy = str(policy).strip().lower().replace("_", "-")
+    if policy not in POLICIES:
+        print(f'\tUnknown firmware update policy "{policy}", using "{DEFAULT_POLICY}"')
+        policy = DEFAULT_POLICY
+    return policy
+
+def ask_with_timeout( question:str, timeout:float, default:str ) -> str:
+    ''' Ask question on the terminal, returning default after timeout seconds (0 waits forever) '''
+    if not sys.stdin or not sys.stdin.isatty():
+        print(f"{question} (no terminal, answering '{default}')")
+        return default
+    if timeout <= 0:
+        print(question)
+        return input()
+    answer = []
+    print(f"{question} (answering '{default}' in {timeout:g} s)")
+    reader = threading.Thread(target=lambda: answer.append(sys.stdin.readline()), daemon=True)
+    reader.start()
+    reader.join(timeout)
+    if len(answer) == 0:
+        print(f"\tNo answer, using '{default}'")
+        return default
+    return answer[0]
+
+def decide( env, is_dirty_tree, is_new_commit ) -> bool:
+    ''' Decide if firmware info is updated, sharing the decision with every env of this "pio run" '''
+    cached = pio_tools.load_run_cache(UPDATE_DECISION_CACHE)
+    if isinstance(cached, dict):
+        print(f"\tUpdate firmware info: {'yes' if cached['update'] else 'no'} "
+              f"(decided by \"{cached['policy']}\" earlier in this run)")
+        return cached['update']
+
+    policy = get_policy(env)
+    if policy == POLICY_ALWAYS:
+        update = True
+    elif policy == POLICY_NEVER:
+        update = False
+    elif policy == POLICY_ON_DIRTY_TREE:
+        update = is_dirty_tree()
+    elif policy == POLICY_ON_NEW_COMMIT:
+        update = is_new_commit()
+    else:
+        timeout = float(pio_tools.get_project_option(env, "custom_fmw_update_prompt_timeout",
+                                                     DEFAULT_PROMPT_TIMEOUT) or 0)
+        default = str(pio_tools.get_project_option(env, "custom_fmw_update_prompt_default",
+                                                   DEFAULT_PROMPT_ANSWER) or DEFAULT_PROMPT_ANSWER)
+        answer  = ask_with_timeout("\tUpdate firmware info? [y/n]", timeout, default)
+        update  = answer.lower().strip().startswith('y')
+    if policy != POLICY_PROMPT:
+        print(f"\tUpdate firmware info: {'yes' if update else 'no'} (policy \"{policy}\")")
+    pio_tools.save_run_cache(UPDATE_DECISION_CACHE, {'policy': policy, 'update': update})
+    return update
@@ -0,0 +1,280 @@
+'''
+    PlatformIO Advanced Script for NavitasTecnologia
+    See: https://docs.platformio.org/en/latest/scripting/actions.html
+
+    Multi-board upload runner, standalone (bundled in release zips): flashes many
+    boards at once with the upload command of upload_runner.json, verifies each
+    one against firmware.md5 and writes a pass/fail and timing report.
+    Usage: python upload_runner.py run [target ...] [-j 4] [--timeout 300] [--report report.json]
+                                       [--command "..."] [--verify-command "..."] [--fake <folder>]
+
+    Targets are serial ports (esptool) or probe serial numbers (openocd), every
+    USB port/probe found when none is given. Commands are argument lists with
+    {python}, {target}, {firmware} and {readback} placeholders. A verify command
+    prints the MD5 of what the board holds, or reads it back into {readback},
+    compared with firmware.md5. Boards without a verify command are reported as
+    passed with "verified": false.
+    "--fake <folder>" uploads to files inside folder instead of boards, to test a
+    fixture locally: <target>.fail makes the upload of target fail and
+    <target>.corrupt makes its verification fail.
+'''
+# pylint: disable=broad-except
+# ------------------
+# Importing Modules
+# ------------------
+import os
+import re
+import sys
+import json
+import time
+import shlex
+import hashlib
+import argparse
+import datetime
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# ------------------
+# Constants
+# ------------------
+RUNNER_CONFIG_FILE     = "upload_runner.json"
+RUNNER_CONFIG_VER      = 1
+FIRMWARE_MD5_FILE      = "firmware.md5"
+REPORTS_FOLDER         = "upload_reports"
+TARGET_KIND_PORT       = "port"
+TARGET_KIND_PROBE      = "probe"
+DEFAULT_JOBS           = 8
+DEFAULT_TIMEOUT        = 300     # seconds of each upload or verification
+FAKE_UPLOAD_DELAY      = 0.2
+STLINK_USB_VID         = 0x0483
+MD5_REGEX              = re.compile(r'\b[0-9a-fA-F]{32}\b')
+
+# ------------------
+# Targets
+# ------------------
+def find_targets( kind:str ) -> list:
+    ''' Get every USB serial port, or every ST-Link probe serial number '''
+    from serial.tools import list_ports #pylint: disable=C0415,E0401
+    ports = [x for x in list_ports.comports() if x.vid is not None]
+    if kind == TARGET_KIND_PROBE:
+        return sorted({ x.serial_number for x in ports if( ( x.vid == STLINK_USB_VID ) and x.serial_number ) })
+    return sorted( x.device for x in ports )
+
+def get_file_name( target:str ) -> str:
+    ''' Target as a file name (e.g. "/dev/ttyUSB0" -> "_dev_ttyUSB0") '''
+    return re.sub(r'[^A-Za-z0-9_.-]', '_', target)
+
+def get_command( template:list, target:str, firmware:str, readback:str = '' ) -> list:
+    ''' Fill placeholders of a command template '''
+    values = {'python': sys.executable, 'target': target, 'firmware': firmware, 'readback': readback}
+    return [ re.sub(r'\{(python|target|firmware|readback)\}', lambda x: values[x.group(1)], arg)
+             for arg in template ]
+
+def get_file_md5( file_path:str ) -> str:
+    ''' MD5 of a file, None if missing '''
+    md5 = hashlib.md5()
+    try:
+        with open(file_path, 'rb') as file:
+            for chunk in iter(lambda: file.read(1024 * 1024), b''):
+                md5.update(chunk)
+    except OSError:
+        return None
+    return md5.hexdigest()
+
+# ------------------
+# Runner
+# ------------------
+def run_step( command:list, timeout:float, log_file ) -> tuple:
+    ''' Run one command, logging its output, returns (return code, output, seconds) '''
+    log_file.write(f"$ {subprocess.list2cmdline(command)}\n")
+    start = time.perf_counter()
+    try:
+        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                timeout=timeout, check=False)
+        code, output = result.returncode, result.stdout.decode('UTF-8', 'replace')
+    except subprocess.TimeoutExpired as excep:
+        code, output = None, (excep.output or b'').decode('UTF-8', 'replace') + f"\nTimeout after {timeout} s\n"
+    except Exception as excep:
+        code, output = None, f"{excep}\n"
+    log_file.write(output)
+    log_file.flush()
+    return code, output, time.perf_counter() - start
+
+def flash_board( config:dict, target:str, expected_md5:str, timeout:float, log_path:str ) -> dict:
+    ''' Upload and verify one board '''
+    board = {'target': target, 'result': 'fail', 'stage': 'upload', 'upload_s': None, 'verify_s': None,
+             'returncode': None, 'md5': None, 'verified': False, 'log': log_path}
+    with open(log_path, 'w', encoding='UTF-8') as log_file:
+        code, _, board['upload_s'] = run_step( get_command(config['command'], target, config['firmware']),
+                                               timeout, log_file )
+        board['returncode'] = code
+        if code != 0:
+            return board
+        if config.get('verify'):
+            board['stage'] = 'verify'
+            readback = os.path.splitext(log_path)[0] + ".readback.bin"
+            code, output, board['verify_s'] = run_step(
+                get_command(config['verify'], target, config['firmware'], readback), timeout, log_file )
+            board['returncode'] = code
+            if any( '{readback}' in x for x in config['verify'] ):
+                board['md5'] = get_file_md5(readback)
+                if os.path.exists(readback):
+                    os.remove(readback)
+            else:
+                found = MD5_REGEX.findall(output)
+                board['md5'] = found[-1].lower() if found else None
+            if( ( code != 0 ) or ( board['md5'] != expected_md5 ) ):
+                return board
+            board['verified'] = True
+        board['result'], board['stage'] = 'pass', None
+    return board
+
+def run_boards( config:dict, targets:list, jobs:int, timeout:float, report_path:str ) -> dict:
+    ''' Flash every target with at most jobs boards at once, returns the report '''
+    with open(config['firmware'], 'rb') as file:
+        firmware_md5 = hashlib.md5(file.read()).hexdigest()
+    with open(FIRMWARE_MD5_FILE, 'r', encoding='UTF-8') as file:
+        expected_md5 = file.read().strip().lower()
+    if firmware_md5 != expected_md5:
+        raise RuntimeError(f"{config['firmware']} MD5 {firmware_md5} differs from {FIRMWARE_MD5_FILE} "
+                           f"{expected_md5}, extract the release zip again")
+
+    logs_folder = os.path.splitext(report_path)[0]
+    os.makedirs(logs_folder, exist_ok=True)
+    report = {
+        'version'  : RUNNER_CONFIG_VER,
+        'firmware' : config['firmware'],
+        'md5'      : expected_md5,
+        'started'  : datetime.datetime.now().isoformat(timespec='seconds'),
+        'jobs'     : jobs,
+        'boards'   : [],
+    }
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        futures = [ pool.submit(flash_board, config, target, expected_md5, timeout,
+                                os.path.join(logs_folder, get_file_name(target) + ".log")) for target in targets ]
+        for future in as_completed(futures):
+            board = future.result()
+            report['boards'].append(board)
+            timing = f"upload {board['upload_s']:.1f} s"
+            if board['verify_s'] is not None:
+                timing += f", verify {board['verify_s']:.1f} s"
+            failure = "" if board['result'] == 'pass' else f" at {board['stage']} (see {board['log']})"
+            if( ( board['result'] == 'pass' ) and ( not board['verified'] ) ):
+                failure = " (not verified)"
+            print(f"\t>> {board['target']}: {board['result'].upper()}{failure}, {timing}")
+    report['boards'].sort(key=lambda x: x['target'])
+    report['wall_s'] = time.perf_counter() - start
+    report['passed'] = sum( 1 for x in report['boards'] if x['result'] == 'pass' )
+    report['failed'] = len(report['boards']) - report['passed']
+    report['not_verified'] = sum( 1 for x in report['boards'] if( ( x['result'] == 'pass' ) and not x['verified'] ) )
+    with open(report_path, 'w', encoding='UTF-8') as file:
+        file.write( json.dumps(report, indent=4) )
+    return report
+
+# ------------------
+# Fake Uploader
+# ------------------
+def fake_upload( folder:str, target:str, firmware:str ) -> int:
+    ''' Write firmware into <folder>/<target>.bin, like a board would '''
+    time.sleep(FAKE_UPLOAD_DELAY)
+    name = os.path.join(folder, get_file_name(target))
+    if os.path.exists(name + ".fail"):
+        print(f"Failed to connect to {target}")
+        return 2
+    with open(firmware, 'rb') as file:
+        data = bytearray(file.read())
+    if( os.path.exists(name + ".corrupt") and data ):
+        data[len(data) // 2] ^= 0xff
+    with open(name + ".bin", 'wb') as file:
+        file.write(data)
+    print(f"Wrote {len(data)} bytes to {target}")
+    return 0
+
+def fake_md5( folder:str, target:str ) -> int:
+    ''' Print MD5 of what was written into <folder>/<target>.bin '''
+    with open(os.path.join(folder, get_file_name(target) + ".bin"), 'rb') as file:
+        print( hashlib.md5(file.read()).hexdigest() )
+    return 0
+
+# ------------------
+# Command Line
+# ------------------
+def run_main( args ) -> int:
+    ''' Flash every target '''
+    with open(RUNNER_CONFIG_FILE, 'r', encoding='UTF-8') as file:
+        config = json.loads(file.read())
+    if args.fake:
+        fake_folder = args.fake
+        os.makedirs(fake_folder, exist_ok=True)
+        this_file = os.path.abspath(__file__)
+        config['command'] = ['{python}', this_file, 'fake-upload', fake_folder, '{target}', '{firmware}']
+        config['verify']  = ['{python}', this_file, 'fake-md5', fake_folder, '{target}']
+    if args.command:
+        config['command'] = shlex.split(args.command)
+    if args.verify_command is not None:
+        config['verify'] = shlex.split(args.verify_command) or None
+    if not any('{target}' in x for x in config['command']):
+        print("ERROR: the upload command of this board has no {target}, flash one board with fmw_upload.bat")
+        return 2
+    targets = args.targets
+    if not targets:
+        try:
+            targets = find_targets( config.get('target_kind', TARGET_KIND_PORT) )
+        except ImportError:
+            print("ERROR: pyserial is needed to find the boards, give their serial ports or probe serial numbers")
+            return 2
+    if len(targets) == 0:
+        print("ERROR: no board found, give their serial ports or probe serial numbers")
+        return 2
+
+    report_path = args.report or os.path.join(
+        REPORTS_FOLDER, "upload_" + datetime.datetime.now().strftime("%Y%m%d-%H%M%S") + ".json" )
+    os.makedirs(os.path.dirname(os.path.abspath(report_path)), exist_ok=True)
+    print(f"\t>> Flashing {len(targets)} boards, {min(args.jobs, len(targets))} at once")
+    report = run_boards( config, targets, min(args.jobs, len(targets)), args.timeout, report_path )
+    not_verified = f" ({report['not_verified']} not verified)" if report['not_verified'] else ""
+    print(f"\t>> {report['passed']} passed{not_verified}, {report['failed']} failed in {report['wall_s']:.1f} s, "
+          f"report saved to {report_path}")
+    return 0 if report['failed'] == 0 else 1
+
+def main( argv ) -> int:
+    ''' Command line entry point '''
+    parser   = argparse.ArgumentParser(description="Flash many boards at once")
+    commands = parser.add_subparsers(dest="command_name")
+    run_parser = commands.add_parser("run", help="upload and verify every target")
+    run_parser.add_argument("targets", nargs="*", help="serial ports or probe serial numbers (default: every one found)")
+    run_parser.add_argument("-j", "--jobs", type=int, default=DEFAULT_JOBS, help="boards flashed at once")
+    run_parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT, help="seconds of each step")
+    run_parser.add_argument("--report", help=f"report path (default: {REPORTS_FOLDER}/upload_<date>.json)")
+    run_parser.add_argument("--command", help="upload command template, instead of the one of the build")
+    run_parser.add_argument("--verify-command", help="verify command template, printing the MD5 or reading the "
+                                                         "image back into {readback} (\"\" skips it)")
+    run_parser.add_argument("--fake", metavar="FOLDER", help="upload to files inside FOLDER instead of boards")
+    fake_upload_parser = commands.add_parser("fake-upload", help="fake uploader used by --fake")
+    fake_upload_parser.add_argument("folder")
+    fake_upload_parser.add_argument("target")
+    fake_upload_parser.add_argument("firmware")
+    fake_md5_parser = commands.add_parser("fake-md5", help="fake verifier used by --fake")
+    fake_md5_parser.add_argument("folder")
+    fake_md5_parser.add_argument("target")
+    args = parser.parse_args(argv)
+    if args.command_name == "fake-upload":
+        return fake_upload( args.folder, args.target, args.firmware )
+    if args.command_name == "fake-md5":
+        return fake_md5( args.folder, args.target )
+    if args.command_name == "run":
+        # Paths of the command line are relative to where it runs, commands to this folder
+        args.fake   = os.path.abspath(args.fake) if args.fake else None
+        args.report = os.path.abspath(args.report) if args.report else None
+        os.chdir( os.path.dirname(os.path.abspath(__file__)) )
+        return run_main(args)
+    parser.print_help()
+    return 2
+
+if __name__ == "__main__":
+    try:
+        sys.exit( main(sys.argv[1:]) )
+    except Exception as excep:
+        print("ERROR:", excep)
+        sys.exit(1)
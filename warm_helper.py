@@ -0,0 +1,324 @@
+'''
+    PlatformIO Advanced Script for NavitasTecnologia
+    See: https://docs.platformio.org/en/latest/scripting/actions.html
+
+    Warm helper: optional process that keeps the Git snapshot, the files pending
+    commit, file digests and tool bundle keys of a project in memory between
+    builds, answering the build scripts over a Unix domain socket under .pio/.
+    Its state is invalidated by file mtimes, scripts fall back to doing the work
+    themselves when it is not running, and it exits after being idle.
+    Usage: python warm_helper.py serve [--idle 900] | status | stop
+'''
+# pylint: disable=broad-except
+# ------------------
+# Importing Modules
+# ------------------
+import os
+import sys
+import json
+import time
+import zlib
+# The socket module costs more to import than a warm answer saves, the client uses its
+# built-in core (the helper itself uses socketserver)
+import _socket
+
+# ------------------
+# Constants
+# ------------------
+HELPER_SOCKET_FILE     = ".pio/navitas_helper.sock"
+HELPER_LOG_FILE        = ".pio/navitas_helper.log"
+DEFAULT_IDLE_TIMEOUT   = 900        # seconds without requests before the helper exits
+REQUEST_TIMEOUT        = 5.0
+MIN_REMOTE_DIGEST_SIZE = 256 * 1024 # smaller files are hashed faster than a round trip
+MAX_DIGESTS            = 4096
+MAX_REQUEST_SIZE       = 64 * 1024
+THIS_FOLDER            = os.path.dirname(os.path.realpath(__file__))
+
+# ------------------
+# Client
+# ------------------
+_STATE = {
+    'enabled'      : False,
+    'idle_timeout' : DEFAULT_IDLE_TIMEOUT,
+    'available'    : None,
+    'spawned'      : False,
+    'code_stamp'   : None,
+}
+
+def configure( enabled:bool, idle_timeout:float = DEFAULT_IDLE_TIMEOUT ):
+    ''' Enable requests to the helper (never inside the helper itself) '''
+    _STATE['enabled']      = bool(enabled) and hasattr(_socket, 'AF_UNIX')
+    _STATE['idle_timeout'] = idle_timeout
+
+def get_code_stamp() -> str:
+    ''' Identify the scripts: a helper running older scripts must not answer '''
+    if _STATE['code_stamp'] is None:
+        stamp = 0
+        for file_name in sorted(os.listdir(THIS_FOLDER)):
+            if file_name.endswith(".py"):
+                stat  = os.stat(os.path.join(THIS_FOLDER, file_name))
+                stamp = zlib.crc32(f"{file_name}|{stat.st_mtime_ns}|{stat.st_size}".encode(), stamp)
+        _STATE['code_stamp'] = f"{stamp:08x}"
+    return _STATE['code_stamp']
+
+def _send( message:dict, timeout:float = REQUEST_TIMEOUT ) -> dict:
+    ''' Send one request line and read the answer line '''
+    sock = _socket.socket(_socket.AF_UNIX, _socket.SOCK_STREAM)
+    try:
+        sock.settimeout(timeout)
+        sock.connect(HELPER_SOCKET_FILE)
+        sock.sendall( json.dumps(message).encode('UTF-8') + b"\n" )
+        chunks = []
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            if chunk.endswith(b"\n"):
+                break
+    finally:
+        sock.close()
+    return json.loads( b"".join(chunks).decode('UTF-8') )
+
+def request( op:str, **args ):
+    ''' Ask the helper, returns its answer or None when the caller shall do the work '''
+    if( ( not _STATE['enabled'] ) or ( _STATE['available'] is False ) ):
+        return None
+    try:
+        answer = _send( dict(args, op=op, cwd=os.getcwd(), code=get_code_stamp()) )
+    except (FileNotFoundError, ConnectionRefusedError):
+        # Not running (or crashed): this build works in-process, the next one finds it warm
+        _STATE['available'] = False
+        start_helper()
+        return None
+    except Exception as excep:
+        print(f'Failed to query the warm helper, working in-process. Reason: {excep}')
+        _STATE['available'] = False
+        return None
+    if not answer.get('ok'):
+        if answer.get('error') == 'stale':
+            _STATE['available'] = False
+            start_helper()
+        return None
+    _STATE['available'] = True
+    return answer['result']
+
+def start_helper():
+    ''' Start the helper in the background, once per process '''
+    if _STATE['spawned']:
+        return
+    _STATE['spawned'] = True
+    import subprocess #pylint: disable=C0415
+    try:
+        os.makedirs(os.path.dirname(HELPER_LOG_FILE), exist_ok=True)
+        with open(HELPER_LOG_FILE, 'ab') as log_file:
+            subprocess.Popen( #pylint: disable=R1732
+                [sys.executable, os.path.realpath(__file__), "serve", "--idle", str(_STATE['idle_timeout'])],
+                stdin=subprocess.DEVNULL, stdout=log_file, stderr=subprocess.STDOUT,
+                cwd=os.getcwd(), start_new_session=True )
+    except Exception as excep:
+        print(f'Failed to start the warm helper. Reason: {excep}')
+
+# ------------------
+# Helper
+# ------------------
+def _get_stat( path:str ):
+    ''' Get [mtime_ns, size, inode] or None if the path does not exist '''
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size, stat.st_ino]
+
+def get_git_stamp( git_tools ):
+    ''' Get stats of every file the Git snapshot is read from: HEAD, the branch ref, config,
+        packed refs and tag folders (adding or moving a tag changes its folder) '''
+    found = git_tools.find_git_dir()
+    if found is None:
+        return None
+    _, git_dir, common_dir = found
+    paths = [ os.path.join(git_dir, "HEAD"), os.path.join(common_dir, "config"),
+              os.path.join(common_dir, "packed-refs") ]
+    try:
+        with open(os.path.join(git_dir, "HEAD"), 'r', encoding='UTF-8') as file:
+            head = file.read().strip()
+        if head.startswith("ref:"):
+            paths.append( os.path.join(common_dir, head[4:].strip()) )
+    except OSError:
+        pass
+    for root, _, _ in os.walk( os.path.join(common_dir, "refs", "tags") ):
+        paths.append(root)
+    return [ [x, _get_stat(x)] for x in paths ]
+
+class WarmHelper:
+    ''' State kept warm between builds, one request at a time '''
+    def __init__(self, idle_timeout:float):
+        import threading #pylint: disable=C0415
+        import script_entry #pylint: disable=C0415
+        self.git_tools    = script_entry.LazyModule("git_tools")
+        self.change_tools = script_entry.LazyModule("change_tools")
+        self.hash_tools   = script_entry.LazyModule("hash_tools")
+        self.tool_cache   = script_entry.LazyModule("tool_cache")
+        self.lock         = threading.Lock()
+        self.stop_event   = threading.Event()
+        self.idle_timeout = idle_timeout
+        self.cwd          = os.getcwd()
+        self.code_stamp   = get_code_stamp()
+        self.started      = time.time()
+        self.last_used    = time.monotonic()
+        self.requests     = 0
+        self.git          = None
+        self.tool_keys    = {}
+
+    def answer( self, message:dict ) -> dict:
+        ''' Answer a request '''
+        with self.lock:
+            self.last_used = time.monotonic()
+            self.requests += 1
+            if message.get('code') != self.code_stamp:
+                # The scripts changed: stop answering, the client starts a new helper
+                self.stop()
+                return {'ok': False, 'error': 'stale'}
+            if message.get('cwd') != self.cwd:
+                return {'ok': False, 'error': f"serving {self.cwd}"}
+            handler = getattr(self, "op_" + str(message.get('op')), None)
+            if handler is None:
+                return {'ok': False, 'error': f"unknown request {message.get('op')}"}
+            try:
+                return {'ok': True, 'result': handler(message)}
+            except Exception as excep:
+                return {'ok': False, 'error': str(excep)}
+
+    def stop( self ):
+        ''' Stop accepting requests '''
+        remove_socket_file()
+        self.stop_event.set()
+
+    def op_ping( self, _ ) -> dict:
+        ''' Helper status '''
+        return {'pid': os.getpid(), 'started': self.started, 'requests': self.requests,
+                'idle_timeout': self.idle_timeout, 'digests': len(self.hash_tools._DIGEST_CACHE)} #pylint: disable=W0212
+
+    def op_stop( self, _ ) -> bool:
+        ''' Exit now '''
+        self.stop()
+        return True
+
+    def op_git_snapshot( self, _ ) -> dict:
+        ''' Git snapshot, queried again only when HEAD, refs, tags or config change '''
+        stamp = get_git_stamp(self.git_tools)
+        if( ( self.git is None ) or ( self.git[0] != stamp ) ):
+            snapshot = self.git_tools._query_git_snapshot_with_backend() #pylint: disable=W0212
+            self.git = (stamp, snapshot.as_dict())
+        return self.git[1]
+
+    def op_pending_files( self, _ ) -> list:
+        ''' Files pending commit, the incremental scan cache stays in memory '''
+        return self.change_tools.get_files_pending_commit(keep_in_memory=True)
+
+    def op_digests( self, message:dict ) -> dict:
+        ''' Digests of a file, hashed again only when its stat changes '''
+        if len(self.hash_tools._DIGEST_CACHE) > MAX_DIGESTS: #pylint: disable=W0212
+            self.hash_tools.clear_digest_cache()
+        return self.hash_tools.get_file_digests(message['path'])
+
+    def op_tool_bundle_key( self, message:dict ) -> list:
+        ''' Tool bundle key of a package without manifest, walked again only when the package
+            folder changes (PlatformIO installs and removes whole package folders) '''
+        tool_dir = os.path.realpath(message['tool_dir'])
+        key      = json.dumps([tool_dir, message.get('method'), message.get('level')])
+        stamp    = [ _get_stat(tool_dir) ] + [ _get_stat(os.path.join(tool_dir, x))
+                                               for x in self.tool_cache.TOOL_PACKAGE_MANIFESTS ]
+        cached   = self.tool_keys.get(key)
+        if( ( cached is not None ) and ( cached[0] == stamp ) ):
+            return cached[1]
+        value = list( self.tool_cache.get_tool_bundle_key(tool_dir, message.get('method'), message.get('level')) )
+        self.tool_keys[key] = (stamp, value)
+        return value
+
+def remove_socket_file():
+    ''' Delete the socket file, new clients find no helper '''
+    try:
+        os.remove(HELPER_SOCKET_FILE)
+    except OSError:
+        pass
+
+def is_helper_running() -> bool:
+    ''' Check if a helper answers on the socket of this project '''
+    try:
+        return bool( _send({'op': 'ping', 'cwd': os.getcwd(), 'code': get_code_stamp()}, 1.0).get('ok') )
+    except Exception:
+        return False
+
+def serve( idle_timeout:float = DEFAULT_IDLE_TIMEOUT ) -> int:
+    ''' Answer requests until idle for idle_timeout seconds '''
+    import threading #pylint: disable=C0415
+    import socketserver #pylint: disable=C0415
+    if is_helper_running():
+        print(f"Warm helper already running for {os.getcwd()}")
+        return 0
+    remove_socket_file()
+    os.makedirs(os.path.dirname(HELPER_SOCKET_FILE), exist_ok=True)
+    helper = WarmHelper(idle_timeout)
+
+    class _Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            line = self.rfile.readline(MAX_REQUEST_SIZE)
+            try:
+                answer = helper.answer( json.loads(line.decode('UTF-8')) )
+            except Exception as excep:
+                answer = {'ok': False, 'error': str(excep)}
+            self.wfile.write( json.dumps(answer).encode('UTF-8') + b"\n" )
+
+    server = socketserver.ThreadingUnixStreamServer(HELPER_SOCKET_FILE, _Handler)
+    server.daemon_threads = True
+
+    def _watch():
+        while not helper.stop_event.wait(min(1.0, idle_timeout)):
+            if time.monotonic() - helper.last_used > idle_timeout:
+                helper.stop()
+        server.shutdown()
+
+    threading.Thread(target=_watch, daemon=True).start()
+    print(f"{time.strftime('%Y-%m-%d %H:%M:%S')} Warm helper {os.getpid()} serving {os.getcwd()}, "
+          f"exits after {idle_timeout:g} s idle", flush=True)
+    try:
+        server.serve_forever(poll_interval=0.5)
+    finally:
+        server.server_close()
+        if not helper.stop_event.is_set():
+            remove_socket_file()
+    print(f"{time.strftime('%Y-%m-%d %H:%M:%S')} Warm helper {os.getpid()} exits after "
+          f"{helper.requests} requests", flush=True)
+    return 0
+
+# ------------------
+# Command Line
+# ------------------
+def main( argv ) -> int:
+    ''' Command line entry point '''
+    import argparse #pylint: disable=C0415
+    parser   = argparse.ArgumentParser(description="Warm helper of the build scripts")
+    commands = parser.add_subparsers(dest="command")
+    serve_parser = commands.add_parser("serve", help="answer the build scripts of the project in this folder")
+    serve_parser.add_argument("--idle", type=float, default=DEFAULT_IDLE_TIMEOUT, help="seconds idle before exiting")
+    commands.add_parser("status", help="show whether the helper is running")
+    commands.add_parser("stop", help="stop the helper")
+    args = parser.parse_args(argv)
+    sys.path.insert(0, THIS_FOLDER)
+    if args.command == "serve":
+        return serve(args.idle)
+    if args.command in ["status", "stop"]:
+        try:
+            answer = _send({'op': 'ping' if args.command == "status" else 'stop',
+                            'cwd': os.getcwd(), 'code': get_code_stamp()}, 1.0)
+        except Exception:
+            print("Warm helper not running")
+            return 1
+        print(json.dumps(answer.get('result', answer), indent=4))
+        return 0 if answer.get('ok') else 1
+    parser.print_help()
+    return 2
+
+if __name__ == "__main__":
+    sys.exit( main(sys.argv[1:]) )